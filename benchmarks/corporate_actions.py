@@ -0,0 +1,47 @@
+"""
+Measure parsing of a synthetic corporate actions section with all kinds of action descriptions the import understands, and some it doesn't.
+
+Example usage: python -m benchmarks.corporate_actions --actions 100000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from matchmaker import ibkr
+
+description_templates = [
+    '{symbol}(US{isin}) Split {new} for {old} ({symbol}, {name}, US{isin})',
+    '{symbol}(US{isin}) Spinoff  {new} for {old} ({target}, {name} SPINCO, US{isin}7)',
+    '{symbol}(US{isin}) Merged(Acquisition) FOR USD {price:.2f} PER SHARE',
+    '{symbol}(US{isin}) Merged(Acquisition) WITH US{isin}7 {new} for {old} ({target}, {name} HOLDINGS, US{isin}7)',
+    '{symbol}(US{isin}) Tendered to US{isin}9 1 for 1 ({symbol}.TEN, {name} - TENDER, US{isin}9)',
+    '{symbol}.DIVRT(NL{isin}) Expire Dividend Right',
+    'Change in description without a symbol',
+]
+
+def generate_actions(count: int, seed: int = 0) -> pd.DataFrame:
+    """ Corporate actions section as read from a statement, with descriptions picked at random from the templates. """
+    rng = np.random.default_rng(seed)
+    kinds = rng.integers(0, len(description_templates), count)
+    symbols = rng.integers(0, 2000, count)
+    descriptions = [description_templates[kind].format(symbol=f'S{symbol}', target=f'T{symbol}', isin=f'{symbol:09d}', name=f'SYNTHETIC {symbol}',
+                                                       new=rng.integers(1, 20), old=rng.integers(1, 20), price=rng.uniform(1, 200))
+                    for kind, symbol in zip(kinds, symbols)]
+    times = pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 3000 * 24 * 3600, count), unit='s')
+    return pd.DataFrame({'Corporate Actions': 'Corporate Actions', 'Header': 'Data', 'Asset Category': 'Stocks', 'Currency': 'USD',
+                         'Report Date': times.strftime('%Y-%m-%d'), 'Date/Time': times.strftime('%Y-%m-%d, %H:%M:%S'), 'Description': descriptions,
+                         'Quantity': rng.integers(-1000, 1000, count), 'Proceeds': 0, 'Value': 0, 'Realized P/L': 0, 'Code': ''})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure parsing of a synthetic corporate actions section.")
+    parser.add_argument("--actions", "-n", type=int, default=100000, help="Number of corporate actions")
+    parser.add_argument("--seed", "-s", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    section = generate_actions(args.actions, args.seed)
+    start = time.perf_counter()
+    parsed = ibkr.import_corporate_actions({'Corporate Actions': section})
+    elapsed = time.perf_counter() - start
+    print(f'{len(parsed)} actions parsed in {elapsed:.2f} s')
+    print(parsed['Action'].value_counts().to_string())
@@ -0,0 +1,73 @@
+"""
+Compare peak memory and runtime of reading the sections of an IBKR activity statement line by line into a dictionary of decoded lines,
+and of the single pass that keeps only the sections the importers use.
+The synthetic statement has trades and a configurable amount of sections that the import never reads.
+
+Example usage: python -m benchmarks.ibkr_parser --trades 100000 --unused 400000
+"""
+import argparse
+import io
+import time
+import tracemalloc
+import numpy as np
+from matchmaker import ibkr
+
+
+def generate_statement(trades: int, unused: int, seed: int = 0) -> bytes:
+    """ Activity statement with random stock trades and rows of sections that the import skips. """
+    rng = np.random.default_rng(seed)
+    lines = [
+        'Statement,Header,Field Name,Field Value',
+        'Statement,Data,BrokerName,Interactive Brokers',
+        'Statement,Data,Title,Activity Statement',
+        'Statement,Data,Period,"January 1, 2023 - December 31, 2023"',
+        'Account Information,Header,Field Name,Field Value',
+        'Account Information,Data,Account,U1234567',
+        'Net Asset Value,Header,Asset Class,Prior Total,Current Long,Current Short,Current Total,Change',
+    ]
+    lines += [f'Net Asset Value,Data,Stock,{i},{i},0,{i},0' for i in range(unused // 2)]
+    lines.append('Financial Instrument Information,Header,Asset Category,Symbol,Description,Conid,Security ID,Listing Exch,Multiplier,Type,Code')
+    lines += [f'Financial Instrument Information,Data,Stocks,S{i},SYNTHETIC COMPANY {i} INC,{100000 + i},US{i:010d},NASDAQ,1,COMMON,'
+              for i in range(unused - unused // 2)]
+    lines.append('Trades,Header,DataDiscriminator,Asset Category,Currency,Symbol,Date/Time,Quantity,T. Price,C. Price,Proceeds,Comm/Fee,Basis,Realized P/L,MTM P/L,Code')
+    seconds = np.sort(rng.integers(0, 365 * 24 * 3600, trades))
+    quantities = rng.integers(-50, 50, trades)
+    prices = np.round(rng.uniform(10, 500, trades), 2)
+    symbols = rng.integers(0, 500, trades)
+    for second, quantity, price, symbol in zip(seconds, quantities, prices, symbols):
+        moment = np.datetime64('2023-01-01T00:00:00') + np.timedelta64(int(second), 's')
+        date, clock = str(moment).split('T')
+        code = 'O' if quantity > 0 else 'C'
+        lines.append(f'Trades,Data,Order,Stocks,USD,S{symbol},"{date}, {clock}",{quantity},{price},{price},{-quantity * price:.2f},-1,0,0,0,{code}')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+def read_all_lines(file: io.BytesIO) -> dict:
+    """ The former path: decode every line, group them by section and read the needed sections. """
+    lines = ibkr.parse_csv_into_prefixed_lines(file)
+    return {section: ibkr.dataframe_from_prefixed_lines(lines, section) for section in ibkr.statement_sections}
+
+def measure(function, statement: bytes) -> tuple[float, float]:
+    """ Runtime in seconds and peak memory in MB allocated while parsing the statement. """
+    file = io.BytesIO(statement)
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(file)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2**20
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare peak memory and runtime of the IBKR statement parsers.")
+    parser.add_argument("--trades", "-n", type=int, default=100000, help="Number of trades in the statement")
+    parser.add_argument("--unused", "-u", type=int, default=400000, help="Number of rows of sections the import doesn't read")
+    parser.add_argument("--seed", "-s", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    statement = generate_statement(args.trades, args.unused, args.seed)
+    print(f'Statement of {len(statement) / 2**20:.1f} MB, {args.trades} trades, {args.unused} unused rows')
+    print(f'{"Parser":16} {"Time [s]":>9} {"Peak [MB]":>10}')
+    for name, function in [('All lines', read_all_lines), ('Single pass', ibkr.parse_statement_sections)]:
+        elapsed, peak = measure(function, statement)
+        print(f'{name:16} {elapsed:9.2f} {peak:10.1f}')
@@ -0,0 +1,55 @@
+"""
+Compare taxable revenue and runtime of the pairing strategies on a synthetic trade history of one symbol.
+Trades are generated as a random walk of prices with buys and partial sells, occasionally closing the whole position.
+
+Example usage: python -m benchmarks.pairing_strategies --trades 2000 --close-probability 0.03
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from matchmaker import lots
+from matchmaker import pairing
+
+
+def generate_trades(count: int, close_probability: float, seed: int = 0) -> pd.DataFrame:
+    """ Random history of buys and sells of a single stock, with the quantities already filled in for pairing. """
+    rng = np.random.default_rng(seed)
+    times = pd.Timestamp('2012-01-01').value + np.cumsum(rng.integers(0, 3 * 24 * 3600 * 10**9, count))
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, count)))
+    sizes = rng.integers(1, 20, count).astype(float)
+    position = 0.0
+    quantities, actions = [], []
+    for size in sizes:
+        if position > 0 and rng.random() < 0.45:
+            quantity = position if rng.random() < close_probability else min(size, position)
+            quantities.append(-quantity)
+            actions.append('Close')
+            position -= quantity
+        else:
+            quantities.append(size)
+            actions.append('Open')
+            position += size
+    quantities = np.array(quantities)
+    dates = pd.to_datetime(times)
+    trades = pd.DataFrame({'Display Name': 'SYNTH', 'Currency': 'USD', 'Date/Time': dates, 'Year': dates.year, 'Quantity': quantities, 'T. Price': prices,
+                           'Proceeds': -quantities * prices, 'Comm/Fee': -1.0, 'Action': actions, 'Type': 'Long', 'Option Type': np.nan})
+    return pairing.fill_trades_covered_quantity(trades, None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare taxable revenue and runtime of the pairing strategies on synthetic trades.")
+    parser.add_argument("--trades", "-n", type=int, default=2000, help="Number of trades to generate")
+    parser.add_argument("--close-probability", "-c", type=float, default=0.03, help="Probability that a sell closes the whole position")
+    parser.add_argument("--seed", "-s", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    trades = generate_trades(args.trades, args.close_probability, args.seed)
+    print(f'{len(trades)} trades, {(trades["Action"] == "Close").sum()} sells, at most {lots.longest_open_stretch(trades)} trades in a row without closing the position')
+    print(f'{"Strategy":12} {"Time [s]":>9} {"Taxable revenue":>16} {"Exempt revenue":>15} {"Paired":>9}')
+    for strategy in pairing.Pairings.strategies[1:]:
+        start = time.perf_counter()
+        pairs = lots.pair_trades(trades.copy(), strategy)
+        elapsed = time.perf_counter() - start
+        revenue = pairs['Proceeds'] + pairs['Cost']
+        print(f'{strategy:12} {elapsed:9.2f} {revenue[pairs["Taxable"] == 1].sum():16.2f} {revenue[pairs["Taxable"] == 0].sum():15.2f} {pairs["Quantity"].sum():9.0f}')
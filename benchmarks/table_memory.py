@@ -0,0 +1,33 @@
+"""
+Report memory of the State tables before and after casting them to their schema, on a synthetic trade history.
+
+Example usage: python -m benchmarks.table_memory --trades 500000
+"""
+import argparse
+import time
+import numpy as np
+from matchmaker import data
+from benchmarks.trade_ids import generate_trades
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report memory of the State tables before and after casting them to their schema.")
+    parser.add_argument("--trades", "-n", type=int, default=500000, help="Number of trades to generate")
+    parser.add_argument("--seed", "-s", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    state = data.State()
+    trades = generate_trades(args.trades, args.seed)
+    rng = np.random.default_rng(args.seed)
+    trades['Category'] = 'Trades'
+    trades['Ticker'] = trades['Symbol']
+    trades['Display Name'] = trades['Symbol']
+    trades['Account'] = [f'U{account}' for account in rng.integers(1000000, 1000004, len(trades))]
+    trades['Manual'] = False
+    state.trades = trades
+    start = time.perf_counter()
+    report = state.normalize_tables(report=True)
+    elapsed = time.perf_counter() - start
+    print(f'{len(trades)} trades cast and measured in {elapsed:.2f} s')
+    print(report.round(2).to_string())
+    print(state.trades.memory_usage(deep=True).div(2**20).round(2).to_string())
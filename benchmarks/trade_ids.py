@@ -0,0 +1,66 @@
+"""
+Compare memory and join times of trades identified by hexadecimal hashes and by compact 64-bit identities on a synthetic trade history.
+Pairs refer to random buys and sells, and the joins are those done when pairing and merging imports.
+
+Example usage: python -m benchmarks.trade_ids --trades 500000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from matchmaker import hash
+from matchmaker import pairing
+
+
+def generate_trades(count: int, seed: int = 0) -> pd.DataFrame:
+    """ Random stock trades of many symbols with all identity fields filled in. """
+    rng = np.random.default_rng(seed)
+    quantities = rng.integers(-100, 100, count).astype(float)
+    prices = np.round(rng.uniform(1, 500, count), 2)
+    times = pd.Timestamp('2010-01-01') + pd.to_timedelta(rng.integers(0, 15 * 365 * 24 * 3600, count), unit='s')
+    return pd.DataFrame({'Currency': 'USD', 'Symbol': [f'S{symbol}' for symbol in rng.integers(0, 5000, count)], 'Date/Time': times,
+                         'Quantity': quantities, 'T. Price': prices, 'C. Price': prices, 'Proceeds': -quantities * prices, 'Comm/Fee': -1.0,
+                         'Basis': 0.0, 'Realized P/L': 0.0, 'MTM P/L': 0.0, 'Code': np.where(quantities > 0, 'O', 'C'),
+                         'Action': np.where(quantities > 0, 'Open', 'Close'), 'Type': 'Long', 'Option Type': np.nan})
+
+def generate_pairs(trades: pd.DataFrame, seed: int = 0) -> pd.DataFrame:
+    """ Pairs of random sells and buys of the trades, one pair per trade. """
+    rng = np.random.default_rng(seed)
+    index = trades.index.to_numpy()
+    return pd.DataFrame({'Sell Transaction': index[rng.integers(0, len(index), len(index))], 'Buy Transaction': index[rng.integers(0, len(index), len(index))],
+                         'Quantity': rng.uniform(0, 10, len(index))})
+
+def measure(trades: pd.DataFrame, pairs: pd.DataFrame) -> dict:
+    """ Memory of the identities in MB and runtimes in seconds of the joins by them. """
+    results = {'Memory [MB]': (trades.index.memory_usage(deep=True) + pairs[['Sell Transaction', 'Buy Transaction']].memory_usage(deep=True, index=False).sum()) / 2**20}
+    start = time.perf_counter()
+    pairing.fill_trades_covered_quantity(trades.copy(), pairs)
+    results['Cover [s]'] = time.perf_counter() - start
+    start = time.perf_counter()
+    # Overlapping imports, deduplicated like State.merge_with does
+    existing, new = trades.iloc[: len(trades) // 2], trades.iloc[len(trades) // 4:]
+    new[~new.index.isin(existing.index)]
+    merged = pd.concat([existing, new])
+    merged[~merged.index.duplicated(keep='first')]
+    results['Merge [s]'] = time.perf_counter() - start
+    start = time.perf_counter()
+    trades.loc[pairs['Sell Transaction'].to_numpy(), 'Date/Time']
+    results['Lookup [s]'] = time.perf_counter() - start
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare memory and join times of hexadecimal and 64-bit trade identities.")
+    parser.add_argument("--trades", "-n", type=int, default=500000, help="Number of trades to generate")
+    parser.add_argument("--seed", "-s", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    trades = generate_trades(args.trades, args.seed)
+    start = time.perf_counter()
+    hashes = hash.hash_rows(trades)
+    print(f'{len(trades)} trades hashed in {time.perf_counter() - start:.2f} s')
+    results = {}
+    for name, index in [('Hexadecimal', pd.Index(hashes.to_numpy(), name='Hash')), ('64-bit', pd.Index(hash.trade_ids(trades).to_numpy(), name='ID'))]:
+        identified = trades.set_axis(index)
+        results[name] = measure(identified, generate_pairs(identified, args.seed))
+    print(pd.DataFrame(results).round(3).to_string())
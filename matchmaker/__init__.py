@@ -1,2 +1,12 @@
 import json
-import streamlit as st
\ No newline at end of file
+
+# Settings shared by the web pages and batch runs, loaded by load_settings
+settings = {}
+
+def load_settings(path: str = 'settings.json') -> dict:
+    """ Load the settings from a JSON file into the shared settings. """
+    from matchmaker import cache
+    with open(path) as f:
+        settings.update(json.load(f))
+    cache.results.memory_limit = settings.get('cache_memory_mb', cache.MEMORY_LIMIT // 2**20) * 2**20
+    return settings
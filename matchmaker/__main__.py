@@ -0,0 +1,52 @@
+"""
+Headless batch run of the whole tax computation, see matchmaker.batch. Options not given on the command line are taken from settings.json.
+
+Example usage: python -m matchmaker --import-trades-dir statements --strategy max-loss --process-years 2023 --save-trade-overview-dir out
+"""
+import argparse
+import os
+import sys
+import pandas as pd
+import matchmaker
+from matchmaker import batch
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m matchmaker', description='Import IBKR activity statements, pair trades and compute taxes of all accounts without the web interface.')
+    parser.add_argument('--settings-dir', type=str, default='.', help='Directory with settings.json, relative directories in settings are resolved against it')
+    parser.add_argument('--import-trades-dir', type=str, help='Directory with IBKR activity statements (CSV) of one or more accounts')
+    parser.add_argument('--tickers-dir', type=str, help='Path to load historic ticker data to adjust prices for splits')
+    parser.add_argument('--load-trades', type=str, help='Snapshot of previously processed trades to start from')
+    parser.add_argument('--save-trades', type=str, help='Path to save a snapshot of processed trades after import')
+    parser.add_argument('--process-years', type=str, help='List of years to process, separated by commas. If not specified, all years are processed.')
+    parser.add_argument('--preserve-years', type=str, help='List of years whose loaded matched trades are kept unchanged, separated by commas. If not specified, all years not processed are preserved.')
+    parser.add_argument('--strategy', type=str, help='Strategy to use for pairing buy and sell orders. Available: ' + ', '.join(batch.strategy_names))
+    parser.add_argument('--save-trade-overview-dir', type=str, help='Directory to output overviews of matched trades and yearly tax summaries')
+    parser.add_argument('--load-matched-trades', type=str, help='Paired trades input to load')
+    parser.add_argument('--save-matched-trades', type=str, help='Save updated paired trades')
+    parser.add_argument('--rates', type=str, choices=['yearly', 'daily'], default='yearly', help='Use yearly or daily CZK conversion rates')
+    parser.add_argument('--workers', type=int, default=0, help='Number of accounts processed in parallel, 0 for all cores')
+    args = parser.parse_args()
+
+    matchmaker.load_settings(os.path.join(args.settings_dir, 'settings.json'))
+    for key in ['currency_rates_dir', 'rename_history_dir', 'tickers_dir', 'statement_cache_dir']:
+        if matchmaker.settings.get(key):
+            matchmaker.settings[key] = os.path.join(args.settings_dir, matchmaker.settings[key])
+    if args.tickers_dir is not None:
+        matchmaker.settings['tickers_dir'] = args.tickers_dir
+    try:
+        options = batch.Options(args, matchmaker.settings)
+    except ValueError as e:
+        parser.error(str(e))
+    if options.import_trades_dir is None and options.load_trades is None:
+        parser.error('Nothing to process, specify --import-trades-dir or --load-trades')
+
+    summary, failed = batch.run(options, log=lambda message: print(message, file=sys.stderr))
+    if not summary.empty:
+        with pd.option_context('display.width', 200, 'display.max_columns', None):
+            print(summary.to_string(index=False, float_format=lambda value: f'{value:,.2f}'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
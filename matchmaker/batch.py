@@ -0,0 +1,212 @@
+"""
+Batch tax runs without the web interface: IBKR statements are imported, positions recomputed, trades paired and converted to CZK, and the results written to files.
+Statements are grouped by account and accounts are processed in parallel. Nothing here may import streamlit.
+"""
+import concurrent.futures
+import glob
+import os
+import re
+import traceback
+import pandas as pd
+import matchmaker
+from matchmaker import currency
+from matchmaker import data
+from matchmaker import hash
+from matchmaker import imports
+from matchmaker import pairing
+from matchmaker import planner
+from matchmaker import snapshot
+
+# Strategy names accepted on the command line and in settings
+strategy_names = {
+    'fifo': 'FIFO',
+    'lifo': 'LIFO',
+    'average-cost': 'AverageCost',
+    'max-loss': 'MaxLoss',
+    'max-profit': 'MaxProfit',
+    'optimal': 'Optimal',
+}
+
+
+class Options:
+    """ Options of a batch run, taken from the command line with settings.json as defaults. """
+    def __init__(self, args, settings: dict):
+        def option(name: str):
+            value = getattr(args, name.replace('-', '_'), None)
+            return value if value is not None else settings.get(name)
+
+        self.import_trades_dir = option('import-trades-dir')
+        self.load_trades = option('load-trades')
+        self.save_trades = option('save-trades')
+        self.load_matched_trades = option('load-matched-trades')
+        self.save_matched_trades = option('save-matched-trades')
+        self.save_trade_overview_dir = option('save-trade-overview-dir')
+        self.process_years = parse_years(option('process-years'))
+        self.preserve_years = parse_years(option('preserve-years'))
+        strategy = option('strategy') or 'fifo'
+        self.strategy = strategy_names.get(strategy.lower(), strategy)
+        if self.strategy not in pairing.Pairings.strategies[1:]:
+            raise ValueError(f'Unknown strategy: {strategy}. Available: {", ".join(strategy_names)}')
+        self.rates = args.rates.capitalize()
+        self.workers = args.workers
+
+def parse_years(years) -> list[int]:
+    """ Years given as a comma separated list, or None if not given. """
+    if years is None or str(years).strip() == '':
+        return None
+    return sorted(int(year) for year in str(years).split(',') if year.strip())
+
+def account_path(path: str, account: str, account_count: int) -> str:
+    """ Path of a per-account file. '{account}' is replaced by the account, otherwise the account is added before the extension if there are more accounts. """
+    if path is None:
+        return None
+    if '{account}' in path:
+        return path.replace('{account}', account)
+    if account_count > 1:
+        root, extension = os.path.splitext(path)
+        return f'{root}.{account}{extension}'
+    return path
+
+def statement_account(path: str) -> str:
+    """ Read the account number from the account information of an IBKR activity statement, without parsing the rest of it. """
+    with open(path, encoding='utf-8-sig') as file:
+        for line in file:
+            if line.startswith('Account Information,Data,Account,'):
+                match = re.search(r'U\d+', line)
+                if match:
+                    return match.group(0)
+    raise ValueError(f'{path} is not an IBKR activity statement with account information')
+
+def find_statements(directory: str) -> tuple[dict[str, list[str]], list[str]]:
+    """ Group statement files of a directory by account. Return the groups and the errors of files that couldn't be read. """
+    accounts, errors = {}, []
+    for path in sorted(glob.glob(os.path.join(directory, '*.csv'))):
+        try:
+            accounts.setdefault(statement_account(path), []).append(path)
+        except (ValueError, UnicodeDecodeError) as e:
+            errors.append(f'{path}: {e}')
+    return accounts, errors
+
+def _makedirs_for(path: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+def process_account(account: str, paths: list[str], options: Options, settings: dict, account_count: int = 1) -> tuple[pd.DataFrame, list[str]]:
+    """ Run the whole pipeline for the statements of one account. Return per-year tax summary and messages about the run. """
+    matchmaker.settings.update(settings)
+    messages = []
+    state = data.State()
+    load_trades = account_path(options.load_trades, account, account_count)
+    if load_trades is not None and os.path.exists(load_trades):
+        with open(load_trades, 'rb') as file:
+            state.merge_with(snapshot.load_snapshot(file), drop_pairings=False)
+        messages.append(f'loaded {len(state.trades)} trades from {load_trades}')
+    files = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            files.append(imports.NamedFile(path, file.read()))
+    # Accounts already run in parallel, their statements are imported in the same process
+    results = imports.import_trade_files(files, workers=1)
+    messages += [f'skipped: {error}' for _, error in results if error is not None]
+    imports.merge_imported_states(state, [imported for imported, _ in results if imported is not None])
+    if state.trades.empty:
+        messages.append('no trades')
+        return pd.DataFrame(), messages
+    state.recompute_positions()
+
+    save_trades = account_path(options.save_trades, account, account_count)
+    if save_trades is not None:
+        _makedirs_for(save_trades)
+        with open(save_trades, 'w', encoding='utf-8') as file:
+            file.write(snapshot.save_snapshot(state))
+
+    # Years to pair again and years whose previously matched pairs are kept
+    trades = state.trades[(state.trades['Action'] == 'Open') | (state.trades['Action'] == 'Close')]
+    sell_years = sorted(trades[trades['Action'] == 'Close']['Year'].unique())
+    process_years = [year for year in sell_years if options.process_years is None or year in options.process_years]
+    preserve_years = options.preserve_years if options.preserve_years is not None else [year for year in sell_years if year not in process_years]
+    kept = None
+    load_matched_trades = account_path(options.load_matched_trades, account, account_count)
+    if load_matched_trades is not None and os.path.exists(load_matched_trades):
+        kept = pairing.normalize_paired_columns(pd.read_csv(load_matched_trades))
+        kept = kept[kept['Sell Time'].dt.year.isin(preserve_years) & ~kept['Sell Time'].dt.year.isin(process_years)]
+        kept = kept[kept['Sell Transaction'].isin(trades.index) & kept['Buy Transaction'].isin(trades.index)]
+        messages.append(f'kept {len(kept)} pairs of years {", ".join(str(year) for year in preserve_years)}')
+    paired, unpaired = pairing.pair_years(trades, kept, {year: options.strategy for year in process_years})
+    if paired.empty or 'Sell Transaction' not in paired.columns:
+        messages.append('nothing to pair')
+        return pd.DataFrame(), messages
+    paired = pairing.convert_pairs(paired, options.rates)
+
+    save_matched_trades = account_path(options.save_matched_trades, account, account_count)
+    if save_matched_trades is not None:
+        _makedirs_for(save_matched_trades)
+        paired.to_csv(save_matched_trades, index=False)
+
+    summary = yearly_summary(paired, unpaired, options.strategy, process_years)
+    summary.insert(0, 'Account', account)
+    if options.save_trade_overview_dir is not None:
+        os.makedirs(options.save_trade_overview_dir, exist_ok=True)
+        if options.rates == 'Yearly':
+            rates = currency.load_yearly_rates(matchmaker.settings['currency_rates_dir'])
+        else:
+            rates = currency.load_daily_rates(matchmaker.settings['currency_rates_dir'])
+        converted = currency.add_czk_conversion_to_trades(state.trades.copy(), rates, options.rates == 'Yearly')
+        converted.insert(0, 'Hash', hash.hash_rows(converted))
+        converted.to_csv(os.path.join(options.save_trade_overview_dir, f'trades.{account}.csv'), index_label='ID')
+        for year in process_years:
+            paired[paired['Sell Time'].dt.year == year].to_csv(os.path.join(options.save_trade_overview_dir, f'pairs.{account}.{year}.csv'), index=False)
+        unpaired_closes = unpaired[unpaired['Action'] == 'Close'].copy()
+        unpaired_closes.insert(0, 'Hash', hash.hash_rows(unpaired_closes))
+        unpaired_closes.to_csv(os.path.join(options.save_trade_overview_dir, f'unpaired.{account}.csv'), index_label='ID')
+        summary.to_csv(os.path.join(options.save_trade_overview_dir, f'summary.{account}.csv'), index=False)
+    messages.append(f'{len(state.trades)} trades, {len(paired)} pairs')
+    return summary, messages
+
+def yearly_summary(paired: pd.DataFrame, unpaired: pd.DataFrame, strategy: str, years: list[int]) -> pd.DataFrame:
+    """ Taxable and exempt CZK revenue, tax and unpaired sell quantity of each year. """
+    sell_years = paired['Sell Time'].dt.year
+    unpaired_sells = unpaired[unpaired['Action'] == 'Close']
+    rows = []
+    for year in sorted(set(sell_years.unique()) | set(years)):
+        pairs = paired[sell_years == year]
+        taxable = pairs.loc[pairs['Taxable'] == 1, 'CZK Revenue'].sum()
+        exempt = pairs.loc[pairs['Taxable'] == 0, 'CZK Revenue'].sum()
+        rows.append((year, strategy if year in years else 'Preserved', taxable, exempt, max(taxable, 0.0) * planner.TAX_RATE,
+                     unpaired_sells.loc[unpaired_sells['Year'] == year, 'Uncovered Quantity'].abs().sum()))
+    return pd.DataFrame(rows, columns=['Year', 'Strategy', 'Taxable Revenue', 'Exempt Revenue', 'Tax', 'Unpaired Quantity'])
+
+def _process_account_job(job) -> tuple[pd.DataFrame, list[str], bool]:
+    account, paths, options, settings, account_count = job
+    try:
+        return process_account(account, paths, options, settings, account_count) + (True,)
+    except Exception:
+        return pd.DataFrame(), [f'failed: {traceback.format_exc()}'], False
+
+def run(options: Options, log=print) -> tuple[pd.DataFrame, int]:
+    """ Process all accounts of the import directory, in parallel if there are more of them. Return the combined per-year summary and the number of failed accounts. """
+    accounts, errors = find_statements(options.import_trades_dir) if options.import_trades_dir is not None else ({}, [])
+    for error in errors:
+        log(f'Skipping {error}')
+    if not accounts and options.load_trades is not None:
+        # Only a previously saved state to pair again
+        accounts = {'all': []}
+    jobs = [(account, paths, options, dict(matchmaker.settings), len(accounts)) for account, paths in accounts.items()]
+    workers = options.workers if options.workers else os.cpu_count()
+    if workers > 1 and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            results = list(executor.map(_process_account_job, jobs))
+    else:
+        results = [_process_account_job(job) for job in jobs]
+
+    summaries, failed = [], 0
+    for (account, paths, _, _, _), (summary, messages, succeeded) in zip(jobs, results):
+        log(f'{account} ({len(paths)} statements): ' + '; '.join(messages))
+        failed += not succeeded
+        if not summary.empty:
+            summaries.append(summary)
+    summary = pd.concat(summaries, ignore_index=True) if summaries else pd.DataFrame()
+    if options.save_trade_overview_dir is not None and not summary.empty:
+        summary.to_csv(os.path.join(options.save_trade_overview_dir, 'summary.csv'), index=False)
+    return summary, failed
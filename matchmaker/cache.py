@@ -0,0 +1,274 @@
+import copy
+import functools
+import hashlib
+import inspect
+import io
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Default memory available to cached results of a single process
+MEMORY_LIMIT = 512 * 1024 * 1024
+# Default disk space of parsed statements
+STATEMENT_CACHE_SIZE = 256 * 1024 * 1024
+# Prefix of columns marking which nulls of an object column were None rather than NaN
+_NONE_MASK = '__none__:'
+
+
+def _update_column(hasher, values):
+    """ Feed a column or an index into the hasher. Plain numeric and datetime columns are hashed as raw memory, others element by element. """
+    array = values.to_numpy() if isinstance(values.dtype, np.dtype) else None
+    if array is not None and array.dtype.kind in 'biufcmM':
+        hasher.update(np.ascontiguousarray(array).view(np.uint8))
+        return
+    try:
+        hasher.update(pd.util.hash_pandas_object(pd.Series(values, copy=False) if isinstance(values, pd.Index) else values, index=False).to_numpy())
+    except TypeError:
+        # Cells holding unhashable objects such as lists
+        hasher.update(pickle.dumps(list(values)))
+
+def _update(hasher, value):
+    if isinstance(value, pd.DataFrame):
+        hasher.update(repr((value.shape, list(value.columns), [str(dtype) for dtype in value.dtypes])).encode())
+        _update_column(hasher, value.index)
+        for position in range(value.shape[1]):
+            _update_column(hasher, value.iloc[:, position])
+    elif isinstance(value, pd.Series):
+        hasher.update(repr((value.name, len(value), str(value.dtype))).encode())
+        _update_column(hasher, value.index)
+        _update_column(hasher, value)
+    elif isinstance(value, (list, tuple)):
+        hasher.update(f'{type(value).__name__}:{len(value)}'.encode())
+        for item in value:
+            _update(hasher, item)
+    elif isinstance(value, dict):
+        hasher.update(f'dict:{len(value)}'.encode())
+        for key, item in sorted(value.items(), key=lambda item: repr(item[0])):
+            _update(hasher, key)
+            _update(hasher, item)
+    elif isinstance(value, io.BytesIO):
+        # Uploaded files are keyed by their content, not by the object
+        hasher.update(b'BytesIO')
+        hasher.update(value.getbuffer())
+    elif hasattr(value, 'get_state'):
+        # Application state objects describe themselves by a tuple of their tables
+        hasher.update(type(value).__name__.encode())
+        _update(hasher, value.get_state())
+    else:
+        hasher.update(f'{type(value).__name__}:{value!r}'.encode())
+
+def fingerprint(value) -> bytes:
+    """ Cheap content fingerprint of DataFrames, application state and plain values, usable as a cache key. """
+    hasher = hashlib.blake2b(digest_size=16)
+    _update(hasher, value)
+    return hasher.digest()
+
+def _memory_size(value) -> int:
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum()) if isinstance(value, pd.DataFrame) else int(value.memory_usage(deep=True))
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_memory_size(item) for item in value)
+    return sys.getsizeof(value)
+
+def _copy(value):
+    """ Copy mutable results so that callers can't change the cached ones. """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(_copy(item) for item in value)
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    if hasattr(value, 'get_state'):
+        return copy.deepcopy(value)
+    return value
+
+
+class ResultCache:
+    """ Least recently used results of expensive functions, bounded by the memory they take. Shared by all sessions of the process. """
+    def __init__(self, memory_limit: int = MEMORY_LIMIT):
+        self.memory_limit = memory_limit
+        """ Cached results in the order of their last use: key -> (function name, result, size in bytes) """
+        self.entries = OrderedDict()
+        self.memory_used = 0
+        """ Lookup counts per function name """
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+
+    def get(self, name: str, key) -> tuple[bool, object]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses[name] = self.misses.get(name, 0) + 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits[name] = self.hits.get(name, 0) + 1
+            return True, entry[1]
+
+    def put(self, name: str, key, result):
+        size = _memory_size(result)
+        with self.lock:
+            if key in self.entries:
+                self.memory_used -= self.entries.pop(key)[2]
+            # Results larger than the whole cache are not worth evicting everything else
+            if size > self.memory_limit:
+                return
+            self.entries[key] = (name, result, size)
+            self.memory_used += size
+            self.evict()
+
+    def evict(self):
+        """ Drop the least recently used results until the cache fits its memory limit. """
+        while self.memory_used > self.memory_limit and self.entries:
+            _, (_, _, size) = self.entries.popitem(last=False)
+            self.memory_used -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.memory_used = 0
+            self.hits.clear()
+            self.misses.clear()
+
+    def statistics(self) -> pd.DataFrame:
+        """ Per-function hit and miss counts, number of cached results and memory they take. """
+        with self.lock:
+            names = sorted(set(self.hits) | set(self.misses) | set(entry[0] for entry in self.entries.values()))
+            rows = [(name, self.hits.get(name, 0), self.misses.get(name, 0),
+                     sum(1 for entry in self.entries.values() if entry[0] == name),
+                     sum(entry[2] for entry in self.entries.values() if entry[0] == name) / 2**20) for name in names]
+        return pd.DataFrame(rows, columns=['Function', 'Hits', 'Misses', 'Entries', 'Memory [MB]'])
+
+results = ResultCache()
+
+
+def cached(function=None, *, ignore: tuple[str, ...] = ()):
+    """
+    Cache results of the function in the process-wide LRU cache, keyed by fingerprints of its arguments.
+    Arguments named in ignore don't change the result (like the number of workers) and are left out of the key.
+    Results are copied on the way out, arguments modified by the function in place are not restored on a cache hit.
+    """
+    if function is None:
+        return lambda function: cached(function, ignore=ignore)
+    signature = inspect.signature(function)
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        key = (function.__module__, name, fingerprint([(argument, value) for argument, value in arguments.arguments.items() if argument not in ignore]))
+        found, result = results.get(name, key)
+        if not found:
+            result = function(*args, **kwargs)
+            results.put(name, key, result)
+        return _copy(result)
+
+    wrapper.cache = results
+    return wrapper
+
+
+def _write_table(table: pd.DataFrame, path: str):
+    """ Write a table to Parquet. Parquet has a single kind of null, so None values of object columns are marked in extra columns. """
+    masks = {}
+    for column in table.columns:
+        if table[column].dtype == object:
+            none = np.fromiter((value is None for value in table[column].to_numpy()), dtype=bool, count=len(table))
+            if none.any():
+                masks[_NONE_MASK + column] = none
+    if masks:
+        table = table.assign(**masks)
+    table.to_parquet(path, engine='pyarrow')
+
+def _read_table(path: str) -> pd.DataFrame:
+    """ Read a table written by _write_table, with NaN and None in object columns where they were. """
+    import pyarrow.parquet as parquet
+    stored = parquet.read_table(path)
+    table = stored.to_pandas()
+    # Object columns of a single type, like flags, come back typed
+    objects = [column['name'] for column in stored.schema.pandas_metadata['columns'] if column['numpy_type'] == 'object' and column['name'] in table.columns]
+    masks = [column for column in table.columns if column.startswith(_NONE_MASK)]
+    for column in objects:
+        if column not in masks:
+            values = table[column].to_numpy(dtype=object, copy=True)
+            values[pd.isna(values)] = np.nan
+            if _NONE_MASK + column in table.columns:
+                values[table[_NONE_MASK + column].to_numpy()] = None
+            table[column] = values
+    return table.drop(columns=masks)
+
+
+class StatementCache:
+    """
+    Tables of parsed statements stored on disk in Parquet, in a directory per statement named by a digest of its content and the parser version.
+    Least recently used statements are removed once the cache grows over its size limit. Shared by all processes using the directory.
+    """
+    def __init__(self, directory: str, size_limit: int = STATEMENT_CACHE_SIZE):
+        self.directory = directory
+        self.size_limit = size_limit
+
+    @staticmethod
+    def key(content: bytes, version) -> str:
+        hasher = hashlib.blake2b(digest_size=20)
+        hasher.update(f'{version}:'.encode())
+        hasher.update(content)
+        return hasher.hexdigest()
+
+    def load(self, key: str) -> dict[str, pd.DataFrame]:
+        """ Tables stored under the key, None if there are none or they can't be read. """
+        path = os.path.join(self.directory, key)
+        try:
+            tables = {name.removesuffix('.parquet'): _read_table(os.path.join(path, name)) for name in os.listdir(path) if name.endswith('.parquet')}
+            os.utime(path)
+        except (OSError, ValueError, ImportError):
+            return None
+        return tables or None
+
+    def save(self, key: str, tables: dict[str, pd.DataFrame]) -> bool:
+        """ Store the tables under the key, return False if they can't be stored in Parquet. """
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        # Written aside and renamed, so that other processes never see a partial entry
+        temporary = tempfile.mkdtemp(prefix='.', dir=self.directory)
+        try:
+            for name, table in tables.items():
+                _write_table(table, os.path.join(temporary, name + '.parquet'))
+            os.rename(temporary, path)
+        except (OSError, ValueError, TypeError, ImportError):
+            shutil.rmtree(temporary, ignore_errors=True)
+            return os.path.isdir(path)
+        self.evict()
+        return True
+
+    def entries(self) -> list[tuple[float, int, str]]:
+        """ Stored statements as (last use, size in bytes, path), least recently used first. """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and not entry.name.startswith('.'):
+                size = sum(file.stat().st_size for file in os.scandir(entry.path) if file.is_file())
+                entries.append((entry.stat().st_mtime, size, entry.path))
+        return sorted(entries)
+
+    def evict(self):
+        """ Remove the least recently used statements until the cache fits its size limit. """
+        try:
+            entries = self.entries()
+        except OSError:
+            return
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in entries:
+            if size <= self.size_limit:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            size -= entry_size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -1,7 +1,7 @@
 import glob
 import numpy as np
 import pandas as pd
-import streamlit as st
+from matchmaker import cache
 
 def adjust_rates_columns(df):
     # Headers contain the divisor for the rates
@@ -15,7 +15,7 @@ def adjust_rates_columns(df):
         df.rename(columns={column: column.split(' ')[1]}, inplace=True)
     return df
 
-@st.cache_data()
+@cache.cached
 def load_yearly_rates(directory):
     df = pd.read_csv(directory + '/CurrencyRatesYearly.csv')
     df['Year'] = pd.to_numeric(df['Year'], errors='coerce')
@@ -24,7 +24,7 @@ def load_yearly_rates(directory):
     return df
 
 # Load daily CNB rates
-@st.cache_data()
+@cache.cached
 def load_daily_rates(directory):
     df = None
     for f in glob.glob(directory + '/CurrencyRatesDaily.*.csv'):
@@ -40,7 +40,7 @@ def load_daily_rates(directory):
 def get_adjusted_price(ticker, date):
     pass
 
-@st.cache_data()
+@cache.cached
 def add_czk_conversion_to_trades(trades, rates, use_yearly_rates=True):
     if use_yearly_rates:
         trades['CZK Rate'] = trades.apply(lambda row: rates.loc[row['Date/Time'].year, row['Currency']] if row['Date/Time'].year in rates.index else np.nan, axis=1)
@@ -52,6 +52,22 @@ def add_czk_conversion_to_trades(trades, rates, use_yearly_rates=True):
     trades['CZK Profit'] = trades['Realized P/L'] * trades['CZK Rate']
     return trades
 
+def get_czk_rates(times: pd.Series, currencies: pd.Series, rates: pd.DataFrame, use_yearly_rates=True) -> np.ndarray:
+    """ Look up CZK rates for many dates and currencies at once. Missing rates are NaN. """
+    times = pd.to_datetime(times).reset_index(drop=True)
+    columns = rates.columns.get_indexer(currencies.to_numpy())
+    if use_yearly_rates:
+        rows = rates.index.get_indexer(times.dt.year.to_numpy())
+    else:
+        if not rates.index.is_monotonic_increasing:
+            rates = rates.sort_index()
+        # Last published rate on or before the day
+        rows = np.searchsorted(rates.index.to_numpy(), times.dt.normalize().to_numpy(), side='right') - 1
+    found = (rows >= 0) & (columns >= 0)
+    values = np.full(len(times), np.nan)
+    values[found] = rates.to_numpy(dtype=np.float64)[rows[found], columns[found]]
+    return values
+
 def add_czk_conversion_to_pairs(trade_pairs, rates, use_yearly_rates=True):
     if trade_pairs.empty:
         return trade_pairs
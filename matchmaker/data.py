@@ -1,16 +1,42 @@
 # Used to hash entire rows since there is no unique identifier for each row
+import matchmaker
 from matchmaker import trade
 from matchmaker import pairing
-import json
+from matchmaker import schema
+from matchmaker import rename_history
+import itertools
 import pandas as pd
 import numpy as np
-import streamlit as st
 
 
 def load_settings():
+    """ Make the settings available to the streamlit session. """
+    import streamlit as st
+    if not matchmaker.settings:
+        matchmaker.load_settings()
     if st.session_state.get('settings') is None:
-        with open('settings.json') as f:
-            st.session_state['settings'] = json.load(f)
+        st.session_state['settings'] = matchmaker.settings
+
+# Generations are unique within the process, so that a reset state never repeats the generation of its past contents
+_generations = itertools.count(1)
+# Number of recent changes kept in the journal
+JOURNAL_LENGTH = 1000
+tables = ['trades', 'actions', 'positions', 'dividends', 'symbols', 'imports']
+
+def related_symbols(symbols, rename_entries: set[tuple]) -> set:
+    """ Raw symbols sharing a ticker with any of the given ones, directly or through a chain of (Symbol, Ticker, Change Date) rename entries. Includes the given symbols. """
+    symbol_tickers, ticker_symbols = {}, {}
+    for symbol, ticker, _ in rename_entries:
+        symbol_tickers.setdefault(symbol, set()).add(ticker)
+        ticker_symbols.setdefault(ticker, set()).add(symbol)
+    related = set()
+    pending = list(symbols)
+    while pending:
+        symbol = pending.pop()
+        if symbol not in related:
+            related.add(symbol)
+            pending.extend(other for ticker in symbol_tickers.get(symbol, ()) for other in ticker_symbols.get(ticker, ()))
+    return related
 
 
 class State:
@@ -19,7 +45,7 @@ class State:
         self.reset()  
 
     def reset(self):
-        """ History of all trades, including stock and option transfers, exercises, assignments, and all related operations. Index: hash of the entire row  """
+        """ History of all trades, including stock and option transfers, exercises, assignments, and all related operations. Index: 64-bit hash of the trade's identity fields  """
         self.trades = pd.DataFrame()
         """ History of corporate actions, including stock splits, spin-offs, acquisitions, etc."""
         self.actions = pd.DataFrame()
@@ -33,65 +59,174 @@ class State:
         self.imports = pd.DataFrame(columns=['Account', 'From', 'To', 'Trade Count'])
         """ Trades that were paired together to form taxable pairs. """
         self.pairings = pairing.Pairings()
+        """ Increases with every change of the tables above. """
+        self.generation = next(_generations)
+        """ Generation of the last change of each table: table name -> generation """
+        self.table_generations = {table: self.generation for table in tables}
+        """ Recent changes, oldest first, as (generation, table, change, symbols). Symbols are None if the change concerns all of them. """
+        self.journal: list[tuple[int, str, str, tuple]] = []
+        """ Generation from which on the journal holds all changes """
+        self.journal_start = self.generation
+        """ Registry of the currency of each raw symbol of the trades and the generation of the trades it reflects, built on first use """
+        self.currencies: pd.Series = None
+        self.currencies_generation = None
+
+    def record_change(self, table: str, change: str, symbols = None):
+        """ Note a change of a table in the journal and move to a new generation. """
+        self.generation = next(_generations)
+        self.table_generations[table] = self.generation
+        self.journal.append((self.generation, table, change, tuple(sorted(set(symbols))) if symbols is not None else None))
+        if len(self.journal) > JOURNAL_LENGTH:
+            self.journal_start = self.journal[-JOURNAL_LENGTH - 1][0]
+            del self.journal[:-JOURNAL_LENGTH]
+
+    def unchanged_since(self, generation: int, *tables: str) -> bool:
+        """ Check whether none of the tables (all of them if none are given) changed after the given generation. """
+        return all(self.table_generations.get(table, self.generation) <= generation for table in (tables or self.table_generations))
+
+    def changes_since(self, generation: int, *tables: str) -> list[tuple[int, str, str, tuple]]:
+        """ Journal entries of the tables after the given generation, or None if the journal doesn't reach that far back. """
+        if generation < self.journal_start and not self.unchanged_since(generation, *tables):
+            return None
+        return [entry for entry in self.journal if entry[0] > generation and (not tables or entry[1] in tables)]
+
+    def symbol_currencies(self) -> pd.Series:
+        """ Currency of each raw symbol, that of its first trade. Added trades only register their new symbols, other changes of the trades rebuild the registry. """
+        generation = self.table_generations.get('trades', self.generation)
+        if self.currencies is not None and self.currencies_generation == generation:
+            return self.currencies
+        if 'Symbol' not in self.trades.columns:
+            return pd.Series(dtype=object)
+        changes = self.changes_since(self.currencies_generation, 'trades') if self.currencies is not None else None
+        if changes is not None and all(change in ('added', 'modified', 'recomputed') for _, _, change, _ in changes):
+            trades = self.trades[~self.trades['Symbol'].isin(self.currencies.index)]
+            registry = [self.currencies]
+        else:
+            trades = self.trades
+            registry = []
+        registry.append(trades.groupby('Symbol', observed=True, sort=False)['Currency'].first().astype(object))
+        self.currencies = pd.concat(registry) if len(registry) > 1 else registry[0]
+        self.currencies_generation = generation
+        return self.currencies
+
+    def currency_of(self, symbol: str) -> str:
+        """ Currency of a raw symbol, or of a ticker that symbols were renamed to, taken from the last of them in the symbols table. """
+        currencies = self.symbol_currencies()
+        if symbol in currencies.index:
+            return currencies[symbol]
+        renamed = currencies.reindex(self.symbols.index[self.symbols['Ticker'] == symbol]).dropna()
+        return renamed.iloc[-1] if not renamed.empty else None
 
     def update(self, **kwargs):
         for key, value in kwargs.items():
             setattr(self, key, value)
 
     def get_state(self):
-        """ Used for streamlit caching. """
+        """ Used as the cache fingerprint. """
         return (self.trades, self.actions, self.positions, self.dividends, self.symbols, self.imports) + self.pairings.get_state()
     
     def load_session(self):
+        import streamlit as st
         self.trades = st.session_state.trades if 'trades' in st.session_state else pd.DataFrame()
         self.actions = st.session_state.actions if 'actions' in st.session_state else pd.DataFrame()
         self.positions = st.session_state.positions if 'positions' in st.session_state else pd.DataFrame()
         self.dividends = st.session_state.dividends if 'dividends' in st.session_state else pd.DataFrame()
         self.symbols = st.session_state.symbols if 'symbols' in st.session_state else pd.DataFrame()
         self.imports = st.session_state.imports if 'imports' in st.session_state else pd.DataFrame()
-        self.pairings.load_session()
+        if 'generation' in st.session_state:
+            self.generation = st.session_state.generation
+            self.table_generations = st.session_state.table_generations
+            self.journal = st.session_state.journal
+            self.journal_start = st.session_state.journal_start
+            self.currencies = st.session_state.get('currencies')
+            self.currencies_generation = st.session_state.get('currencies_generation')
+        self.pairings.load_session(st.session_state)
 
     def save_session(self):
+        import streamlit as st
         st.session_state.update(trades=self.trades)
         st.session_state.update(actions=self.actions)
         st.session_state.update(positions=self.positions)
         st.session_state.update(dividends=self.dividends)
         st.session_state.update(symbols=self.symbols)
         st.session_state.update(imports=self.imports)
-        self.pairings.save_session()
+        st.session_state.update(generation=self.generation, table_generations=self.table_generations, journal=self.journal, journal_start=self.journal_start)
+        st.session_state.update(currencies=self.currencies, currencies_generation=self.currencies_generation)
+        self.pairings.save_session(st.session_state)
 
-    def recompute_positions(self, added_trades = None):
+    def recompute_positions(self, symbols = None):
         """ 
-        Recompute past and present positions of the entire portfolio. 
+        Recompute past and present positions of the entire portfolio, or only of the given raw symbols once all were computed before.
         Includes modifying the trades by applying splits and symbol renames.
         """
-        if added_trades is not None:
-            new_symbols = pd.DataFrame(added_trades['Symbol'].unique(), columns=['Symbol'])
+        renames_before = self._rename_entries()
+        incremental = symbols is not None and 'Accumulated Quantity' in self.trades.columns
+        if incremental:
+            new_symbols = pd.DataFrame(pd.Series(symbols).unique(), columns=['Symbol'])
         else:
             all_symbols = pd.concat([self.trades['Symbol'], self.positions['Symbol'], self.dividends['Symbol']]).unique()
             new_symbols = pd.DataFrame(all_symbols, columns=['Symbol'])
-            added_trades = self.trades
 
         # Populate the symbols table with symbols in these trades
         new_symbols.set_index('Symbol', inplace=True)
         new_symbols['Ticker'] = new_symbols.index
         new_symbols['Change Date'] = pd.NaT
-        new_symbols['Currency'] = new_symbols.index.map(lambda symbol: self.trades[self.trades['Symbol'] == symbol]['Currency'].iloc[0] if not self.trades[self.trades['Symbol'] == symbol].empty else None)
+        new_symbols['Currency'] = new_symbols.index.map(self.symbol_currencies().get)
         self.symbols = pd.concat([self.symbols, new_symbols]).drop_duplicates()
         # Auto-generated symbols need to yield priority to possibly manually added symbols
         self.symbols = self.symbols[~self.symbols.duplicated(keep='first')]
 
-        if len(added_trades) > 0:
-            trade.adjust_for_splits(added_trades, self.actions)
+        if len(self.trades) > 0:
             # Create a map of symbols that could be renamed (but we don't know for now)
-            self.detect_and_apply_renames()
+            renames_found = self.detect_renames()
+            recomputed_symbols = None
+            if incremental:
+                # Positions are accumulated per ticker, so all symbols sharing one with the given symbols, before or after the renames, are recomputed with them
+                recomputed_symbols = related_symbols(new_symbols.index, renames_before | self._rename_entries())
+                scope = State()
+                scope.symbols, scope.actions = self.symbols, self.actions
+                kept = {}
+                for table in ['trades', 'positions', 'dividends']:
+                    df = getattr(self, table)
+                    in_scope = df['Symbol'].isin(recomputed_symbols)
+                    setattr(scope, table, df[in_scope].copy())
+                    kept[table] = df[~in_scope]
+                scope.recompute_tables(renames_found)
+                self.trades = pd.concat([kept['trades'], scope.trades]).sort_values(by='Date/Time', kind='stable')
+                self.positions = pd.concat([kept['positions'], scope.positions]).sort_index()
+                self.dividends = pd.concat([kept['dividends'], scope.dividends]).sort_index()
+            else:
+                self.recompute_tables(renames_found)
+            self.record_change('trades', 'recomputed', recomputed_symbols)
+            self.record_change('positions', 'recomputed', recomputed_symbols)
+            self.record_change('dividends', 'recomputed', recomputed_symbols)
+        renamed = renames_before ^ self._rename_entries()
+        if renamed:
+            self.record_change('symbols', 'renamed', [symbol for symbol, _, _ in renamed])
+        # Only symbols and years with changed trades (imported, manual, renamed or split) need to be paired again
+        self.pairings.mark_changes(self.trades)
+        self.normalize_tables()
+
+    def recompute_tables(self, renames_found: bool = True):
+        """ Adjust the trades for splits and renames, accumulate their positions and derive the columns of the positions and dividends from the symbols table. """
+        trade.adjust_for_splits(self.trades, self.actions)
+        if renames_found:
+            self.apply_renames()
             self.trades = trade.compute_accumulated_positions(self.trades)
-            self.positions['Date/Time'] = pd.to_datetime(self.positions['Date']) + pd.Timedelta(seconds=86399) # Add 23:59:59 to the date
-            self.positions = trade.add_split_data(self.positions, self.actions)
-            self.positions['Display Name'] = self.positions['Ticker']
-            self.positions.drop(columns=['Ticker'], inplace=True)
-            self.dividends['Display Name'] = self.dividends['Ticker']
-            self.trades['Display Name'] = self.trades['Ticker'] + self.trades['Display Suffix'].fillna('')
+        self.trades = trade.compute_accumulated_positions(self.trades)
+        self.positions['Date/Time'] = pd.to_datetime(self.positions['Date']) + pd.Timedelta(seconds=86399) # Add 23:59:59 to the date
+        self.positions = trade.add_split_data(self.positions, self.actions)
+        self.positions['Display Name'] = self.positions['Ticker']
+        self.positions.drop(columns=['Ticker'], inplace=True)
+        self.dividends['Display Name'] = self.dividends['Ticker']
+        self.trades['Display Name'] = self.trades['Ticker'].astype(object) + self.trades['Display Suffix'].fillna('')
+
+    def _rename_entries(self) -> set[tuple]:
+        """ Entries of the symbols table as (Symbol, Ticker, Change Date), to find renamed symbols by comparison. """
+        if self.symbols.empty:
+            return set()
+        symbols = self.symbols.reindex(columns=['Ticker', 'Change Date'])
+        return set(zip(symbols.index, symbols['Ticker'], symbols['Change Date'].fillna(pd.NaT)))
 
     def merge_with(self, other: 'State', drop_pairings = True) -> int:
         """ Merge another state into this one, returning the number of new trades. """
@@ -103,14 +238,20 @@ class State:
         self.positions.drop_duplicates(subset=['Symbol', 'Date'], inplace=True)
         self.positions.reset_index(drop=True, inplace=True)
         before = len(self.trades)
+        new_trades = other.trades[~other.trades.index.isin(self.trades.index)]
         self.trades = trade.merge_trades(other.trades, self.trades)
         self.dividends = pd.concat([self.dividends, other.dividends])
         self.dividends.drop_duplicates(inplace=True)
         self.symbols = pd.concat([self.symbols, other.symbols])
         imported_count = len(self.trades) - before
-        if imported_count > 0 and drop_pairings:
-            self.pairings.invalidate_pairs(other.trades['Date/Time'].min())
-        elif not drop_pairings:
+        for table in ['imports', 'positions', 'dividends', 'symbols']:
+            self.record_change(table, 'merged')
+        if len(other.actions) > 0:
+            self.record_change('actions', 'added', other.actions['Symbol'] if 'Symbol' in other.actions.columns else None)
+        if imported_count > 0:
+            self.record_change('trades', 'added', new_trades['Symbol'])
+        # Symbols affected by the new trades get marked for pairing once their positions are recomputed
+        if not drop_pairings:
             self.pairings = other.pairings
         return imported_count
 
@@ -120,35 +261,52 @@ class State:
         new_trades['Display Name'] = new_trades['Symbol']
         self.trades = pd.concat([self.trades, new_trades])
         self.trades.drop_duplicates(inplace=True) # Someone could put in two identical manual trades as there is a preset date. Let's remove them as they would cause trouble with duplicate indices.
-        self.pairings.invalidate_pairs(new_trades['Date/Time'].min())
-        self.recompute_positions()
+        self.record_change('trades', 'added', new_trades['Symbol'])
+        self.recompute_positions(new_trades['Symbol'])
+
+    def edit_trades(self, edited_trades: pd.DataFrame):
+        """ Update trades with edited values, removing those whose quantity was set to zero. """
+        # Edited values need not be among the categories of the columns
+        self.trades = schema.relax(self.trades, edited_trades.columns)
+        self.trades.update(edited_trades)
+        self.record_change('trades', 'modified', edited_trades['Symbol'])
+        removed_trades = edited_trades[edited_trades['Quantity'] == 0]
+        if not removed_trades.empty:
+            self.trades.drop(removed_trades.index, inplace=True)
+            self.record_change('trades', 'removed', removed_trades['Symbol'])
 
-    def normalize_tables(self):
-        """ Ensure that all trades have the same columns and data types. """
-        # TODO: fill in missing columns with default values
-        pass
+    def normalize_tables(self, report: bool = False) -> pd.DataFrame:
+        """ Cast all tables to the column types of their schema, with repeated strings as categories. With report, return memory of the tables before and after in MB. """
+        before = schema.memory_usage({table: getattr(self, table) for table in tables}) if report else None
+        for table in tables:
+            setattr(self, table, schema.enforce(getattr(self, table), table))
+        if report:
+            return pd.DataFrame({'Before': before, 'After': schema.memory_usage({table: getattr(self, table) for table in tables})})
 
 
     def apply_renames(self):
         """ Apply symbol renames by looking them up in the symbols table . """
         def rename_symbols(df: pd.DataFrame, date_column: str) -> pd.DataFrame:
             
-            # Symbols contain a history of renames of each symbol. We need to select the most recent rename that is older than the trade date.
+            # Symbols contain a history of renames of each symbol. We need to select the earliest rename that is not older than the trade date.
             # Entries with no change date are considered to be the original symbol and applies if no other row matches.
-            if not df.empty:
-                df['Ticker'] = df.apply(
-                    lambda row: self.symbols.loc[
-                        (self.symbols.index == row['Symbol']) & 
-                        ((self.symbols['Change Date'].isna()) | (self.symbols['Change Date'] >= row[date_column]))
-                    ].sort_values(by='Change Date', na_position='last').iloc[0]['Ticker'],
-                    axis=1
-                )
-            else:
+            if df.empty:
                 df['Ticker'] = ''
+                return df
+            history = self.symbols.rename_axis('Symbol').reset_index()[['Symbol', 'Ticker', 'Change Date']].astype({'Symbol': object, 'Ticker': object})
+            original = history[history['Change Date'].isna()].drop_duplicates(subset='Symbol').set_index('Symbol')['Ticker']
+            renames = history[history['Change Date'].notna()].sort_values(by='Change Date', kind='stable').drop_duplicates(subset=['Symbol', 'Change Date'])
+            renames['Change Date'] = renames['Change Date'].astype('datetime64[ns]')
+            rows = pd.DataFrame({'Symbol': df['Symbol'].astype(object).to_numpy(), 'Date': pd.to_datetime(df[date_column]).astype('datetime64[ns]').to_numpy(), 'Row': np.arange(len(df))})
+            rows = rows[rows['Date'].notna()].sort_values(by='Date', kind='stable')
+            # One as-of join per table: each row takes the first rename on or after its date
+            renamed = pd.merge_asof(rows, renames, left_on='Date', right_on='Change Date', by='Symbol', direction='forward')
+            tickers = pd.Series(renamed['Ticker'].to_numpy(), index=renamed['Row'].to_numpy()).reindex(np.arange(len(df)))
+            df['Ticker'] = tickers.fillna(pd.Series(df['Symbol'].astype(object).map(original).to_numpy())).to_numpy()
             return df
 
         manual_trades = self.trades[self.trades['Manual'] == True]
-        imported_trades = rename_symbols(self.trades[self.trades['Manual'] == False].reset_index().rename(columns={'index': 'Hash'}), 'Date/Time').set_index('Hash')
+        imported_trades = rename_symbols(self.trades[self.trades['Manual'] == False].reset_index().rename(columns={'index': 'ID'}), 'Date/Time').set_index('ID')
         self.trades = pd.concat([imported_trades, manual_trades])
         self.positions = rename_symbols(self.positions, 'Date')
         self.dividends = rename_symbols(self.dividends, 'Date')
@@ -158,25 +316,22 @@ class State:
         Consult the rename history dataset and and apply it to symbols that do not have an override already set.
         Then perform the renames and recompute the position history.
         """
-        # Load renames table and adjust to match the symbols table
-        renames_table = st.session_state['settings']['rename_history_dir'] + '/renames.csv'
-        renames = pd.read_csv(renames_table, parse_dates=['Change Date'])
-        renames.rename(columns={'New': 'Ticker', 'Old': 'Symbol'}, inplace=True)
-        renames.drop(columns=['New Company Name'], inplace=True)
-        renames['Manual'] = False
-        renames.set_index('Symbol', inplace=True)
+        if self.detect_renames():
+            self.apply_renames()
+            self.trades = trade.compute_accumulated_positions(self.trades)
+
+    def detect_renames(self) -> bool:
+        """ Consult the rename history dataset and apply it to symbols in the symbols table that do not have an override already set. Returns whether there are any renames. """
+        # Renames with chains already followed to the final ticker, shared by all sessions and read again only once the file changes
+        history = rename_history.load(matchmaker.settings['rename_history_dir'] + '/renames.csv')
+        renames = history.table.assign(Manual=False)
 
         # Apply the renames to the symbols table
         kept_symbols = self.symbols[(self.symbols['Change Date'].isna()) | (self.symbols['Manual'] == True)]
-        currency_lookup = kept_symbols.groupby('Symbol')['Currency'].first()
         active_renames = renames[renames.index.isin(self.symbols.index)]
-        active_renames['Currency'] = active_renames.index.map(lambda symbol: currency_lookup[symbol])
+        active_renames['Currency'] = active_renames.index.map(self.symbol_currencies().get)
         active_renames = active_renames[['Ticker', 'Change Date', 'Currency', 'Manual']]
         self.symbols = pd.concat([kept_symbols, active_renames]).drop_duplicates().sort_values(by=['Change Date', 'Symbol'], na_position='last')
         # TODO: The currency doesn't need to be the same in case it was another company that took over the symbol. We'll need to get it from the trades table later. 
-
-        # Now we can adjust the trades for the renames
-        if len(renames) > 0:
-            self.apply_renames()
-            self.trades = trade.compute_accumulated_positions(self.trades)
+        return len(renames) > 0
 
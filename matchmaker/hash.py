@@ -1,8 +1,93 @@
 import hashlib
+import numpy as np
+import pandas as pd
 
-def hash_row(row):
-    row_str = row.to_string()
-    hash_object = hashlib.sha256()
-    hash_object.update(row_str.encode())
-    hash_hex = hash_object.hexdigest()
-    return hash_hex
+# Version of trade identities. Increase it whenever the identity fields or their encoding change, snapshots of older versions get their trades identified again on load.
+HASH_VERSION = 4
+
+# Fields identifying a trade, as (column, kind), in the order they are hashed. Missing columns hash as empty values.
+# Original quantity and price are used since splits adjust the others after import.
+identity_fields = [
+    ('Account', 'text'),
+    ('Currency', 'text'),
+    ('Symbol', 'text'),
+    ('Option Name', 'text'),
+    ('Date/Time', 'time'),
+    ('Orig. Quantity', 'number'),
+    ('Orig. T. Price', 'number'),
+    ('C. Price', 'number'),
+    ('Proceeds', 'number'),
+    ('Comm/Fee', 'number'),
+    ('Basis', 'number'),
+    ('Realized P/L', 'number'),
+    ('MTM P/L', 'number'),
+    ('Code', 'text'),
+    ('Action', 'text'),
+    ('Type', 'text'),
+    ('Target', 'text'),
+]
+
+# Numbers are identified up to this many decimal places, so that values read back from text with their last digit rounded keep their identity
+NUMBER_DECIMALS = 6
+
+_HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """ 64-bit finalizer of MurmurHash3, mixing every input bit into every output bit. """
+    values = values ^ (values >> np.uint64(33))
+    values = values * np.uint64(0xff51afd7ed558ccd)
+    values = values ^ (values >> np.uint64(33))
+    values = values * np.uint64(0xc4ceb53fe1a85ec3)
+    return values ^ (values >> np.uint64(33))
+
+def _text_words(values: pd.Series) -> np.ndarray:
+    """ 64-bit words of text values. Each distinct value is hashed once, empty and missing values are the same. """
+    codes, uniques = pd.factorize(values.astype(object).where(values.notna(), ''))
+    digests = [hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest() for value in uniques]
+    words = np.frombuffer(b''.join(digests), dtype='<u8')
+    return words[codes] if len(words) else np.zeros(len(values), dtype=np.uint64)
+
+def _number_words(values: pd.Series) -> np.ndarray:
+    """ 64-bit words of numbers as integer multiples of 10^-NUMBER_DECIMALS, equal for equal numbers of any type. Missing numbers get a word of their own. """
+    numbers = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    missing = ~np.isfinite(numbers)
+    words = np.rint(np.where(missing, 0.0, numbers) * 10.0**NUMBER_DECIMALS).astype(np.int64).view(np.uint64)
+    words[missing] = np.uint64(0x7ff8000000000000)
+    return words
+
+def _time_words(values: pd.Series) -> np.ndarray:
+    """ 64-bit words of times in nanoseconds. """
+    return pd.to_datetime(values).to_numpy(dtype='datetime64[ns]').view(np.int64).view(np.uint64)
+
+_encoders = {'text': _text_words, 'number': _number_words, 'time': _time_words}
+
+def _hash_lanes(df: pd.DataFrame) -> list[np.ndarray]:
+    """ Two independent 64-bit lanes per row mixed from the words of all identity fields. """
+    count = len(df)
+    lanes = [np.full(count, _mix(np.array([HASH_VERSION * 2 + lane], dtype=np.uint64))[0], dtype=np.uint64) for lane in (1, 2)]
+    with np.errstate(over='ignore'):
+        for position, (column, kind) in enumerate(identity_fields):
+            values = df[column] if column in df.columns else pd.Series(np.nan, index=df.index)
+            words = _encoders[kind](values)
+            for lane, seed in zip(lanes, (0x9e3779b97f4a7c15, 0xc2b2ae3d27d4eb4f)):
+                lane[:] = _mix(lane ^ _mix(words + np.uint64((seed * (position + 1)) & 0xffffffffffffffff)))
+    return lanes
+
+def hash_rows(df: pd.DataFrame) -> pd.Series:
+    """
+    Identities of all trades of the DataFrame as 32 hexadecimal digits, computed from the identity fields in one pass over columns.
+    Every field is encoded into a 64-bit word per row, and the words are mixed into two independent 64-bit lanes.
+    Used as the key of trades outside of the application, see trade_ids for the one used within it.
+    """
+    lanes = _hash_lanes(df)
+    # Both lanes as big-endian bytes, written out as hexadecimal digits
+    digest = np.stack(lanes, axis=1).astype('>u8').view(np.uint8).reshape(len(df), 16)
+    digits = np.empty((len(df), 32), dtype=np.uint8)
+    digits[:, 0::2] = _HEX_DIGITS[digest >> 4]
+    digits[:, 1::2] = _HEX_DIGITS[digest & 15]
+    return pd.Series(digits.view('S32').ravel().astype(str).astype(object), index=df.index, dtype=object)
+
+def trade_ids(df: pd.DataFrame) -> pd.Series:
+    """ Compact identities of all trades of the DataFrame as 64-bit integers, the first lane of their hash (the leading 16 digits of hash_rows). """
+    return pd.Series(_hash_lanes(df)[0].view(np.int64), index=df.index, name='ID')
@@ -1,3 +1,4 @@
+import codecs
 import re
 import pandas as pd
 import numpy as np
@@ -6,6 +7,7 @@ from matchmaker.trade import normalize_trades
 import matchmaker.actions as actions
 import matchmaker.position as position
 import matchmaker.data as data
+import matchmaker.hash as hash
 
 def dataframe_from_prefixed_lines(line_dict: dict, prefix: str) -> pd.DataFrame:
     """
@@ -31,6 +33,36 @@ def parse_csv_into_prefixed_lines(file: io.BytesIO) -> dict:
         prefix_dict[key].append(line)
     return prefix_dict
 
+# Version of the parsing below. Increase it with every change of the imported tables, so that statements cached by an older version are parsed again.
+PARSER_VERSION = 6
+
+# Sections of the activity statement read by the importers. Lines of other sections are skipped without decoding.
+statement_sections = ('Statement', 'Account Information', 'Trades', 'Corporate Actions', 'Transfers', 'Dividends', 'Withholding Tax', 'Mark-to-Market Performance Summary')
+
+def parse_statement_sections(file: io.BytesIO, sections: tuple[str, ...] = statement_sections) -> dict[str, pd.DataFrame]:
+    """
+    Read the statement once and return a DataFrame for each of the wanted sections found in it.
+    Lines are grouped by their section prefix as raw bytes, so only the wanted sections are ever decoded and parsed.
+    Repeated headers stay in the data as rows, like before, so that column types and trade hashes don't change.
+    """
+    wanted = {section.encode('utf-8') for section in sections}
+    found = {}
+    file.seek(0)
+    for number, line in enumerate(file):
+        if number == 0:
+            line = line.removeprefix(codecs.BOM_UTF8)
+        prefix = line.partition(b',')[0]
+        if prefix not in wanted:
+            continue
+        if not line.endswith(b'\n'):
+            line += b'\n'
+        found.setdefault(prefix, []).append(line)
+    return {prefix.decode('utf-8'): pd.read_csv(io.BytesIO(b''.join(lines))) for prefix, lines in found.items()}
+
+def section_dataframe(sections: dict, name: str) -> pd.DataFrame:
+    """ DataFrame of a parsed statement section, empty if the statement doesn't have it. """
+    return sections.get(name, pd.DataFrame())
+
 def convert_option_names(df: pd.DataFrame) -> pd.DataFrame:
     """
     Convert raw option names into detailed option fields
@@ -68,11 +100,11 @@ def convert_option_names(df: pd.DataFrame) -> pd.DataFrame:
 
 # Data begins on the second line
 # Example line: Trades,Data,Order,Stocks,CZK,CEZ,"2023-08-03, 08:44:03",250,954,960,-238500,-763.2,239263.2,0,1500,O
-def import_trades(lines: dict) -> pd.DataFrame:
+def import_trades(sections: dict) -> pd.DataFrame:
     """
     Import the trades section from IBKR format.
     """
-    df = dataframe_from_prefixed_lines(lines, 'Trades')
+    df = section_dataframe(sections, 'Trades')
     if df.empty:
         df = pd.DataFrame(columns=['Trades', 'Header', 'DataDiscriminator', 'Asset Category', 'Currency', 'Symbol', 'Date/Time', 'Quantity', 'T. Price', 'C. Price', 'Proceeds', 'Comm/Fee', 'Basis', 'Realized P/L', 'MTM P/L', 'Code'])
     df = df[(df['Trades'] == 'Trades') & (df['Header'] == 'Data') & (df['DataDiscriminator'] == 'Order') & ((df['Asset Category'] == 'Stocks') | (df['Asset Category'] == 'Equity and Index Options'))]
@@ -84,73 +116,75 @@ def import_trades(lines: dict) -> pd.DataFrame:
     df.drop(columns=['Trades', 'Header', 'DataDiscriminator', 'Asset Category',], inplace=True)
     return normalize_trades(df)
 
-def import_corporate_actions(lines: dict) -> pd.DataFrame:
+# Grammars of corporate action descriptions as (action, pattern, regex flags, ratio computed from the matched groups).
+# Each description gets the action of the first grammar matching it. Groups named 'symbol' and 'target' fill in the symbol and target of the action.
+action_grammars = [
+    # AAPL(US0378331005) Split 4 for 1 (AAPL, APPLE INC, US0378331005)
+    ('Split', r'(?P<symbol>[\w\.]+)\(\w+\) Split (?P<new>\d+) for (?P<old>\d+)', re.IGNORECASE,
+     lambda groups: groups['old'].astype(float) / groups['new'].astype(float)),
+    # GE(US3696043013) Spinoff  1 for 4 (GEHC, GE HEALTHCARE TECHNOLOGIES INC, US36266G1076)
+    ('Spinoff', r'^(?P<parent>\w+)\(\w+\) Spinoff\s+(?P<new>\d+) for (?P<old>\d+) \((?P<symbol>\w+),.+\)', re.IGNORECASE,
+     lambda groups: groups['new'].astype(float) / groups['old'].astype(float)),
+    # Stock bought by another: ATVI(US00507V1098) Merged(Acquisition) FOR USD 95.00 PER SHARE
+    ('Acquisition', r'^(?P<symbol>\w+)\(\w+\) Merged\(Acquisition\) FOR (?P<currency>\w+) (?P<price>\d+\.\d+) PER SHARE', re.IGNORECASE,
+     lambda groups: groups['price'].astype(float)),
+    # Converted to other stock: MRO(US5658491064) Merged(Acquisition) WITH US20825C1045 255 for 1000 (COP, CONOCOPHILLIPS, US20825C1045)
+    ('Acquisition', r'^(?P<target>\w+)\(\w+\) Merged\(Acquisition\) WITH (?P<isin>\w+) (?P<new>\d+) for (?P<old>\d+) \((?P<symbol>\w+),', re.IGNORECASE,
+     lambda groups: groups['old'].astype(float) / groups['new'].astype(float)),
+    # Any other action of a known symbol
+    ('Unknown', r'^(?P<symbol>\w+)\(\w+\)', 0, lambda groups: 0.0),
+    ('Dividend', r'Dividend', 0, None),
+]
+
+def parse_action_descriptions(descriptions: pd.Series) -> pd.DataFrame:
+    """
+    Parse corporate action descriptions into their action, symbol, ratio and target by action_grammars.
+    Each grammar is one vectorized pass over the descriptions not matched by the previous ones. Descriptions matching none are 'Unknown'.
+    """
+    count = len(descriptions)
+    action = np.full(count, 'Unknown', dtype=object)
+    symbol, ratio, target = np.full(count, None, dtype=object), np.full(count, None, dtype=object), np.full(count, None, dtype=object)
+    unmatched = np.arange(count)
+    for grammar_action, pattern, flags, grammar_ratio in action_grammars:
+        if len(unmatched) == 0:
+            break
+        groups = descriptions.iloc[unmatched].str.extract(f'(?P<match>{pattern})', flags=flags)
+        matched = groups['match'].notna().to_numpy()
+        groups, positions = groups[matched], unmatched[matched]
+        action[positions] = grammar_action
+        if 'symbol' in groups.columns:
+            symbol[positions] = groups['symbol'].to_numpy()
+        if 'target' in groups.columns:
+            target[positions] = groups['target'].to_numpy()
+        if grammar_ratio is not None:
+            ratio[positions] = pd.Series(grammar_ratio(groups), index=groups.index).to_numpy()
+        unmatched = unmatched[~matched]
+    return pd.DataFrame({'Action': action, 'Symbol': symbol, 'Ratio': ratio, 'Target': target}, index=descriptions.index).infer_objects()
+
+def import_corporate_actions(sections: dict) -> pd.DataFrame:
     """
     Import corporate actions from IBKR format.
     """
-    df = dataframe_from_prefixed_lines(lines, 'Corporate Actions')
+    df = section_dataframe(sections, 'Corporate Actions')
     if df.empty:
         df = pd.DataFrame(columns=['Corporate Actions', 'Header', 'Asset Category', 'Currency', 'Report Date', 'Date/Time', 'Description', 'Quantity', 'Proceeds', 'Value', 'Realized P/L', 'Action', 'Symbol', 'Ratio', 'Code', 'Target'])
     df = df[df['Asset Category'] == 'Stocks']
     df.drop(columns=['Corporate Actions', 'Header', 'Asset Category'], inplace=True)
     
-    def parse_action_text(text: str) -> tuple:
-        action, symbol, ratio, target = parse_split_text(text)
-        if not action:
-            action, symbol, ratio, target = parse_spinoff_text(text)
-        if not action:
-            action, symbol, ratio, target = parse_acquisition_text(text)
-        if not action:
-            match = re.search(r'^(\w+)\(\w+\)', text)
-            if match:
-                action, symbol, ratio, target = 'Unknown', match.group(1), 0.0, None
-        if not action and 'Dividend' in text:
-            action, symbol, ratio, target = 'Dividend', None, None, None
-        if not action:
-            action, symbol, ratio, target = 'Unknown', None, None, None
-        return action, symbol, ratio, target
-    
-    def parse_split_text(text: str) -> tuple:
-        match = re.search(r'([\w\.]+)\(\w+\) Split (\d+) for (\d+)', text, re.IGNORECASE)
-        if match:
-            ratio = float(match.group(3)) / float(match.group(2))
-            return 'Split', match.group(1), ratio, None
-        return None, None, None, None
-    
-    def parse_spinoff_text(text: str) -> tuple:
-        match = re.search(r'^(\w+)\(\w+\) Spinoff\s+(\d+) for (\d+) \((\w+),.+\)', text, re.IGNORECASE)
-        if match:
-            ratio = float(match.group(2)) / float(match.group(3))
-            return 'Spinoff', match.group(4), ratio, None
-        return None, None, None, None
-    
-    def parse_acquisition_text(text: str) -> tuple:
-        # Stock bought by another: ATVI(US00507V1098) Merged(Acquisition) FOR USD 95.00 PER SHARE
-        match = re.search(r'^(\w+)\(\w+\) Merged\(Acquisition\) FOR (\w+) (\d+\.\d+) PER SHARE', text, re.IGNORECASE)
-        if match:
-            ratio = float(match.group(3))
-            return 'Acquisition', match.group(1), ratio, None
-        # Converted to other stock: MRO(US5658491064) Merged(Acquisition) WITH US20825C1045 255 for 1000 (COP, CONOCOPHILLIPS, US20825C1045)
-        match = re.search(r'^(\w+)\(\w+\) Merged\(Acquisition\) WITH (\w+) (\d+) for (\d+) \((\w+),', text, re.IGNORECASE)
-        if match:
-            ratio = float(match.group(4)) / float(match.group(3))
-            return 'Acquisition', match.group(5), ratio, match.group(1)
-        return None, None, None, None
-    
     df['Quantity'] = pd.to_numeric(df['Quantity'].astype(str).str.replace(',', ''), errors='coerce')
     df['Date/Time'] = pd.to_datetime(df['Date/Time'], format='%Y-%m-%d, %H:%M:%S')
-    if not df.empty:
-        df[['Action', 'Symbol', 'Ratio', 'Target']] = df['Description'].apply(lambda x: pd.Series(parse_action_text(x)))
+    # Also sections with no stock actions, like those with only a total row, get the parsed columns
+    df[['Action', 'Symbol', 'Ratio', 'Target']] = parse_action_descriptions(df['Description'].astype(object))
     df.drop(columns=['Code'], inplace=True)
     df = actions.convert_action_columns(df)
     return df
 
-def import_open_positions(lines: dict, date_from: pd.Timestamp, date_to: pd.Timestamp) -> pd.DataFrame:
+def import_open_positions(sections: dict, date_from: pd.Timestamp, date_to: pd.Timestamp) -> pd.DataFrame:
     """
     Import open positions from IBKR format.
     """
     # Old format that doesn't reflect symbol changes
-    df = dataframe_from_prefixed_lines(lines, 'Mark-to-Market Performance Summary')
+    df = section_dataframe(sections, 'Mark-to-Market Performance Summary')
     if df.empty:
         # Mark-to-Market Performance Summary,Header,Asset Category,Symbol,Prior Quantity,Current Quantity,Prior Price,
         # Current Price,Mark-to-Market P/L Position,Mark-to-Market P/L Transaction,Mark-to-Market P/L Commissions,Mark-to-Market P/L Other,Mark-to-Market P/L Total,Code
@@ -162,11 +196,11 @@ def import_open_positions(lines: dict, date_from: pd.Timestamp, date_to: pd.Time
     df['Current Date'] = date_to
     return position.convert_position_history_columns(df)
 
-def import_transfers(list: dict) -> pd.DataFrame:
+def import_transfers(sections: dict) -> pd.DataFrame:
     """
     Import transfers from IBKR format.
     """
-    df = dataframe_from_prefixed_lines(list, 'Transfers')
+    df = section_dataframe(sections, 'Transfers')
     if df.empty:
         # Transfers,Header,Asset Category,,Currency,Symbol,Date,Type,Direction,Xfer Company,Xfer Account,Qty,Xfer Price,Market Value,Realized P/L,Cash Amount,Code
         df = pd.DataFrame(columns=['Transfers', 'Header', 'Asset Category', 'Currency', 'Symbol', 'Date', 'Type', 'Direction', 'Xfer Company', 'Xfer Account', 'Qty', 'Xfer Price', 'Market Value', 'Realized P/L', 'Cash Amount', 'Code'])
@@ -190,29 +224,30 @@ def generate_transfers_from_actions(actions: pd.DataFrame) -> pd.DataFrame:
     """
     Generate asset transfers from a list of corporate actions.
     """
-    spinoffs = actions[(actions['Action'] == 'Spinoff') | (actions['Action'] == 'Acquisition')]
-    transfers = pd.DataFrame()
-    for index, spinoff in spinoffs.iterrows():
-        proceeds = spinoff['Proceeds'] if (spinoff['Action'] != 'Acquisition') | (spinoff['Proceeds'] != 0) else -spinoff['Value']
-        transfer = {
-            'Date/Time': spinoff['Date/Time'] - pd.Timedelta(seconds=1),
-            'Currency': spinoff['Currency'],
-            'Symbol': spinoff['Symbol'],
-            'Quantity': spinoff['Quantity'],
-            'Proceeds': proceeds,
-            'Comm/Fee': 0,
-            'Basis': 0,
-            'Realized P/L': spinoff['Realized P/L'],
-            'MTM P/L': 0,
-            'T. Price': abs(proceeds / spinoff['Quantity'] if spinoff['Quantity'] != 0 else 0),
-            'C. Price': 0,
-            'Action': 'Open' if spinoff['Quantity'] >= 0 else 'Close',
-            'Type': spinoff['Action'],
-        }
-        transfers = pd.concat([transfers, pd.DataFrame([transfer])], ignore_index=True)
+    spinoffs = actions[actions['Action'].isin(['Spinoff', 'Acquisition'])]
+    if spinoffs.empty:
+        return normalize_trades(pd.DataFrame())
+    # Acquisitions for stock have no proceeds, the acquired stock is transferred at its value
+    proceeds = spinoffs['Proceeds'].where((spinoffs['Action'] != 'Acquisition') | (spinoffs['Proceeds'] != 0), -spinoffs['Value'])
+    quantity = spinoffs['Quantity']
+    transfers = pd.DataFrame({
+        'Date/Time': spinoffs['Date/Time'] - pd.Timedelta(seconds=1),
+        'Currency': spinoffs['Currency'],
+        'Symbol': spinoffs['Symbol'],
+        'Quantity': quantity,
+        'Proceeds': proceeds,
+        'Comm/Fee': 0,
+        'Basis': 0,
+        'Realized P/L': spinoffs['Realized P/L'],
+        'MTM P/L': 0,
+        'T. Price': np.where(quantity != 0, (proceeds / quantity.where(quantity != 0)).abs(), 0),
+        'C. Price': 0,
+        'Action': np.where(quantity >= 0, 'Open', 'Close'),
+        'Type': spinoffs['Action'],
+    }).reset_index(drop=True)
     return normalize_trades(transfers)
 
-def import_dividends(lines: dict) -> pd.DataFrame:
+def import_dividends(sections: dict) -> pd.DataFrame:
     """
     Import dividends and withholding taxes on those dividends.
     """
@@ -221,7 +256,7 @@ def import_dividends(lines: dict) -> pd.DataFrame:
     # Dividends,Data,EUR,2024-03-22,UNA.DIVRT(NL0015001YU5) Expire Dividend Right (Ordinary Dividend),17.07
     # Dividends,Data,USD,2024-03-05,JNJ(US4781601046) Cash Dividend USD 1.19 per Share (Ordinary Dividend),11.9
     # We will ignore the first for now
-    divi = dataframe_from_prefixed_lines(lines, 'Dividends')
+    divi = section_dataframe(sections, 'Dividends')
     if divi.empty:
         return pd.DataFrame(columns=['Symbol', 'Display Name', 'Currency', 'Date', 'Ratio', 'Amount'])
     divi = divi[~pd.isna(divi['Date'])]
@@ -244,7 +279,7 @@ def import_dividends(lines: dict) -> pd.DataFrame:
     
     # Withholding Tax,Header,Currency,Date,Description,Amount,Code
     # Withholding Tax,Data,USD,2024-03-05,JNJ(US4781601046) Cash Dividend USD 1.19 per Share - US Tax,-3.57,
-    withhold = dataframe_from_prefixed_lines(lines, 'Withholding Tax')
+    withhold = section_dataframe(sections, 'Withholding Tax')
     if withhold.empty:
         return divi
     withhold = withhold[~pd.isna(withhold['Date'])]
@@ -269,29 +304,27 @@ def import_activity_statement(file: io.BytesIO) -> data.State:
     """
     Import the entire IBKR activity statement, returning dataframes for trades, actions and open positions.
     """
-    file.seek(0)
-    # 2nd line: Statement,Data,Title,Activity Statement
-    # 3rd line: Statement,Data,Period,"April 13, 2020 - April 12, 2021"
-    while line := file.readline().decode('utf-8'):
-        if line.startswith('Statement,Data,Title,Activity '):
-            break
-    match_period = re.match('Statement,Data,Period,"(.+) - (.+)"', file.readline().decode('utf-8'))
+    sections = parse_statement_sections(file)
+    # Statement,Data,Title,Activity Statement
+    # Statement,Data,Period,"April 13, 2020 - April 12, 2021"
+    statement = section_dataframe(sections, 'Statement')
+    fields = dict(zip(statement['Field Name'], statement['Field Value'])) if 'Field Name' in statement.columns else {}
+    match_period = re.match('(.+) - (.+)', str(fields.get('Period', ''))) if str(fields.get('Title', '')).startswith('Activity ') else None
     if not match_period:
         raise Exception('No period in IBKR Activity Statement')
-    lines = parse_csv_into_prefixed_lines(file)
 
     # Convert to from and to dates
     from_date = pd.to_datetime(match_period.group(1), format='%B %d, %Y')
     to_date = pd.to_datetime(match_period.group(2), format='%B %d, %Y')    
-    trades = import_trades(lines)
-    actions = import_corporate_actions(lines)
-    open_positions = import_open_positions(lines, from_date, to_date)
-    transfers = import_transfers(lines)
-    dividends = import_dividends(lines)
+    trades = import_trades(sections)
+    actions = import_corporate_actions(sections)
+    open_positions = import_open_positions(sections, from_date, to_date)
+    transfers = import_transfers(sections)
+    dividends = import_dividends(sections)
     transfers = pd.concat([transfers, generate_transfers_from_actions(actions)])
     trades = pd.concat([trades, transfers])
     # Fill in account info into trades so open positions can be computed and verified per account
-    account_info = dataframe_from_prefixed_lines(lines, 'Account Information')
+    account_info = section_dataframe(sections, 'Account Information')
     account_str = account_info[account_info['Field Name'] == 'Account'].iloc[0]['Field Value']
     match = re.match(r'U\d+', account_str)
     if match:
@@ -300,7 +333,9 @@ def import_activity_statement(file: io.BytesIO) -> data.State:
         raise ValueError("No account name/number found in account information. This is needed to match transfers between accounts. If you don't wish to disclose that, simply replace them with aliases.")
     if 'Account' not in trades.columns:
         trades['Account'] = account
-    trades['Account'].fillna(account, inplace=True)
+    trades['Account'] = trades['Account'].fillna(account)
+    # The account is part of the trade identity, so the trades are identified once it is known
+    trades.index = pd.Index(hash.trade_ids(trades).to_numpy(), name='ID')
     open_positions['Account'] = account
 
     imported = pd.DataFrame({
@@ -1,5 +1,10 @@
+import concurrent.futures
+import io
+import os
 import pandas as pd
-import streamlit as st
+import matchmaker
+import matchmaker.cache as cache
+import matchmaker.schema as schema
 import matchmaker.ibkr as ibkr
 import matchmaker.snapshot as snapshot
 import matchmaker.data as data
@@ -8,10 +13,7 @@ def convert_import_history_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
     Convert columns of the import history DataFrame to appropriate types.
     """
-    df['From'] = pd.to_datetime(df['From'])
-    df['To'] = pd.to_datetime(df['To'])
-    df['Trade Count'] = pd.to_numeric(df['Trade Count'], errors='coerce')
-    return df
+    return schema.enforce(df, 'imports', categorize=False)
 
 def merge_import_intervals(imports: pd.DataFrame) -> pd.DataFrame:
     """ Merge intervals of imported trades together if they form a largerc ontinuous interval. """
@@ -36,16 +38,111 @@ def merge_import_intervals(imports: pd.DataFrame) -> pd.DataFrame:
     return imports
 
 
+def statement_cache() -> cache.StatementCache:
+    """ Disk cache of parsed statements set up in settings, None if it is turned off. """
+    directory = matchmaker.settings.get('statement_cache_dir')
+    if not directory:
+        return None
+    return cache.StatementCache(directory, matchmaker.settings.get('statement_cache_mb', cache.STATEMENT_CACHE_SIZE // 2**20) * 2**20)
+
+def import_statement(file) -> data.State:
+    """ Import an IBKR activity statement, taking its tables from the statement cache if the same file was parsed before. """
+    statements = statement_cache()
+    if statements is None:
+        return ibkr.import_activity_statement(file)
+    key = statements.key(file.getvalue(), ibkr.PARSER_VERSION)
+    tables = statements.load(key)
+    if tables is not None and all(table in tables for table in data.tables):
+        imported = data.State()
+        for table in data.tables:
+            setattr(imported, table, tables[table])
+        return imported
+    imported = ibkr.import_activity_statement(file)
+    statements.save(key, {table: getattr(imported, table) for table in data.tables})
+    return imported
+
 def import_trade_file(file) -> data.State:
     try:
         if snapshot.is_snapshot(file):
             imported = snapshot.load_snapshot(file)
         else:
-            imported = ibkr.import_activity_statement(file)
+            imported = import_statement(file)
     except Exception as e:
-        st.error(f'Error importing trades. File {file.name} does not contain the expected format. Error: {e}')
-        return data.State()
+        raise ValueError(f'Error importing trades. File {file.name} does not contain the expected format. Error: {e}') from e
     
     imported.normalize_tables()
     return imported
     
+
+class NamedFile(io.BytesIO):
+    """ Content of an uploaded file with its name, which can be sent to worker processes unlike the upload itself. """
+    def __init__(self, name: str, content: bytes):
+        super().__init__(content)
+        self.name = name
+
+def _import_file_job(job) -> tuple[data.State, str]:
+    name, content = job
+    try:
+        return import_trade_file(NamedFile(name, content)), None
+    except ValueError as e:
+        return None, str(e)
+
+def import_trade_files(files: list, workers: int = 0, progress=None) -> list[tuple[data.State, str]]:
+    """
+    Import snapshots and IBKR statements, in a process pool if there are more of them. Return (state, error) of each file in the order of the files,
+    the state is None if the file couldn't be imported. Progress is called with the name and error of each file as soon as it is imported.
+    """
+    jobs = [(file.name, file.getvalue()) for file in files]
+    if workers is None or workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        results = []
+        for job in jobs:
+            results.append(_import_file_job(job))
+            if progress is not None:
+                progress(job[0], results[-1][1])
+        return results
+
+    results = [None] * len(jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_import_file_job, job): i for i, job in enumerate(jobs)}
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            if progress is not None:
+                progress(jobs[i][0], results[i][1])
+    return results
+
+def combine_states(states: list[data.State]) -> data.State:
+    """ Combine imported states into one. Later files take precedence over earlier ones, the same as if they were merged one by one. """
+    combined = data.State()
+    if not states:
+        return combined
+    latest_first = states[::-1]
+    combined.imports = pd.concat([state.imports for state in states]).drop_duplicates()
+    actions = [state.actions for state in latest_first if len(state.actions) > 0]
+    if actions:
+        combined.actions = pd.concat(actions)
+    combined.positions = pd.concat([state.positions for state in latest_first])
+    combined.positions.drop_duplicates(subset=['Symbol', 'Date'], inplace=True)
+    combined.positions.reset_index(drop=True, inplace=True)
+    trades = pd.concat([state.trades for state in latest_first])
+    combined.trades = trades[~trades.index.duplicated(keep='first')]
+    combined.dividends = pd.concat([state.dividends for state in states]).drop_duplicates()
+    combined.symbols = pd.concat([state.symbols for state in states])
+    # Only snapshots come with pairings, the first of them is taken
+    combined.pairings = next((state.pairings for state in states if not state.pairings.is_empty()), states[0].pairings)
+    return combined
+
+def merge_imported_states(state: data.State, imported: list[data.State]) -> int:
+    """ Merge imported states into the state in a single step, return the number of new trades. """
+    if not imported:
+        return 0
+    combined = combine_states(imported)
+    # Statements have no pairings, which must not replace those of the state
+    imported_count = state.merge_with(combined, drop_pairings=combined.pairings.is_empty())
+    state.actions.drop_duplicates(inplace=True)
+    state.imports = merge_import_intervals(state.imports)
+    state.normalize_tables()
+    return imported_count
@@ -0,0 +1,647 @@
+import bisect
+import collections
+import heapq
+import os
+import concurrent.futures
+import numpy as np
+import pandas as pd
+
+# Sales of positions held for at least this many days are exempt from tax (the 3-year time test)
+TAX_FREE_DAYS = 3 * 365
+_TAX_FREE_NS = TAX_FREE_DAYS * 24 * 3600 * 10**9
+
+# Each strategy covers a sell by going through the open lots in one or more passes of (lot order, lot filter)
+strategy_commands = {
+    # FIFO is easy, just take the oldest lots first
+    'FIFO': [('FIFO', 'All')],
+    # LIFO should prefer oldest not taxable transactions, then youngest taxable transactions
+    'LIFO': [('FIFO', 'IgnoreTaxable'), ('LIFO', 'All')],
+    # Pair like IBKR would compute P/L from average price of all buy orders
+    'AverageCost': [('AverageCost', 'All')],
+    'MaxLoss': [('MaxProfit', 'IgnoreTaxable'), ('MaxLoss', 'All')],
+    # Untaxed lots are taken youngest first, then the cheapest lots to maximize the profit
+    'MaxProfit': [('LIFO', 'IgnoreTaxable'), ('MaxProfit', 'All')],
+    # Minimize the taxable revenue over all sells of the symbol at once, solved as a min-cost flow
+    'Optimal': [('Optimal', 'All')],
+}
+
+# Smaller inputs are paired serially, starting worker processes would take longer than the pairing itself
+PARALLEL_MIN_TRADES = 20000
+# Optimal pairs each stretch of a symbol's trades between closings of the whole position at once, in time growing faster than the stretch.
+# A stretch this long takes up to a few seconds, so Optimal is offered only for trades without longer ones.
+OPTIMAL_MAX_STRETCH = 1000
+
+pair_columns = ['Sell Transaction', 'Buy Transaction', 'Display Name', 'Currency', 'Quantity', 'Buy Time', 'Sell Time', 'Buy Price', 'Sell Price',
+                'Buy Cost', 'Sell Proceeds', 'Cost', 'Proceeds', 'Ratio', 'Type', 'Taxable']
+
+
+class SymbolLots:
+    """ Trades of a single symbol prepared for pairing. Sells are kept in statement order, open lots are split by direction and ordered by time. """
+    def __init__(self, symbol: str, positions: np.ndarray, times: np.ndarray, years: np.ndarray, quantities: np.ndarray, prices: np.ndarray, actions: np.ndarray,
+                 values: np.ndarray = None):
+        self.symbol = symbol
+        """ Positions of the symbol's trades in the full trades table. """
+        self.positions = positions
+        self.times = times
+        self.years = years
+        self.quantities = quantities
+        self.prices = prices
+        """ Proceeds including fees per unit. """
+        self.values = values
+        self.sells = np.flatnonzero(actions == 'Close')
+        opens = np.flatnonzero(actions == 'Open')
+        """ All open lots, newest first, as averaging goes through them. Ties keep the statement order. """
+        self.opens_newest = opens[np.lexsort((opens, -times[opens]))]
+        self.opens_newest_times = times[self.opens_newest]
+        """ Open lots per direction (+1 long, -1 short) ordered by time. A sell is covered only by lots of the opposite direction. """
+        self.lots = {}
+        for direction in (1, -1):
+            lots = opens[np.sign(quantities[opens]) == direction]
+            self.lots[direction] = lots[np.argsort(times[lots], kind='stable')]
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class _LotBook:
+    """
+    Open lots of one direction, ordered by time. Skip pointers jump over fully covered lots, so the book behaves
+    as a FIFO deque from the left and a LIFO stack from the right of any time prefix. Price ordering uses lazily filled heaps.
+    """
+    def __init__(self, lots: SymbolLots, direction: int, uncovered: list):
+        self.indices = lots.lots[direction].tolist()
+        self.times = lots.times[lots.lots[direction]].tolist()
+        self.prices = lots.prices
+        self.uncovered = uncovered
+        count = len(self.indices)
+        self._next = list(range(count + 1))
+        self._prev = list(range(count + 1))
+        self._heaps = {}
+        for i, index in enumerate(self.indices):
+            if not uncovered[index] > 0:
+                self.remove(i)
+
+    def limit(self, time: int) -> int:
+        """ Number of lots opened up to the given time. """
+        return bisect.bisect_right(self.times, time)
+
+    def is_open(self, i: int) -> bool:
+        return self.uncovered[self.indices[i]] > 0
+
+    def remove(self, i: int):
+        """ Mark the lot as fully covered. """
+        self._next[i] = i + 1
+        self._prev[i + 1] = i
+
+    def _first_open(self, i: int) -> int:
+        parent = self._next
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def _last_open(self, i: int) -> int:
+        parent = self._prev
+        i += 1
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i - 1
+
+    def next_lot(self, order: str, limit: int):
+        """ Return the position of the next open lot among the first `limit` lots in the given order, or None. """
+        if order == 'FIFO':
+            i = self._first_open(0)
+            return i if i < limit else None
+        if order == 'LIFO':
+            i = self._last_open(limit - 1)
+            if i < 0:
+                return None
+            # Lots opened at the same time keep their statement order
+            return self._first_open(bisect.bisect_left(self.times, self.times[i]))
+        return self._next_by_price(order, limit)
+
+    def _next_by_price(self, order: str, limit: int):
+        heap, state = self._heaps.setdefault(order, ([], {'pushed': 0, 'deferred': []}))
+        sign = -1.0 if order == 'MaxLoss' else 1.0
+        for i in range(state['pushed'], limit):
+            index = self.indices[i]
+            heapq.heappush(heap, (sign * self.prices[index], index, i))
+        state['pushed'] = max(state['pushed'], limit)
+        # Lots deferred by an earlier sell that happened to be later in time than this one
+        if state['deferred']:
+            kept = [entry for entry in state['deferred'] if entry[2] >= limit]
+            for entry in state['deferred']:
+                if entry[2] < limit:
+                    heapq.heappush(heap, entry)
+            state['deferred'] = kept
+        while heap:
+            i = heap[0][2]
+            if not self.is_open(i):
+                heapq.heappop(heap)
+            elif i >= limit:
+                state['deferred'].append(heapq.heappop(heap))
+            else:
+                return i
+        return None
+
+
+def prepare_lots(trades: pd.DataFrame) -> list[SymbolLots]:
+    """ Split trades into per-symbol lots ready for pairing. """
+    times = trades['Date/Time'].values.astype('datetime64[ns]').view(np.int64)
+    years = trades['Year'].to_numpy()
+    quantities = trades['Quantity'].to_numpy(dtype=np.float64)
+    prices = trades['T. Price'].to_numpy(dtype=np.float64)
+    actions = trades['Action'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = (trades['Proceeds'].to_numpy(dtype=np.float64) + trades['Comm/Fee'].to_numpy(dtype=np.float64)) / quantities
+    groups = trades.groupby('Display Name', observed=True).indices
+    return [SymbolLots(symbol, positions, times[positions], years[positions], quantities[positions], prices[positions], actions[positions], values[positions])
+            for symbol, positions in sorted(groups.items())]
+
+
+def longest_open_stretch(trades: pd.DataFrame) -> int:
+    """ Most trades of a symbol made in a row without the position getting closed in between. """
+    if trades.empty:
+        return 0
+    trades = trades.sort_values(by='Date/Time', kind='stable')
+    symbols = trades['Display Name'].to_numpy()
+    closed = np.isclose(trades.groupby(symbols, sort=False)['Quantity'].cumsum().to_numpy(dtype=np.float64), 0.0)
+    # Trades up to and including the one closing the position form a stretch
+    stretches = pd.Series(closed, index=trades.index).groupby(symbols, sort=False).cumsum() - closed
+    return int(trades.groupby([symbols, stretches.to_numpy()], sort=False).size().max())
+
+
+def _in_years(year: int, from_year: int, to_year: int) -> bool:
+    return (from_year is None or year >= from_year) and (to_year is None or year <= to_year)
+
+
+def pair_symbol(lots: SymbolLots, strategy: str, from_year: int, uncovered: np.ndarray, covered: np.ndarray, to_year: int = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pair sells of one symbol with its open lots according to the strategy. Uncovered and covered quantities of the symbol's trades are updated in place.
+    Returns local indices of sells and lots forming the pairs and the paired quantities, in the order the pairs were created.
+    """
+    if strategy == 'AverageCost':
+        return _pair_average_cost(lots, from_year, uncovered, covered, to_year)
+    if strategy == 'Optimal':
+        return _pair_optimal(lots, from_year, uncovered, covered, to_year)
+
+    commands = strategy_commands[strategy]
+    uncovered_list = uncovered.tolist()
+    covered_list = covered.tolist()
+    books = {}
+    sells, buys, quantities = [], [], []
+    for s in lots.sells:
+        if uncovered_list[s] == 0 or not _in_years(lots.years[s], from_year, to_year):
+            continue
+        # Sells are covered by lots of the opposite direction
+        direction = -1 if lots.quantities[s] > 0 else 1 if lots.quantities[s] < 0 else 0
+        if direction == 0:
+            continue
+        if direction not in books:
+            books[direction] = _LotBook(lots, direction, uncovered_list)
+        book = books[direction]
+        sell_time = lots.times[s]
+        for order, lot_filter in commands:
+            limit = book.limit(sell_time - _TAX_FREE_NS if lot_filter == 'IgnoreTaxable' else sell_time)
+            while uncovered_list[s] != 0:
+                i = book.next_lot(order, limit)
+                if i is None:
+                    break
+                b = book.indices[i]
+                assert (uncovered_list[b] * uncovered_list[s]) < 0, f"Buy and sell quantities must have opposite signs. Buy: {uncovered_list[b]}, Sell: {uncovered_list[s]} for {lots.symbol} at {pd.Timestamp(sell_time)}"
+                quantity = min(uncovered_list[b], -uncovered_list[s])
+                uncovered_list[s] += quantity
+                covered_list[s] += quantity
+                uncovered_list[b] -= quantity
+                covered_list[b] += quantity
+                if not uncovered_list[b] > 0:
+                    book.remove(i)
+                sells.append(s)
+                buys.append(b)
+                quantities.append(quantity)
+    uncovered[:] = uncovered_list
+    covered[:] = covered_list
+    return np.array(sells, dtype=np.int64), np.array(buys, dtype=np.int64), np.array(quantities, dtype=np.float64)
+
+
+def _pair_average_cost(lots: SymbolLots, from_year: int, uncovered: np.ndarray, covered: np.ndarray, to_year: int = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Cover each sell by the same fraction of every open lot, going through the lots newest first. """
+    sells, buys, quantities = [], [], []
+    for s in lots.sells:
+        if uncovered[s] == 0 or not _in_years(lots.years[s], from_year, to_year):
+            continue
+        # Lots opened up to the sell time, newest first
+        available = lots.opens_newest[np.searchsorted(-lots.opens_newest_times, -lots.times[s], side='left'):]
+        available = available[uncovered[available] > 0]
+        matching = available[lots.quantities[available] * lots.quantities[s] < 0]
+        if matching.size == 0:
+            continue
+        sell_fraction = -uncovered[s] / uncovered[available].sum()
+        taken = uncovered[matching] * sell_fraction
+        # Stop at the first lot after which the sell is fully covered
+        running = np.cumsum(np.concatenate(([uncovered[s]], taken)))
+        stops = np.flatnonzero(running[:-1] == 0)
+        count = stops[0] if stops.size > 0 else taken.size
+        matching, taken = matching[:count], taken[:count]
+        nonzero = taken != 0
+        matching, taken = matching[nonzero], taken[nonzero]
+        if taken.size == 0:
+            continue
+        uncovered[matching] -= taken
+        covered[matching] += taken
+        uncovered[s] = np.cumsum(np.concatenate(([uncovered[s]], taken)))[-1]
+        covered[s] = np.cumsum(np.concatenate(([covered[s]], taken)))[-1]
+        sells.append(np.full(taken.size, s))
+        buys.append(matching)
+        quantities.append(taken)
+    if not sells:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+    return np.concatenate(sells), np.concatenate(buys), np.concatenate(quantities)
+
+
+class _FlowNetwork:
+    """ Residual network for min-cost flow. Edges are stored in pairs, edge ^ 1 being the reverse of edge. """
+    EPSILON = 1e-9
+
+    def __init__(self, node_count: int):
+        self.adjacent = [[] for _ in range(node_count)]
+        self.to = []
+        self.capacity = []
+        self.cost = []
+        """ Remaining supply of the nodes. """
+        self.supply = [0.0] * node_count
+
+    def add_edge(self, source: int, target: int, capacity: float, cost: float = 0.0) -> int:
+        edge = len(self.to)
+        self.to += [target, source]
+        self.capacity += [capacity, 0.0]
+        self.cost += [cost, -cost]
+        self.adjacent[source].append(edge)
+        self.adjacent[target].append(edge + 1)
+        return edge
+
+    def flow(self, edge: int) -> float:
+        return self.capacity[edge ^ 1]
+
+    def _initial_potentials(self) -> list[float]:
+        """ Potentials making all reduced costs non-negative. The network is acyclic, so edges are relaxed in topological order. """
+        count = len(self.adjacent)
+        incoming = [0] * count
+        for edge in range(0, len(self.to), 2):
+            incoming[self.to[edge]] += 1
+        order = [node for node in range(count) if incoming[node] == 0]
+        for node in order:
+            for edge in self.adjacent[node]:
+                if edge % 2 == 0:
+                    incoming[self.to[edge]] -= 1
+                    if incoming[self.to[edge]] == 0:
+                        order.append(self.to[edge])
+        potential = [0.0] * count
+        for node in order:
+            for edge in self.adjacent[node]:
+                if edge % 2 == 0 and potential[node] + self.cost[edge] < potential[self.to[edge]]:
+                    potential[self.to[edge]] = potential[node] + self.cost[edge]
+        return potential
+
+    def solve(self, demands: list[tuple[int, float]]):
+        """
+        Satisfy the demands of the nodes, in the given order, from the supplies at the minimum total cost. Successive shortest paths,
+        each searched backward from the demanding node to the closest node with supply left, so that the search stays local.
+        A search goes on to the next closest supply as long as the paths found so far left all their edges open, as the distances then stay valid.
+        """
+        to, capacity, cost, adjacent, supply = self.to, self.capacity, self.cost, self.adjacent, self.supply
+        epsilon = self.EPSILON
+        infinity = float('inf')
+        # Nodes not reached by a search would all get the same potential shift, which does not change reduced costs, so only reached nodes are updated
+        potential = self._initial_potentials()
+        distance = [infinity] * len(adjacent)
+        previous = [-1] * len(adjacent)
+        done = [False] * len(adjacent)
+        for target, demand in demands:
+            while demand > epsilon:
+                # Dijkstra over reversed residual edges, reduced costs are non-negative thanks to the potentials
+                distance[target] = 0.0
+                reached = [target]
+                settled = []
+                # Among equally distant nodes, the ones with supply and then the latest reached are taken first to end the search early
+                heap = [(0.0, True, 0, target)]
+                # Nodes reached at the distance being settled skip the heap, most reduced costs are zero once the potentials are set
+                level = []
+                length = 0.0
+                reach = None
+                saturated = False
+                while heap or level:
+                    if level:
+                        node = level.pop()
+                    else:
+                        length, _, _, node = heapq.heappop(heap)
+                    if done[node] or length > distance[node]:
+                        continue
+                    done[node] = True
+                    settled.append(node)
+                    reach = length
+                    if supply[node] > epsilon:
+                        path = []
+                        step = node
+                        while step != target:
+                            path.append(previous[step])
+                            step = to[previous[step]]
+                        amount = min([demand, supply[node]] + [capacity[edge] for edge in path])
+                        for edge in path:
+                            capacity[edge] -= amount
+                            capacity[edge ^ 1] += amount
+                            saturated |= capacity[edge] <= epsilon
+                        supply[node] -= amount
+                        demand -= amount
+                        # The opposite edges of the path don't shorten any distance, only a closed edge may lengthen some
+                        if demand <= epsilon or saturated:
+                            break
+                    node_potential = potential[node]
+                    for edge in adjacent[node]:
+                        # Residual edge from the neighbour to this node is the reverse of the listed one
+                        edge ^= 1
+                        if capacity[edge] > epsilon:
+                            neighbour = to[edge ^ 1]
+                            candidate = cost[edge] + potential[neighbour] - node_potential
+                            candidate = length + candidate if candidate > 0.0 else length
+                            if candidate < distance[neighbour]:
+                                if distance[neighbour] == infinity:
+                                    reached.append(neighbour)
+                                distance[neighbour] = candidate
+                                previous[neighbour] = edge
+                                if candidate == length:
+                                    level.append(neighbour)
+                                else:
+                                    heapq.heappush(heap, (candidate, supply[neighbour] <= epsilon, -len(reached), neighbour))
+                if demand > epsilon and not saturated:
+                    return
+                for node in settled:
+                    potential[node] -= distance[node] - reach
+                for node in reached:
+                    distance[node] = infinity
+                    done[node] = False
+
+
+def _pair_optimal(lots: SymbolLots, from_year: int, uncovered: np.ndarray, covered: np.ndarray, to_year: int = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Cover the sells so that the taxable revenue (in trade currency) is the lowest possible. Sells are covered by as much as any strategy
+    going through them in time would cover, only the choice of lots is optimized.
+    """
+    all_sells, all_lots, all_quantities = [], [], []
+    for direction in (1, -1):
+        sells = [s for s in lots.sells if uncovered[s] < 0 and np.sign(lots.quantities[s]) == -direction and _in_years(lots.years[s], from_year, to_year)]
+        book = [b for b in lots.lots[direction] if uncovered[b] > 0]
+        if not sells or not book:
+            continue
+        # Going through the sells in time, the problem splits into independent segments wherever the position gets closed
+        segments = [([], [])]
+        available, next_lot = 0.0, 0
+        for s in sorted(sells, key=lambda s: lots.times[s]):
+            while next_lot < len(book) and lots.times[book[next_lot]] <= lots.times[s]:
+                if available <= _FlowNetwork.EPSILON and segments[-1][1]:
+                    segments.append(([], []))
+                available += uncovered[book[next_lot]]
+                segments[-1][0].append((book[next_lot], uncovered[book[next_lot]]))
+                next_lot += 1
+            demand = min(-uncovered[s], available)
+            if demand > _FlowNetwork.EPSILON:
+                available -= demand
+                segments[-1][1].append((s, demand))
+
+        pairs = {}
+        for segment_lots, segment_sells in segments:
+            if segment_sells:
+                pairs.update(_pair_optimal_segment(lots, segment_lots, segment_sells, 1.0 if direction > 0 else -1.0))
+        for (s, b), quantity in sorted(pairs.items(), key=lambda pair: (pair[0][0], lots.times[pair[0][1]], pair[0][1])):
+            uncovered[s] += quantity
+            covered[s] += quantity
+            uncovered[b] -= quantity
+            covered[b] += quantity
+            all_sells.append(s)
+            all_lots.append(b)
+            all_quantities.append(quantity)
+    return np.array(all_sells, dtype=np.int64), np.array(all_lots, dtype=np.int64), np.array(all_quantities, dtype=np.float64)
+
+
+def _pair_optimal_segment(lots: SymbolLots, book: list[tuple[int, float]], sells: list[tuple[int, float]], lot_sign: float) -> dict[tuple[int, int], float]:
+    """
+    Solve the optimal pairing of lots and sells (with their supplies and demands, in time order) as a min-cost flow. Pairs held for the tax-free period
+    cost nothing, the others cost their revenue. Lots reach sells through chains along the timeline, which keeps the network linear
+    in the number of trades. Dividing the timeline into periods of the tax-free length, a sell is taxed on:
+    - lots opened earlier in its own period ('Taxable' chain flowing forward in time),
+    - lots from the previous period opened later within the period than the sell ('Previous' chain flowing backward).
+    Lots enter the 'Exempt' chain once they reach the tax-free age.
+    Long lots open their pairs and pay the Cost (lot_sign 1), short lots close them and pay the Proceeds (lot_sign -1).
+    """
+    start = lots.times[book[0][0]]
+    def period(time):
+        return int((time - start) // _TAX_FREE_NS)
+    def offset(time):
+        return int((time - start) % _TAX_FREE_NS)
+
+    # Keys of the nodes of each chain in the direction of the flow
+    keys = {}
+    for b, _ in book:
+        keys.setdefault(('Taxable', period(lots.times[b])), set()).add(lots.times[b])
+        keys.setdefault(('Previous', period(lots.times[b])), set()).add(offset(lots.times[b]))
+        keys.setdefault(('Exempt', 0), set()).add(lots.times[b] + _TAX_FREE_NS)
+    for s, _ in sells:
+        keys.setdefault(('Taxable', period(lots.times[s])), set()).add(lots.times[s])
+        keys.setdefault(('Exempt', 0), set()).add(lots.times[s])
+    keys = {chain: sorted(values, reverse=chain[0] == 'Previous') for chain, values in keys.items()}
+
+    node_count = len(book) + len(sells)
+    nodes = {}
+    for chain, chain_keys in keys.items():
+        nodes[chain] = {key: node_count + position for position, key in enumerate(chain_keys)}
+        node_count += len(chain_keys)
+    network = _FlowNetwork(node_count)
+    # Edges of lots entering and sells leaving each chain node
+    entering = {node: [] for chain in nodes.values() for node in chain.values()}
+    leaving = {node: [] for chain in nodes.values() for node in chain.values()}
+
+    for lot, (b, supply) in enumerate(book):
+        network.supply[lot] = float(supply)
+        time = lots.times[b]
+        for chain, key, cost in ((('Taxable', period(time)), time, lot_sign * lots.values[b]),
+                                 (('Previous', period(time)), offset(time), lot_sign * lots.values[b]),
+                                 (('Exempt', 0), time + _TAX_FREE_NS, 0.0)):
+            node = nodes[chain][key]
+            entering[node].append((network.add_edge(lot, node, float('inf'), cost), b))
+    for chain_nodes in nodes.values():
+        chain_nodes = list(chain_nodes.values())
+        for node, next_node in zip(chain_nodes, chain_nodes[1:]):
+            network.add_edge(node, next_node, float('inf'))
+    demands = []
+    for i, (s, demand) in enumerate(sells):
+        sell = len(book) + i
+        time = lots.times[s]
+        sources = [(nodes[('Taxable', period(time))][time], -lot_sign * lots.values[s]), (nodes[('Exempt', 0)][time], 0.0)]
+        previous = ('Previous', period(time) - 1)
+        if previous in keys:
+            # Node of the smallest offset above the sell's collects exactly the lots still taxable
+            offsets = keys[previous][::-1]
+            position = bisect.bisect_right(offsets, offset(time))
+            if position < len(offsets):
+                sources.append((nodes[previous][offsets[position]], -lot_sign * lots.values[s]))
+        for node, cost in sources:
+            leaving[node].append((network.add_edge(node, sell, float('inf'), cost), s))
+        demands.append((sell, demand))
+    network.solve(demands)
+
+    # Walk each chain and hand out the lots that entered it to the sells leaving it, first come first served
+    pairs = {}
+    for chain_nodes in nodes.values():
+        queue = collections.deque()
+        for node in chain_nodes.values():
+            queue.extend([b, network.flow(edge)] for edge, b in entering[node] if network.flow(edge) > _FlowNetwork.EPSILON)
+            for edge, s in leaving[node]:
+                amount = network.flow(edge)
+                while amount > _FlowNetwork.EPSILON and queue:
+                    lot = queue[0]
+                    taken = min(amount, lot[1])
+                    pairs[(s, lot[0])] = pairs.get((s, lot[0]), 0.0) + taken
+                    amount -= taken
+                    lot[1] -= taken
+                    if lot[1] <= _FlowNetwork.EPSILON:
+                        queue.popleft()
+    return pairs
+
+
+def build_pairs(trades: pd.DataFrame, sells: np.ndarray, buys: np.ndarray, quantities: np.ndarray) -> pd.DataFrame:
+    """ Create the pairs table from positions of paired sells and buys in the trades table. """
+    def column(name: str) -> np.ndarray:
+        return trades[name].to_numpy()
+
+    buy_quantity = column('Quantity')[buys].astype(np.float64)
+    is_long = buy_quantity > 0
+    # Treat short positions as reversed long positions
+    opens = np.where(is_long, buys, sells)
+    closes = np.where(is_long, sells, buys)
+    price = column('T. Price').astype(np.float64)
+    fee = column('Comm/Fee').astype(np.float64)
+    proceeds = column('Proceeds').astype(np.float64)
+    quantity = column('Quantity').astype(np.float64)
+    times = column('Date/Time')
+    index = trades.index.to_numpy()
+    held = pd.to_timedelta(times[sells] - times[buys]).days
+    open_price = price[opens]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(open_price != 0, price[closes] / open_price, 0)
+    return pd.DataFrame({
+        'Sell Transaction': index[sells],
+        'Buy Transaction': index[buys],
+        'Display Name': column('Display Name')[sells],
+        'Currency': column('Currency')[buys],
+        'Quantity': quantities,
+        'Buy Time': times[buys],
+        'Sell Time': times[sells],
+        'Buy Price': open_price,
+        'Sell Price': price[closes],
+        'Buy Cost': open_price - (fee[opens] / quantity[opens]),
+        'Sell Proceeds': price[closes] - (fee[closes] / quantity[closes]),
+        'Cost': (proceeds[opens] + fee[opens]) * quantities / quantity[opens],
+        'Proceeds': -(proceeds[closes] + fee[closes]) * quantities / quantity[closes],
+        'Ratio': ratio,
+        'Type': column('Type')[closes],
+        'Taxable': np.where(np.asarray(held) < TAX_FREE_DAYS, 1, 0),
+    }, columns=pair_columns)
+
+
+def _balance_chunks(prepared: list[SymbolLots], count: int) -> list[list[int]]:
+    """ Split symbols into chunks with similar number of trades. Returns positions into `prepared`, each chunk in the original order. """
+    chunks = [[] for _ in range(count)]
+    loads = [(0, chunk) for chunk in range(count)]
+    # Largest symbols first, each to the least loaded chunk
+    for i in sorted(range(len(prepared)), key=lambda i: -len(prepared[i])):
+        load, chunk = heapq.heappop(loads)
+        chunks[chunk].append(i)
+        heapq.heappush(loads, (load + len(prepared[i]), chunk))
+    return [sorted(chunk) for chunk in chunks if chunk]
+
+
+def _pair_chunk(jobs: list[tuple[SymbolLots, np.ndarray, np.ndarray]], strategy: str, from_year: int, to_year: int = None) -> list[tuple]:
+    """ Pair a chunk of symbols in a worker process. Returns pairs and updated quantities per symbol. """
+    results = []
+    for lots, uncovered, covered in jobs:
+        sells, buys, quantities = pair_symbol(lots, strategy, from_year, uncovered, covered, to_year)
+        results.append((sells, buys, quantities, uncovered, covered))
+    return results
+
+
+def _pair_all(prepared: list[SymbolLots], jobs: list[tuple], strategy: str, from_year: int, workers: int, to_year: int = None) -> list[tuple]:
+    """ Pair all symbols, in a process pool if there are enough trades. Results are in the order of `prepared`. """
+    trade_count = sum(len(lots) for lots in prepared)
+    if workers is None or workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(prepared))
+    if workers <= 1 or trade_count < PARALLEL_MIN_TRADES:
+        return _pair_chunk(jobs, strategy, from_year, to_year)
+
+    results = [None] * len(prepared)
+    chunks = _balance_chunks(prepared, workers)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+        futures = {executor.submit(_pair_chunk, [jobs[i] for i in chunk], strategy, from_year, to_year): chunk for chunk in chunks}
+        for future in concurrent.futures.as_completed(futures):
+            for i, result in zip(futures[future], future.result()):
+                results[i] = result
+    return results
+
+
+def pair_positions(prepared: list[SymbolLots], strategy: str, uncovered: np.ndarray, covered: np.ndarray, from_year: int = None, to_year: int = None,
+                   workers: int = 1) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pair sells of the given years of already prepared symbols, starting from the given quantities of all trades.
+    Returns positions of paired sells and buys in the trades table, paired quantities and the updated quantities.
+    """
+    uncovered = uncovered.copy()
+    covered = covered.copy()
+    jobs = [(lots, uncovered[lots.positions], covered[lots.positions]) for lots in prepared]
+    sells, buys, quantities = [np.array([], dtype=np.int64)], [np.array([], dtype=np.int64)], [np.array([], dtype=np.float64)]
+    # Merge in symbol order so that the result does not depend on which worker finished first
+    for lots, (symbol_sells, symbol_buys, symbol_quantities, symbol_uncovered, symbol_covered) in zip(prepared, _pair_all(prepared, jobs, strategy, from_year, workers, to_year)):
+        uncovered[lots.positions] = symbol_uncovered
+        covered[lots.positions] = symbol_covered
+        sells.append(lots.positions[symbol_sells])
+        buys.append(lots.positions[symbol_buys])
+        quantities.append(symbol_quantities)
+    return np.concatenate(sells), np.concatenate(buys), np.concatenate(quantities), uncovered, covered
+
+
+def _pair_prepared(trades: pd.DataFrame, prepared: list[SymbolLots], strategy: str, from_year: int, workers: int,
+                   uncovered: np.ndarray, covered: np.ndarray) -> tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    """ Pair already prepared symbols starting from the given quantities. Returns the new pairs and the updated quantities. """
+    sells, buys, quantities, uncovered, covered = pair_positions(prepared, strategy, uncovered, covered, from_year, None, workers)
+    if sells.size == 0:
+        return pd.DataFrame(columns=pair_columns), uncovered, covered
+    return build_pairs(trades, sells, buys, quantities), uncovered, covered
+
+
+def pair_trades(trades: pd.DataFrame, strategy: str, from_year: int = None, workers: int = 1) -> pd.DataFrame:
+    """
+    Pair sells from `from_year` on with open lots using the given strategy. Expects Covered and Uncovered Quantity columns
+    already reflecting the existing pairs and updates them. Returns the newly created pairs.
+    Symbols are independent, so with more than one worker (0 for all cores) large inputs are paired in a process pool.
+    """
+    uncovered = trades['Uncovered Quantity'].to_numpy(dtype=np.float64)
+    covered = trades['Covered Quantity'].to_numpy(dtype=np.float64)
+    pairs, uncovered, covered = _pair_prepared(trades, prepare_lots(trades), strategy, from_year, workers, uncovered, covered)
+    trades['Uncovered Quantity'] = uncovered
+    trades['Covered Quantity'] = covered
+    return pairs
+
+
+def pair_strategies(trades: pd.DataFrame, strategies: list[str], from_year: int = None, workers: int = 1) -> dict[str, tuple[pd.DataFrame, np.ndarray]]:
+    """
+    Pair the trades with each of the strategies, sharing the per-symbol lots between the runs. Trades are left unchanged.
+    Returns the new pairs and the resulting uncovered quantities of the trades for each strategy.
+    """
+    uncovered = trades['Uncovered Quantity'].to_numpy(dtype=np.float64)
+    covered = trades['Covered Quantity'].to_numpy(dtype=np.float64)
+    prepared = prepare_lots(trades)
+    results = {}
+    for strategy in strategies:
+        pairs, strategy_uncovered, _ = _pair_prepared(trades, prepared, strategy, from_year, workers, uncovered, covered)
+        results[strategy] = (pairs, strategy_uncovered)
+    return results
@@ -1,8 +1,12 @@
 
+import numpy as np
 import pandas as pd
-import streamlit as st
+import matchmaker
+from matchmaker import cache
 from matchmaker import currency
 from matchmaker import trade
+from matchmaker import lots
+from matchmaker import schema
 import io
 
 snapshot_sections = [
@@ -14,8 +18,10 @@ snapshot_sections = [
 
 class Pairings:
     """ Holds the current state of the pairing process. """
-    strategies = ['None', 'FIFO', 'LIFO', 'AverageCost', 'MaxLoss', 'MaxProfit']
+    strategies = ['None', 'FIFO', 'LIFO', 'AverageCost', 'MaxLoss', 'MaxProfit', 'Optimal']
     conversion_rates = ['Yearly', 'Daily']
+    # Strategies compared side by side unless asked for all, Optimal takes seconds for thousands of lots of a symbol
+    compared_strategies = ['FIFO', 'LIFO', 'AverageCost', 'MaxLoss', 'MaxProfit']
 
     class Choices:
         def __init__(self, strategy = 'None', rates_usage = 'None'):
@@ -35,18 +41,29 @@ class Pairings:
         self.unpaired = pd.DataFrame()
         """ Configuration of the pairing process - strategies for each year """
         self.config: dict[int, Pairings.Choices] = {}
+        """ Symbols and years whose trades changed since they were paired, as (Display Name, Year). Pairs of the symbol from that year on need to be recomputed. """
+        self.dirty: set[tuple[str, int]] = set()
+        """ Fields of the trades relevant for pairing as they were at the last pairing. Index: trade ID """
+        self.paired_trades: pd.DataFrame = None
 
     def update(self, **kwargs):
         for key, value in kwargs.items():
             setattr(self, key, value)
 
+    def is_empty(self) -> bool:
+        """ Whether nothing was paired or configured yet, as in states imported from statements. """
+        return self.paired.empty and not self.config
+
     def get_state(self):
-        """ Used for streamlit caching. """
+        """ Used as the cache fingerprint. """
         # Convert config to a hashable type
         config_hashable = tuple((year, choices.get_state()) for year, choices in self.config.items())
         return (self.paired, self.unpaired, config_hashable)
     
-    def get_strategies():
+    def get_strategies(trades: pd.DataFrame = None):
+        """ Strategies offered for the trades, without Optimal if it would take too long to pair them. """
+        if trades is not None and lots.longest_open_stretch(trades) > lots.OPTIMAL_MAX_STRETCH:
+            return [strategy for strategy in Pairings.strategies if strategy != 'Optimal']
         return Pairings.strategies
     
     def populate_choices(self, trades: pd.DataFrame):
@@ -55,31 +72,36 @@ class Pairings:
             if year not in self.config:
                 self.config[year] = Pairings.Choices()
 
-    def load_session(self):
-        self.paired = st.session_state.pairing_paired if 'pairing_paired' in st.session_state else pd.DataFrame()
-        self.unpaired = st.session_state.pairing_unpaired if 'pairing_unpaired' in st.session_state else pd.DataFrame()
-        self.config = st.session_state.pairing_config if 'pairing_config' in st.session_state else {}
+    def load_session(self, session):
+        self.paired = session['pairing_paired'] if 'pairing_paired' in session else pd.DataFrame()
+        self.unpaired = session['pairing_unpaired'] if 'pairing_unpaired' in session else pd.DataFrame()
+        self.config = session['pairing_config'] if 'pairing_config' in session else {}
+        self.dirty = session['pairing_dirty'] if 'pairing_dirty' in session else set()
+        self.paired_trades = session['pairing_trades'] if 'pairing_trades' in session else None
 
-    def save_session(self):
-        st.session_state.update(pairing_paired=self.paired)
-        st.session_state.update(pairing_unpaired=self.unpaired)
-        st.session_state.update(pairing_config=self.config)
+    def save_session(self, session):
+        session.update(pairing_paired=self.paired)
+        session.update(pairing_unpaired=self.unpaired)
+        session.update(pairing_config=self.config)
+        session.update(pairing_dirty=self.dirty)
+        session.update(pairing_trades=self.paired_trades)
 
-    def populate_pairings(self, trades: pd.DataFrame, from_year: int, choices: Choices):
-        """ Compute the pairings of the trades according to chosen strategy and rates usage. """
+    def populate_pairings(self, trades: pd.DataFrame, from_year: int, choices: Choices, workers: int = 1):
+        """ Compute the pairings of the trades according to chosen strategy and rates usage. Workers > 1 (0 for all cores) pair large portfolios in parallel. """
         if choices.pair_strategy not in self.strategies:
-            st.error(f'Unknown strategy: {choices.pair_strategy}')
-            return
+            raise ValueError(f'Unknown strategy: {choices.pair_strategy}')
         if choices.conversion_rates not in self.conversion_rates:
-            st.error(f'Unknown rates usage: {choices.conversion_rates}')
-            return
+            raise ValueError(f'Unknown rates usage: {choices.conversion_rates}')
 
         # Initialize all yearly configurations if not yet present
         self.populate_choices(trades)
+
+        # Symbols whose trades changed are paired again with the strategies already chosen, other pairs are kept
+        self._repair_dirty(trades, choices.conversion_rates, workers)
         
         # If the strategy changed, recompute the pairings of this year and all the following years
         if not (self.config[from_year].pair_strategy == choices.pair_strategy):
-            self.paired, self.unpaired = pair_buy_sell(trades, self.paired, choices.pair_strategy, from_year)
+            self.paired, self.unpaired = pair_buy_sell(trades, self.paired, choices.pair_strategy, from_year, workers)
             years = trades[trades['Action'] == 'Close']['Year'].unique()
             for year in years:
                 if year in self.config and year >= from_year:
@@ -90,63 +112,130 @@ class Pairings:
         if not (self.config[from_year].conversion_rates == choices.conversion_rates):
             self._add_currency_conversion(choices.conversion_rates)
             self.config[from_year].conversion_rates = choices.conversion_rates
+        self.paired_trades = trades.reindex(columns=pairing_fields)
+
+    def apply_plan(self, planner, results: list, conversion_rates: str):
+        """ Use the pairings of a multi-year strategy plan found by planner.StrategyPlanner. """
+        self.paired, self.unpaired = planner.pairings(results)
+        for result in results:
+            self.config[result.year] = Pairings.Choices(result.strategy, conversion_rates)
+        if not self.paired.empty and 'Sell Transaction' in self.paired.columns:
+            self._add_currency_conversion(conversion_rates)
+        self.paired_trades = planner.trades.reindex(columns=pairing_fields)
+        self.dirty.clear()
+
+    def mark_dirty(self, trades: pd.DataFrame):
+        """ Mark symbols and years of the given trades as needing to be paired again. """
+        if not trades.empty:
+            self.dirty.update(zip(trades['Display Name'], pd.to_datetime(trades['Date/Time']).dt.year))
 
-    def invalidate_pairs(self, date_since : pd.Timestamp = pd.Timestamp.min):
-        """ Invalidate all pairs (partial invalidation won't help now). """
-        if self.paired.empty:
+    def mark_changes(self, trades: pd.DataFrame):
+        """ Compare the trades with those last paired and mark symbols and years of added, removed or modified trades (including renames and splits). """
+        if self.paired.empty or 'Sell Transaction' not in self.paired.columns:
             return
-        self.paired = self.paired[self.paired['Buy Time'] < date_since]
-        self.unpaired = self.unpaired[self.unpaired['Date/Time'] < date_since]
-        for year in self.config.keys():
-            self.config[year] = Pairings.Choices()
+        current = trades[(trades['Action'] == 'Open') | (trades['Action'] == 'Close')].reindex(columns=pairing_fields)
+        previous = self.paired_trades
+        if previous is None or not current.index.is_unique or not previous.index.is_unique:
+            # Nothing to compare with, all symbols need pairing again
+            self.mark_dirty(current)
+            return
+        common = current.index.intersection(previous.index)
+        # Categories of the tables may differ, their values are compared
+        now, before = schema.relax(current.loc[common]), schema.relax(previous.loc[common])
+        modified = ~((now == before) | (now.isna() & before.isna())).all(axis=1)
+        self.mark_dirty(current.loc[current.index.difference(previous.index)])
+        self.mark_dirty(previous.loc[previous.index.difference(current.index)])
+        # Both the old and the new symbol of a renamed trade are affected
+        self.mark_dirty(now[modified])
+        self.mark_dirty(before[modified])
+
+    def _repair_dirty(self, trades: pd.DataFrame, conversion_usage: str, workers: int = 1):
+        """ Pair the dirty symbols again from their first dirty year on, with the strategy configured for each year. """
+        if not self.dirty or self.paired.empty or 'Sell Transaction' not in self.paired.columns:
+            self.dirty.clear()
+            return
+        since = {}
+        for name, year in self.dirty:
+            since[name] = min(year, since.get(name, year))
+        first_dirty_year = self.paired['Display Name'].map(since)
+        kept = self.paired[~(self.paired['Sell Time'].dt.year >= first_dirty_year)]
+        symbol_trades = trades[trades['Display Name'].isin(since.keys())]
+        symbol_trades = fill_trades_covered_quantity(symbol_trades.copy(), kept[kept['Display Name'].isin(since.keys())])
+        prepared = lots.prepare_lots(symbol_trades)
+        uncovered = symbol_trades['Uncovered Quantity'].to_numpy(dtype=float)
+        covered = symbol_trades['Covered Quantity'].to_numpy(dtype=float)
+        sells, buys, quantities = [], [], []
+        for year in sorted(symbol_trades[symbol_trades['Action'] == 'Close']['Year'].unique()):
+            strategy = self.config[year].pair_strategy if year in self.config else 'None'
+            year_lots = [symbol_lots for symbol_lots in prepared if since[symbol_lots.symbol] <= year]
+            if strategy not in lots.strategy_commands or not year_lots:
+                continue
+            year_sells, year_buys, year_quantities, uncovered, covered = lots.pair_positions(year_lots, strategy, uncovered, covered, year, year, workers)
+            sells.append(year_sells)
+            buys.append(year_buys)
+            quantities.append(year_quantities)
+        symbol_trades['Uncovered Quantity'] = uncovered
+        symbol_trades['Covered Quantity'] = covered
+
+        if sells and sum(len(year_sells) for year_sells in sells) > 0:
+            new_pairs = lots.build_pairs(symbol_trades, np.concatenate(sells), np.concatenate(buys), np.concatenate(quantities))
+            new_pairs['Revenue'] = new_pairs['Proceeds'] + new_pairs['Cost']
+            if conversion_usage in self.conversion_rates:
+                new_pairs = convert_pairs(new_pairs, conversion_usage)
+            kept = new_pairs if kept.empty else pd.concat([kept, new_pairs], ignore_index=True)
+        self.paired = kept.sort_values(by=['Display Name', 'Sell Time', 'Buy Time'])
+        unpaired = self.unpaired[~self.unpaired['Display Name'].isin(since.keys())] if 'Display Name' in self.unpaired.columns else self.unpaired
+        self.unpaired = pd.concat([unpaired, symbol_trades[symbol_trades['Uncovered Quantity'] != 0]])
+        self.dirty.clear()
 
     def _add_currency_conversion(self, conversion_usage: str):
         """ Add yearly or daily currency conversion to the pairs. """
-        if conversion_usage == 'Yearly':
-            yearly_rates = currency.load_yearly_rates(st.session_state['settings']['currency_rates_dir'])
-            self.paired = currency.add_czk_conversion_to_pairs(self.paired, yearly_rates, True)
-        elif conversion_usage == 'Daily':
-            daily_rates = currency.load_daily_rates(st.session_state['settings']['currency_rates_dir'])
-            self.paired = currency.add_czk_conversion_to_pairs(self.paired, daily_rates, False)
-        else:
-            st.error(f'Unknown rates usage: {conversion_usage}')
-            return
-        self.paired['Percent Return'] = self.paired['Ratio'] * 100
+        if conversion_usage not in self.conversion_rates:
+            raise ValueError(f'Unknown rates usage: {conversion_usage}')
+        self.paired = convert_pairs(self.paired, conversion_usage)
 
+# Fields of trades that affect their pairing
+pairing_fields = ['Display Name', 'Date/Time', 'Quantity', 'T. Price', 'Proceeds', 'Comm/Fee', 'Action', 'Type', 'Option Type']
+
+def convert_pairs(pairs: pd.DataFrame, conversion_usage: str) -> pd.DataFrame:
+    """ Add yearly or daily currency conversion to the given pairs. """
+    if conversion_usage == 'Yearly':
+        yearly_rates = currency.load_yearly_rates(matchmaker.settings['currency_rates_dir'])
+        pairs = currency.add_czk_conversion_to_pairs(pairs, yearly_rates, True)
+    else:
+        daily_rates = currency.load_daily_rates(matchmaker.settings['currency_rates_dir'])
+        pairs = currency.add_czk_conversion_to_pairs(pairs, daily_rates, False)
+    pairs['Percent Return'] = pairs['Ratio'] * 100
+    return pairs
+
+def is_short_trade(trades: pd.DataFrame) -> pd.Series:
+    """ Flag trades that open or close a short position. """
+    quantity_opposite_of_action = ((trades['Quantity'] > 0) & (trades['Action'] == 'Close')) | ((trades['Quantity'] < 0) & (trades['Action'] == 'Open'))
+    option_type = trades['Option Type'] if 'Option Type' in trades.columns else pd.Series(np.nan, index=trades.index)
+    # The trade is borrowing stock or writing options
+    short = trades['Type'] == 'Short'
+    # It is an assigned option (had to be short), where only a NaN and not a None or empty Option Type means the trade is not an option
+    nan_option_type = option_type.isna().to_numpy() & ~np.equal(option_type.to_numpy(dtype=object), None)
+    short |= (trades['Type'] == 'Assigned') & ~nan_option_type
+    # It is stock resulting from exercised call option and it closes a position (there should be an open short position)
+    short |= (trades['Type'] == 'Exercised') & option_type.isna() & quantity_opposite_of_action
+    # Expired options could be owned or borrowed, only one of those is short
+    short |= (trades['Type'] == 'Expired') & (trades['Quantity'] > 0)
+    return short
 
 def fill_trades_covered_quantity(trades, sell_buy_pairs):
     """ Fill in the covered and uncovered quantities for each trade based on already created pairs. """
-    def is_short_trade(row):
-        def is_quantity_opposite_of_action(row : pd.Series):
-            return (row['Quantity'] > 0 and row['Action'] == 'Close') or (row['Quantity'] < 0 and row['Action'] == 'Open')
-        # The trade is borrowing stock or writing options 
-        if row['Type'] == 'Short':
-            return True
-        # It is an assigned option (had to be short) or is assigning stock that opens or fulfills a short position
-        if row['Type'] == 'Assigned' and (not pd.isna(row['Option Type'] or is_quantity_opposite_of_action(row))):
-            return True
-        # It is stock resulting from exercised call option and it closes a position (there should be an open short position) 
-        if row['Type'] == 'Exercised' and pd.isna(row['Option Type']) and is_quantity_opposite_of_action(row):
-            return True
-        # Expired options could be owned or borrowed, only one of those is short
-        if row['Type'] == 'Expired' and row['Quantity'] > 0:
-            return True
-        return False
     trades['Covered Quantity'] = 0.0
-    trades['Uncovered Quantity'] = trades.apply(lambda row: row['Quantity'] if not is_short_trade(row) else -row['Quantity'], axis=1)
-    if sell_buy_pairs is not None:
-        for index, row in sell_buy_pairs.iterrows():
-            sell_index = row['Sell Transaction']
-            buy_index = row['Buy Transaction']
-            quantity = row['Quantity']
-            trades.loc[buy_index, 'Covered Quantity'] += quantity
-            trades.loc[buy_index, 'Uncovered Quantity'] -= quantity
-            trades.loc[sell_index, 'Covered Quantity'] += quantity
-            trades.loc[sell_index, 'Uncovered Quantity'] += quantity
+    trades['Uncovered Quantity'] = trades['Quantity'].where(~is_short_trade(trades), -trades['Quantity']).astype(float)
+    if sell_buy_pairs is not None and not sell_buy_pairs.empty:
+        bought = sell_buy_pairs.groupby('Buy Transaction', sort=False)['Quantity'].sum().reindex(trades.index, fill_value=0.0).to_numpy()
+        sold = sell_buy_pairs.groupby('Sell Transaction', sort=False)['Quantity'].sum().reindex(trades.index, fill_value=0.0).to_numpy()
+        trades['Covered Quantity'] += bought + sold
+        trades['Uncovered Quantity'] += sold - bought
     return trades
 
-@st.cache_data()
-def pair_buy_sell(trades: pd.DataFrame, pairs: pd.DataFrame, strategy: str, from_year = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+@cache.cached(ignore=('workers',))
+def pair_buy_sell(trades: pd.DataFrame, pairs: pd.DataFrame, strategy: str, from_year = None, workers: int = 1) -> tuple[pd.DataFrame, pd.DataFrame]:
     """ Pair buy and sell trades to create taxable pairs. Return unmatched sells for diagnostics. """
     # Group all trades by Symbol into a new DataFrame
     # For each sell order (negative Proceeds), find enough corresponding buy orders (positive Proceeds) with the same Symbol to cover the sell order
@@ -155,105 +244,19 @@ def pair_buy_sell(trades: pd.DataFrame, pairs: pd.DataFrame, strategy: str, from
     # If a sell order is not covered by any buy orders, it is ignored
     
     # Drop all rows from pairs that are after the from_year
-    if from_year is not None and pairs is not None and not pairs.empty:
-        pairs = pairs[pairs['Sell Time'].dt.year < from_year]
+    pairs = pairs_before(pairs, from_year)
     
     trades = fill_trades_covered_quantity(trades, pairs)
     # trades.round(3).to_csv('paired.order.quantities.csv')
-    per_symbol = trades.groupby('Display Name')
     if pairs is None:
         pairs = pd.DataFrame(columns=['Buy Transaction', 'Sell Transaction', 'Display Name', 'Quantity', 'Buy Time', 'Buy Price', 'Sell Time', 'Sell Price', 'Buy Cost', 'Sell Proceeds', 'Revenue', 'Ratio', 'Type', 'Taxable'])
-    for symbol, group in per_symbol:
-        # Find sell orders
-        sells = group[group['Action'] == 'Close']
-        # Find buy orders. We'll use the quantity column to determine which buy orders were used to cover the sell orders
-        buys = group[group['Action'] == 'Open']
-        # For each sell order, find enough buy orders to cover it
-        for index_s, sell in sells.iterrows():
-            # If already paired, skip
-            if sell['Uncovered Quantity'] == 0 or sell['Year'] < from_year:
-                continue
-            
-            if strategy == 'LIFO':
-                # LIFO should prefer oldest not taxable transactions, then youngest taxable transactions
-                commands = [('FIFO', 'IgnoreTaxable'), ('LIFO', 'All')]
-            elif strategy == 'AverageCost':
-                # Pair like IBKR would compute P/L from average price of all buy orders
-                commands = [('AverageCost', 'All')]
-            elif strategy == 'MaxLoss':
-                commands = [('MaxProfit', 'IgnoreTaxable'), ('MaxLoss', 'All')]
-            elif strategy == 'MaxProfit':
-                commands = [('MaxLose', 'IgnoreTaxable'), ('MaxProfit', 'All')]
-            elif strategy == 'FIFO':
-                # FIFO is easy, just sort by Date/Time
-                commands = [('FIFO', 'All')]
-            else:
-                st.error(f'Unknown strategy: {strategy}')
-                return trades, pairs
-
-            # We sell using IBKR average price, meaning we need to always pair the same fraction of each buy order
-            for match_strategy, filter in commands:
-                # Find enough buy orders to cover the sell order
-                buys_to_cover = buys[(buys['Date/Time'] <= sell['Date/Time']) & (buys['Uncovered Quantity'] > 0)]
-                if match_strategy == 'MaxLoss' or match_strategy == 'MaxProfit':
-                    buys_to_cover = buys_to_cover.sort_values(by=['T. Price'], ascending=match_strategy == 'MaxProfit')
-                else:
-                    buys_to_cover = buys_to_cover.sort_values(by=['Date/Time'], ascending=match_strategy == 'FIFO')
-                    
-                sell_fraction = 1  
-                if match_strategy == 'AverageCost':
-                    total_uncovered = buys_to_cover['Uncovered Quantity'].sum()
-                    sell_fraction = -sell['Uncovered Quantity'] / total_uncovered            
-
-                # If there are enough buy orders to cover the sell order
-                for index_b, buy in buys_to_cover[buys_to_cover['Quantity'].apply(lambda x: x * sell['Quantity'] < 0)].iterrows():
-                    if sell['Uncovered Quantity'] == 0:
-                        break
-                    
-                    taxable = (sell['Date/Time'] - buy['Date/Time']).days < 3*365
-                    if (filter == 'IgnoreTaxable' and taxable) or (filter == 'TaxableLoss' and not taxable):
-                        continue
-                    
-                    # Determine the maximum quantity available to cover the sell order
-                    if match_strategy == 'AverageCost':
-                        quantity = buy['Uncovered Quantity'] * sell_fraction # Proportional to the total uncovered quantity
-                    else:
-                        assert (buy['Uncovered Quantity'] * sell['Uncovered Quantity']) < 0, f"Buy and sell quantities must have opposite signs. Buy: {buy['Uncovered Quantity']}, Sell: {sell['Uncovered Quantity']} for {symbol} at {sell['Date/Time']}"
-                        quantity = min(buy['Uncovered Quantity'], -sell['Uncovered Quantity'])
-                    
-                    if quantity != 0:
-                        # Treat short positions as reversed long positions
-                        open = buy if buy['Quantity'] > 0 else sell
-                        close = sell if buy['Quantity'] > 0 else buy
-                        # Add covered price to the sell order, it might not be all
-                        made_profit = (close['T. Price'] - open['T. Price']) > 0
-                        if made_profit and filter == 'TaxableLoss':
-                            continue
-                        sell['Uncovered Quantity'] += quantity
-                        # Add the pair to the DataFrame, indexing by hashes of the buy and sell transactions
-                        data = {'Sell Transaction': index_s, 'Buy Transaction': index_b, 'Display Name': symbol, 'Currency': buy['Currency'],
-                                'Quantity': quantity, 'Buy Time': buy['Date/Time'], 'Sell Time': sell['Date/Time'],
-                                'Buy Price': open['T. Price'], 
-                                'Sell Price': close['T. Price'], 
-                                'Buy Cost': open['T. Price'] - (open['Comm/Fee'] / open['Quantity']), 
-                                'Sell Proceeds': close['T. Price'] - (close['Comm/Fee'] / close['Quantity']), 
-                                'Cost': (open['Proceeds'] + open['Comm/Fee']) * quantity / open['Quantity'], 
-                                'Proceeds': -(close['Proceeds'] + close['Comm/Fee']) * quantity / close['Quantity'],
-                                'Ratio': close['T. Price']/open['T. Price'] if open['T. Price'] != 0 else 0, 'Type': close['Type'],
-                                'Taxable': 1 if (sell['Date/Time'] - buy['Date/Time']).days < 3*365 else 0}
-                        pairs = pd.concat([pairs, pd.DataFrame([data])], ignore_index=True)
-
-                        # Update the original dataframes
-                        buys.at[index_b, 'Uncovered Quantity'] -= quantity
-                        buys.at[index_b, 'Covered Quantity'] += quantity
-                        sells.at[index_s, 'Covered Quantity'] += quantity
-                        sells.at[index_s, 'Uncovered Quantity'] += quantity
-
-        # Propagate the changes back to the original DataFrame
-        trades.loc[sells.index, 'Uncovered Quantity'] = sells['Uncovered Quantity']
-        trades.loc[buys.index, 'Uncovered Quantity'] = buys['Uncovered Quantity']
-        trades.loc[sells.index, 'Covered Quantity'] = sells['Covered Quantity']
-        trades.loc[buys.index, 'Covered Quantity'] = buys['Covered Quantity']
+    if strategy not in lots.strategy_commands:
+        raise ValueError(f'Unknown strategy: {strategy}')
+
+    # Each symbol keeps its open lots in strategy-specific order and all sells are covered in a single pass over them
+    new_pairs = lots.pair_trades(trades, strategy, from_year, workers)
+    if not new_pairs.empty:
+        pairs = new_pairs if pairs.empty else pd.concat([pairs, new_pairs], ignore_index=True)
     
     if pairs.empty:
         return trades[trades['Action'] == 'Open'], trades[trades['Action'] == 'Close']
@@ -261,6 +264,65 @@ def pair_buy_sell(trades: pd.DataFrame, pairs: pd.DataFrame, strategy: str, from
     pairs['Revenue'] = pairs['Proceeds'] + pairs['Cost']
     return pairs.sort_values(by=['Display Name','Sell Time', 'Buy Time']), trades[trades['Uncovered Quantity'] != 0]
 
+def pair_years(trades: pd.DataFrame, pairs: pd.DataFrame, strategies: dict[int, str], workers: int = 1) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """ Pair the sells of each year with the strategy given for it, keeping the given pairs. Return pairs and unpaired trades like pair_buy_sell. """
+    trades = fill_trades_covered_quantity(trades.copy(), pairs)
+    prepared = lots.prepare_lots(trades)
+    uncovered = trades['Uncovered Quantity'].to_numpy(dtype=np.float64)
+    covered = trades['Covered Quantity'].to_numpy(dtype=np.float64)
+    sells, buys, quantities = [], [], []
+    for year in sorted(strategies):
+        if strategies[year] not in lots.strategy_commands:
+            raise ValueError(f'Unknown strategy: {strategies[year]}')
+        year_sells, year_buys, year_quantities, uncovered, covered = lots.pair_positions(prepared, strategies[year], uncovered, covered, year, year, workers)
+        sells.append(year_sells)
+        buys.append(year_buys)
+        quantities.append(year_quantities)
+    trades['Uncovered Quantity'] = uncovered
+    trades['Covered Quantity'] = covered
+
+    if pairs is None:
+        pairs = pd.DataFrame(columns=lots.pair_columns)
+    if sells and sum(len(year_sells) for year_sells in sells) > 0:
+        new_pairs = lots.build_pairs(trades, np.concatenate(sells), np.concatenate(buys), np.concatenate(quantities))
+        pairs = new_pairs if pairs.empty else pd.concat([pairs, new_pairs], ignore_index=True)
+    if pairs.empty:
+        return trades[trades['Action'] == 'Open'], trades[trades['Action'] == 'Close']
+    pairs['Revenue'] = pairs['Proceeds'] + pairs['Cost']
+    return pairs.sort_values(by=['Display Name', 'Sell Time', 'Buy Time']), trades[trades['Uncovered Quantity'] != 0]
+
+def pairs_before(pairs: pd.DataFrame, year: int) -> pd.DataFrame:
+    """ Pairs of sells made before the year, all of them if the year is None. """
+    if year is None or pairs is None or pairs.empty:
+        return pairs
+    return pairs[pairs['Sell Time'].dt.year < year]
+
+@cache.cached(ignore=('workers',))
+def compare_strategies(trades: pd.DataFrame, pairs: pd.DataFrame, from_year: int, rates: pd.DataFrame, use_yearly_rates = True,
+                       strategies: list[str] = Pairings.compared_strategies, workers: int = 1) -> pd.DataFrame:
+    """
+    Pair the trades with each of the strategies from the given year on, keeping earlier pairs. Return taxable and exempt CZK revenue and unpaired quantity per year and strategy.
+    Pass only the pairs before the year, so that the cache isn't missed when later pairs change.
+    """
+    pairs = pairs_before(pairs, from_year)
+    trades = fill_trades_covered_quantity(trades.copy(), pairs)
+    sells = trades['Action'].to_numpy() == 'Close'
+    summaries = []
+    # All strategies share the same per-symbol lots, only the pairing itself is repeated
+    for strategy, (new_pairs, uncovered) in lots.pair_strategies(trades, strategies, from_year, workers).items():
+        unpaired = pd.DataFrame({'Year': trades['Year'].to_numpy()[sells], 'Unpaired Quantity': abs(uncovered[sells])})
+        summary = unpaired[unpaired['Year'] >= from_year].groupby('Year').sum()
+        if not new_pairs.empty:
+            revenue = (new_pairs['Proceeds'] * currency.get_czk_rates(new_pairs['Sell Time'], new_pairs['Currency'], rates, use_yearly_rates)
+                       + new_pairs['Cost'] * currency.get_czk_rates(new_pairs['Buy Time'], new_pairs['Currency'], rates, use_yearly_rates))
+            revenue = pd.DataFrame({'Year': new_pairs['Sell Time'].dt.year, 'Taxable': new_pairs['Taxable'], 'CZK Revenue': revenue})
+            revenue = revenue.pivot_table(index='Year', columns='Taxable', values='CZK Revenue', aggfunc='sum', fill_value=0.0)
+            summary['Taxable Revenue'] = revenue.get(1, pd.Series(dtype=float))
+            summary['Exempt Revenue'] = revenue.get(0, pd.Series(dtype=float))
+        summary = summary.reindex(columns=['Taxable Revenue', 'Exempt Revenue', 'Unpaired Quantity']).fillna(0.0)
+        summary['Strategy'] = strategy
+        summaries.append(summary.reset_index())
+    return pd.concat(summaries, ignore_index=True)[['Year', 'Strategy', 'Taxable Revenue', 'Exempt Revenue', 'Unpaired Quantity']]
 
 def config_from_dataframe(df: pd.DataFrame) -> dict[int, Pairings.Choices]:
     return {row['Year']: Pairings.Choices(row['Strategy'], row['Rates']) for _, row in df.iterrows()}
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+from matchmaker import currency
+from matchmaker import lots
+from matchmaker import pairing
+
+# Personal income tax rate applied to the yearly taxable revenue, losses can't be carried over to other years
+TAX_RATE = 0.15
+
+
+class StrategyPlanner:
+    """
+    Searches per-year pairing strategies minimizing the total tax over all years. Lots paired in one year are missing in the following years,
+    so the best strategy of a year depends on the years before. The search goes year by year and remembers the remaining lots at each year boundary:
+    the best plan for the rest of the years only depends on them, so years reached in the same state by different strategies are searched only once.
+    Branches that can't beat the best plan found so far are cut off, as the tax of the remaining years can't be negative.
+    """
+    def __init__(self, trades: pd.DataFrame, pairs: pd.DataFrame, from_year: int, rates: pd.DataFrame, use_yearly_rates = True,
+                 strategies: list[str] = None, tax_rate = TAX_RATE):
+        if pairs is not None and not pairs.empty:
+            pairs = pairs[pairs['Sell Time'].dt.year < from_year]
+        self.previous_pairs = pairs
+        self.trades = pairing.fill_trades_covered_quantity(trades.copy(), pairs)
+        self.prepared = lots.prepare_lots(self.trades)
+        self.years = sorted(year for year in self.trades[self.trades['Action'] == 'Close']['Year'].unique() if year >= from_year)
+        """ Symbols with sells in each year, the only ones paired in it """
+        self.year_symbols = [[symbol for symbol in self.prepared if np.any(symbol.years[symbol.sells] == year)] for year in self.years]
+        """ Positions of the open lots of symbols with sells in each year or later, the only quantities the plan of the remaining years depends on """
+        self.state_positions = [np.sort(np.concatenate([np.array([], dtype=np.int64)] +
+                                                       [symbol.positions[np.concatenate([symbol.lots[1], symbol.lots[-1]])] for symbol in self.prepared
+                                                        if np.any(symbol.years[symbol.sells] >= year)]))
+                                for year in self.years]
+        self.strategies = strategies if strategies is not None else pairing.Pairings.strategies[1:]
+        self.rates = rates
+        self.use_yearly_rates = use_yearly_rates
+        self.tax_rate = tax_rate
+        """ Pairing of a year from a state by a strategy: (year, state, strategy) -> YearResult """
+        self.steps = {}
+        """ Best plan of the remaining years from a state: (year, state) -> (tax, [YearResult]) """
+        self.solved = {}
+        """ Lower bound of the tax of the remaining years from a state that was cut off: (year, state) -> tax """
+        self.bounds = {}
+
+    class YearResult:
+        def __init__(self, year, strategy, sells, buys, quantities, positions, uncovered, covered, taxable_revenue, exempt_revenue):
+            self.year = year
+            self.strategy = strategy
+            """ Positions of the paired trades and paired quantities """
+            self.sells = sells
+            self.buys = buys
+            self.quantities = quantities
+            """ Quantities of the paired trades after pairing the year, at their positions. Other trades keep theirs. """
+            self.positions = positions
+            self.uncovered = uncovered
+            self.covered = covered
+            self.taxable_revenue = taxable_revenue
+            self.exempt_revenue = exempt_revenue
+
+        def apply(self, uncovered: np.ndarray, covered: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+            """ Quantities of all trades after pairing the year, given those before it. """
+            uncovered, covered = uncovered.copy(), covered.copy()
+            uncovered[self.positions] = self.uncovered
+            covered[self.positions] = self.covered
+            return uncovered, covered
+
+    def _state_key(self, year_index: int, uncovered: np.ndarray) -> bytes:
+        return np.round(uncovered[self.state_positions[year_index]], 9).tobytes()
+
+    def pair_year(self, year_index: int, uncovered: np.ndarray, covered: np.ndarray, strategy: str) -> 'StrategyPlanner.YearResult':
+        """ Pair sells of one year with a strategy, reusing the result if the same year was already paired from the same state. """
+        year = self.years[year_index]
+        key = (year_index, self._state_key(year_index, uncovered), strategy)
+        if key not in self.steps:
+            sells, buys, quantities, new_uncovered, new_covered = lots.pair_positions(self.year_symbols[year_index], strategy, uncovered, covered, year, year)
+            taxable_revenue, exempt_revenue = 0.0, 0.0
+            if sells.size > 0:
+                pairs = lots.build_pairs(self.trades, sells, buys, quantities)
+                revenue = (pairs['Proceeds'] * currency.get_czk_rates(pairs['Sell Time'], pairs['Currency'], self.rates, self.use_yearly_rates)
+                           + pairs['Cost'] * currency.get_czk_rates(pairs['Buy Time'], pairs['Currency'], self.rates, self.use_yearly_rates))
+                taxable_revenue = revenue[pairs['Taxable'] == 1].sum()
+                exempt_revenue = revenue[pairs['Taxable'] == 0].sum()
+            changed = np.unique(np.concatenate([sells, buys]))
+            self.steps[key] = StrategyPlanner.YearResult(year, strategy, sells, buys, quantities, changed, new_uncovered[changed], new_covered[changed],
+                                                         taxable_revenue, exempt_revenue)
+        return self.steps[key]
+
+    def tax(self, result: 'StrategyPlanner.YearResult') -> float:
+        return max(result.taxable_revenue, 0.0) * self.tax_rate
+
+    def _search(self, year_index: int, uncovered: np.ndarray, covered: np.ndarray, budget: float):
+        """ Best plan of the remaining years costing less than the budget, or None if there is none. """
+        if year_index == len(self.years):
+            return 0.0, []
+        key = (year_index, self._state_key(year_index, uncovered))
+        if key in self.solved:
+            return self.solved[key] if self.solved[key][0] < budget else None
+        if self.bounds.get(key, 0.0) >= budget:
+            return None
+
+        # Cheapest years first, to find a good plan early and cut off the rest
+        results = sorted((self.pair_year(year_index, uncovered, covered, strategy) for strategy in self.strategies), key=self.tax)
+        best = None
+        for result in results:
+            limit = min(budget, best[0]) if best is not None else budget
+            if self.tax(result) >= limit:
+                continue
+            rest = self._search(year_index + 1, *result.apply(uncovered, covered), limit - self.tax(result))
+            if rest is not None:
+                best = (self.tax(result) + rest[0], [result] + rest[1])
+        if best is None:
+            self.bounds[key] = budget
+        else:
+            # Every skipped branch costs at least as much as the best one, so the best plan is final
+            self.solved[key] = best
+        return best
+
+    def plan(self) -> tuple[float, list['StrategyPlanner.YearResult']]:
+        """ Return the minimal total tax and the chosen pairing of each year. """
+        uncovered = self.trades['Uncovered Quantity'].to_numpy(dtype=np.float64)
+        covered = self.trades['Covered Quantity'].to_numpy(dtype=np.float64)
+        return self._search(0, uncovered, covered, float('inf'))
+
+    def summary(self, results: list['StrategyPlanner.YearResult']) -> pd.DataFrame:
+        """ Per-year table of the chosen strategies and their revenue and tax. """
+        return pd.DataFrame([(result.year, result.strategy, result.taxable_revenue, result.exempt_revenue, self.tax(result)) for result in results],
+                            columns=['Year', 'Strategy', 'Taxable Revenue', 'Exempt Revenue', 'Tax'])
+
+    def pairings(self, results: list['StrategyPlanner.YearResult']) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """ Pairs of the whole plan, including the kept pairs of earlier years, and the trades left unpaired, as returned by pairing.pair_buy_sell. """
+        trades = self.trades.copy()
+        if results:
+            uncovered = trades['Uncovered Quantity'].to_numpy(dtype=np.float64)
+            covered = trades['Covered Quantity'].to_numpy(dtype=np.float64)
+            for result in results:
+                uncovered, covered = result.apply(uncovered, covered)
+            trades['Uncovered Quantity'] = uncovered
+            trades['Covered Quantity'] = covered
+            sells = np.concatenate([result.sells for result in results])
+        else:
+            sells = np.array([], dtype=np.int64)
+        pairs = self.previous_pairs if self.previous_pairs is not None else pd.DataFrame(columns=lots.pair_columns)
+        if sells.size > 0:
+            new_pairs = lots.build_pairs(trades, sells, np.concatenate([result.buys for result in results]), np.concatenate([result.quantities for result in results]))
+            pairs = new_pairs if pairs.empty else pd.concat([pairs, new_pairs], ignore_index=True)
+        if pairs.empty:
+            return trades[trades['Action'] == 'Open'], trades[trades['Action'] == 'Close']
+        pairs['Revenue'] = pairs['Proceeds'] + pairs['Cost']
+        return pairs.sort_values(by=['Display Name', 'Sell Time', 'Buy Time']), trades[trades['Uncovered Quantity'] != 0]
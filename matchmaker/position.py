@@ -1,23 +1,16 @@
 import pandas as pd
 import numpy as np
-import streamlit as st
 from typing import Optional, Tuple
+from matchmaker import schema
 
 def convert_position_history_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
     Convert columns of the position history DataFrame to appropriate types.
     """
-    df['Prior Date'] = pd.to_datetime(df['Prior Date'])
-    df['Date'] = pd.to_datetime(df['Current Date'])
-    df['Prior Quantity'] = pd.to_numeric(df['Prior Quantity'], errors='coerce')
-    df['Quantity'] = pd.to_numeric(df['Current Quantity'], errors='coerce')
-    df['Prior Price'] = pd.to_numeric(df['Prior Price'], errors='coerce')
-    df['Price'] = pd.to_numeric(df['Current Price'], errors='coerce')
-    df['Mark-to-Market P/L Position'] = pd.to_numeric(df['Mark-to-Market P/L Position'], errors='coerce')
-    df['Mark-to-Market P/L Transaction'] = pd.to_numeric(df['Mark-to-Market P/L Transaction'], errors='coerce')
-    df['Mark-to-Market P/L Commissions'] = pd.to_numeric(df['Mark-to-Market P/L Commissions'], errors='coerce')
-    df['Mark-to-Market P/L Other'] = pd.to_numeric(df['Mark-to-Market P/L Other'], errors='coerce')
-    df['Mark-to-Market P/L Total'] = pd.to_numeric(df['Mark-to-Market P/L Total'], errors='coerce')
+    df['Date'] = df['Current Date']
+    df['Quantity'] = df['Current Quantity']
+    df['Price'] = df['Current Price']
+    df = schema.enforce(df, 'positions', categorize=False)
     df['Category'] = 'Open Positions'
     df = df[['Category'] + [col for col in df.columns if col != 'Category']]
     return df
@@ -27,7 +20,7 @@ def compute_open_positions(trades: pd.DataFrame, time: pd.Timestamp = pd.Timesta
     Compute open positions per symbol at a given time.
     """
     trades = trades[trades['Date/Time'] <= time]
-    positions = trades.groupby('Ticker')[['Accumulated Quantity', 'Date/Time', 'Split Ratio']].last().reset_index()
+    positions = trades.groupby('Ticker', observed=True)[['Accumulated Quantity', 'Date/Time', 'Split Ratio']].last().reset_index()
     return positions[np.abs(positions['Accumulated Quantity']) > 1e-9]
 
 def compute_open_positions_per_account(trades: pd.DataFrame, time: pd.Timestamp = pd.Timestamp.now(), account: Optional[str] = None) -> pd.DataFrame:
@@ -37,7 +30,7 @@ def compute_open_positions_per_account(trades: pd.DataFrame, time: pd.Timestamp
     trades = trades[trades['Date/Time'] <= time]
     if account is not None:
         trades = trades[trades['Account'] == account]
-    positions = trades.groupby('Display Name')[['Account', 'Account Accumulated Quantity', 'Date/Time', 'Split Ratio']].last().reset_index()
+    positions = trades.groupby('Display Name', observed=True)[['Account', 'Account Accumulated Quantity', 'Date/Time', 'Split Ratio']].last().reset_index()
 
     return positions[np.abs(positions['Account Accumulated Quantity']) > 1e-9]
 
@@ -47,7 +40,7 @@ def check_open_position_mismatches(trades: pd.DataFrame, positions: pd.DataFrame
     Returns:
         Tuple[pd.DataFrame, pd.DataFrame]: Misaligned positions, guessed renames
     """
-    time_points = positions[(positions['Quantity'] != 0) & (positions['Date'] <= max_date)].groupby(['Date', 'Account'])
+    time_points = positions[(positions['Quantity'] != 0) & (positions['Date'] <= max_date)].groupby(['Date', 'Account'], observed=True)
     mismatches = pd.DataFrame(columns=['Ticker', 'Currency', 'Date'])
     for (time, account), snapshot in time_points:
         # Join and check for quantity mismatches or missing symbols
@@ -69,7 +62,7 @@ def check_open_position_mismatches(trades: pd.DataFrame, positions: pd.DataFrame
     agg_funcs = {
         'Date/Time': ['min', 'max']
     }
-    symbol_dates = trades.groupby('Ticker').agg(agg_funcs).reset_index()
+    symbol_dates = trades.groupby('Ticker', observed=True).agg(agg_funcs).reset_index()
     symbol_dates.columns = ['Display Name', 'First Activity', 'Last Activity']
     # Group by possibly renamed symbols and check if we have pairs of mismatches
     mismatches = mismatches.merge(symbol_dates, on='Display Name', how='left')
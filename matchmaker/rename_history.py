@@ -0,0 +1,67 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+# Longest chain of renames followed from one symbol, so that symbols renamed back and forth on the same day can't loop forever
+MAX_CHAIN_LENGTH = 32
+
+
+class RenameIndex:
+    """
+    Rename history of listed symbols: for each old symbol its change dates in ascending order and the final ticker each rename leads to.
+    Chains of renames (A to B, later B to C) are followed once when the index is built, so that any symbol and date resolve to the final ticker by a single binary search.
+    """
+    def __init__(self, renames: pd.DataFrame, modified: float = None):
+        """ Renames as rows of Change Date, Old and New symbol. Modified is the time of the last change of the file they come from. """
+        self.modified = modified
+        renames = renames.dropna(subset=['Change Date', 'Old', 'New']).sort_values(by='Change Date', kind='stable')
+        direct = {symbol: (group['Change Date'].to_numpy(dtype='datetime64[ns]'), group['New'].to_numpy(dtype=object))
+                  for symbol, group in renames.groupby('Old', sort=False)}
+        """ Old symbol -> (change dates, final tickers) """
+        self.history = {symbol: (dates, np.array([self._follow(direct, ticker, date) for date, ticker in zip(dates, tickers)], dtype=object))
+                        for symbol, (dates, tickers) in direct.items()}
+        """ All renames with their final tickers, indexed by the old symbol, in the layout of the symbols table """
+        self.table = pd.DataFrame({'Symbol': renames['Old'].to_numpy(dtype=object), 'Ticker': None, 'Change Date': renames['Change Date'].to_numpy(dtype='datetime64[ns]')})
+        self.table['Ticker'] = [self.resolve(symbol, date) for symbol, date in zip(self.table['Symbol'], self.table['Change Date'])]
+        self.table.set_index('Symbol', inplace=True)
+
+    @staticmethod
+    def _follow(direct: dict, symbol: str, date: np.datetime64) -> str:
+        """ Final ticker of a symbol that took its name on the date, following its later renames. """
+        for _ in range(MAX_CHAIN_LENGTH):
+            if symbol not in direct:
+                break
+            dates, tickers = direct[symbol]
+            position = np.searchsorted(dates, date, side='left')
+            if position == len(dates):
+                break
+            symbol, date = tickers[position], dates[position]
+        return symbol
+
+    def resolve(self, symbol: str, date) -> str:
+        """ Ticker under which the symbol traded on the date is known today, the symbol itself if it wasn't renamed since. """
+        if symbol not in self.history:
+            return symbol
+        dates, tickers = self.history[symbol]
+        position = np.searchsorted(dates, np.datetime64(pd.Timestamp(date), 'ns'), side='left')
+        return tickers[position] if position < len(dates) else symbol
+
+    @classmethod
+    def read(cls, path: str) -> 'RenameIndex':
+        modified = os.path.getmtime(path)
+        return cls(pd.read_csv(path, parse_dates=['Change Date']), modified)
+
+
+# Rename indexes of the files read so far: path -> index. Shared by all sessions of the process.
+_indexes: dict[str, RenameIndex] = {}
+_lock = threading.Lock()
+
+def load(path: str) -> RenameIndex:
+    """ Rename index of the file, built once per process and built again only once the file changes. """
+    modified = os.path.getmtime(path)
+    with _lock:
+        index = _indexes.get(path)
+        if index is None or index.modified != modified:
+            index = _indexes[path] = RenameIndex.read(path)
+        return index
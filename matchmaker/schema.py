@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+# Types of the columns of State tables. Columns not listed keep whatever type they have.
+# Kinds: 'category' for strings repeating across rows, 'float', 'number' (integer or float, whichever the values are), 'time' and 'flag' (missing values are False)
+table_schemas = {
+    'trades': {
+        'Category': 'category', 'Currency': 'category', 'Symbol': 'category', 'Ticker': 'category', 'Display Name': 'category', 'Account': 'category',
+        'Action': 'category', 'Type': 'category', 'Code': 'category', 'Option Type': 'category', 'Target': 'category',
+        'Date/Time': 'time', 'Quantity': 'number', 'T. Price': 'float', 'C. Price': 'float', 'Proceeds': 'float', 'Comm/Fee': 'float', 'Basis': 'float',
+        'Realized P/L': 'float', 'MTM P/L': 'float', 'Manual': 'flag',
+        'Opening': 'flag', 'Closing': 'flag', 'Cancelled': 'flag', 'Exercised': 'flag', 'Expired': 'flag', 'Assigned': 'flag',
+    },
+    'actions': {
+        'Category': 'category', 'Currency': 'category', 'Symbol': 'category', 'Action': 'category', 'Target': 'category',
+        'Date/Time': 'time', 'Quantity': 'number', 'Proceeds': 'number', 'Value': 'number', 'Realized P/L': 'number',
+    },
+    'positions': {
+        'Category': 'category', 'Symbol': 'category', 'Account': 'category', 'Display Name': 'category',
+        'Prior Date': 'time', 'Current Date': 'time', 'Date': 'time', 'Prior Quantity': 'number', 'Quantity': 'number', 'Prior Price': 'number', 'Price': 'number',
+        'Mark-to-Market P/L Position': 'number', 'Mark-to-Market P/L Transaction': 'number', 'Mark-to-Market P/L Commissions': 'number',
+        'Mark-to-Market P/L Other': 'number', 'Mark-to-Market P/L Total': 'number',
+    },
+    'dividends': {
+        'Symbol': 'category', 'Ticker': 'category', 'Display Name': 'category', 'Currency': 'category', 'Action': 'category', 'Country': 'category',
+        'Date': 'time',
+    },
+    'symbols': {
+        'Change Date': 'time',
+    },
+    'imports': {
+        'Account': 'category', 'From': 'time', 'To': 'time', 'Trade Count': 'number',
+    },
+}
+
+
+def _cast(values: pd.Series, kind: str) -> pd.Series:
+    if kind == 'category':
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return values.cat.remove_unused_categories()
+        return values.astype('category')
+    if kind == 'float':
+        return pd.to_numeric(values, errors='coerce').astype(np.float64)
+    if kind == 'number':
+        return pd.to_numeric(values, errors='coerce')
+    if kind == 'time':
+        return values if values.dtype == 'datetime64[ns]' else pd.to_datetime(values)
+    if kind == 'flag':
+        return values if values.dtype == bool else values.notna() & values.astype(bool)
+    raise ValueError(f'Unknown column kind: {kind}')
+
+def enforce(df: pd.DataFrame, table: str, categorize: bool = True) -> pd.DataFrame:
+    """ Cast the columns of the table present in the DataFrame to their declared types in one step. Without categorize, strings are left as they are. """
+    casts = {column: _cast(df[column], kind) for column, kind in table_schemas[table].items()
+             if column in df.columns and (categorize or kind != 'category')}
+    for column, values in casts.items():
+        df[column] = values
+    return df
+
+def relax(df: pd.DataFrame, columns = None) -> pd.DataFrame:
+    """ Categorical columns (all or the given ones) as plain objects, so that they can take new values or be compared with other tables. """
+    categorical = [column for column in (columns if columns is not None else df.columns)
+                   if column in df.columns and isinstance(df[column].dtype, pd.CategoricalDtype)]
+    return df.astype({column: object for column in categorical}) if categorical else df
+
+def memory_usage(tables: dict[str, pd.DataFrame]) -> pd.Series:
+    """ Memory taken by each of the tables in MB, including the strings they refer to. """
+    return pd.Series({name: table.memory_usage(deep=True).sum() / 2**20 for name, table in tables.items()}, name='Memory [MB]')
@@ -1,5 +1,6 @@
 import pandas as pd
-import streamlit as st
+import matchmaker.cache as cache
+import matchmaker.hash as hash
 import matchmaker.trade as trade
 import matchmaker.actions as action
 import matchmaker.position as position
@@ -16,14 +17,16 @@ def is_snapshot(file):
     return header == 'Matchmaker snapshot\n'
 
 snapshot_sections = [
-    ('Trades',  lambda state: state.trades.to_csv(index_label='Hash'), lambda data, state: setattr(state, 'trades', trade.convert_trade_columns(pd.read_csv(io.StringIO(data)).set_index('Hash')))),
+    # Read by load_snapshot itself, snapshots without it are from before versioned trade identities
+    ('Trade Identity', lambda state: pd.DataFrame({'Version': [hash.HASH_VERSION]}).to_csv(index=False), lambda data, state: None),
+    ('Trades',  lambda state: state.trades.to_csv(index_label='ID'), lambda data, state: setattr(state, 'trades', read_trades(data))),
     ('Actions', lambda state: state.actions.to_csv(index=False), lambda data, state: setattr(state, 'actions', action.convert_action_columns(pd.read_csv(io.StringIO(data))))),
     ('Position History', lambda state: state.positions.to_csv(index=False), lambda data, state: setattr(state, 'positions', position.convert_position_history_columns(pd.read_csv(io.StringIO(data))))),
     ('Symbols', lambda state: state.symbols.to_csv(index_label='Symbol'), lambda data, state: setattr(state, 'symbols', pd.read_csv(io.StringIO(data)).set_index('Symbol'))),
     ('Imports', lambda state: state.imports.to_csv(index=False), lambda data, state: setattr(state, 'imports', imports.convert_import_history_columns(pd.read_csv(io.StringIO(data)))))
 ] + pairing.snapshot_sections
 
-@st.cache_data(hash_funcs={data.State: data.State.get_state})
+@cache.cached
 def save_snapshot(state: data.State) -> str: 
     """ Serialize the current state of the application to a snapshot. """
     
@@ -33,7 +36,7 @@ def save_snapshot(state: data.State) -> str:
         serialized += serialize(state)
     return serialized
 
-@st.cache_data()
+@cache.cached
 def load_snapshot(file: io.BytesIO) -> data.State:
     """ Load a snapshot of data.State from a file. """
     header = file.readline().decode('utf-8')
@@ -61,4 +64,26 @@ def load_snapshot(file: io.BytesIO) -> data.State:
         if section_name in sections_data and sections_data[section_name].strip():
             deserialize(sections_data[section_name], state)
 
+    version = pd.read_csv(io.StringIO(sections_data['Trade Identity']))['Version'].iloc[0] if 'Trade Identity' in sections_data else 1
+    if version != hash.HASH_VERSION and not state.trades.empty:
+        migrate_trade_identities(state)
     return state
+
+def read_trades(data: str) -> pd.DataFrame:
+    """ Trades section of a snapshot, indexed by trade identity. Snapshots from before compact identities have hashes in their place. """
+    # Strikes are part of option names, read them as written
+    trades = pd.read_csv(io.StringIO(data), dtype={'Strike': str, 'Orig. Strike': str})
+    return trade.convert_trade_columns(trades.set_index('ID' if 'ID' in trades.columns else 'Hash'))
+
+def migrate_trade_identities(state: data.State):
+    """ Identify trades of a snapshot from an older version by the current trade identity, also in the pairs referring to them. """
+    identities = hash.trade_ids(state.trades)
+    previous = pd.Series(identities.to_numpy(), index=state.trades.index)
+    previous = previous[~previous.index.duplicated(keep='first')]
+    state.trades.index = pd.Index(identities.to_numpy(), name='ID')
+    paired = state.pairings.paired
+    for column in ['Buy Transaction', 'Sell Transaction']:
+        if column in paired.columns:
+            # Kept as objects while mapping, 64-bit identities don't survive a round trip through floats
+            mapped = paired[column].map(previous.astype(object))
+            paired[column] = mapped.where(mapped.notna(), paired[column]).infer_objects()
@@ -1,77 +1,69 @@
 import numpy as np
 import pandas as pd
-import streamlit as st
+from matchmaker import cache
 from matchmaker import hash
+from matchmaker import schema
+
+# Flags of IBKR trade codes as (code, column). A trade can have several codes separated by semicolons.
+code_flags = [('O', 'Opening'), ('C', 'Closing'), ('Ca', 'Cancelled'), ('Ex', 'Exercised'), ('Ep', 'Expired'), ('A', 'Assigned')]
+
+def add_code_flags(df: pd.DataFrame) -> pd.DataFrame:
+    """ Parse the codes of the trades into a boolean column per flag. Every distinct code is parsed once, trades without codes have no flags. """
+    codes, uniques = pd.factorize(df['Code'].fillna('') if 'Code' in df.columns else pd.Series('', index=df.index))
+    delimited = ';' + pd.Series(uniques, dtype=object).astype(str) + ';'
+    for code, column in code_flags:
+        df[column] = delimited.str.contains(f';{code};', regex=False).to_numpy(dtype=bool)[codes]
+    return df
 
 def convert_trade_columns(df: pd.DataFrame) -> pd.DataFrame:
     """ Convert columns of the trade DataFrame to appropriate data types. """
-    df['Date/Time'] = pd.to_datetime(df['Date/Time'])
-    df['Quantity'] = pd.to_numeric(df['Quantity'], errors='coerce')
-    df['Proceeds'] = pd.to_numeric(df['Proceeds'], errors='coerce').astype(np.float64)
-    df['Comm/Fee'] = pd.to_numeric(df['Comm/Fee'], errors='coerce').astype(np.float64)
-    df['Basis'] = pd.to_numeric(df['Basis'], errors='coerce').astype(np.float64)
-    df['Realized P/L'] = pd.to_numeric(df['Realized P/L'], errors='coerce').astype(np.float64)
-    df['MTM P/L'] = pd.to_numeric(df['MTM P/L'], errors='coerce').astype(np.float64)
-    df['T. Price'] = pd.to_numeric(df['T. Price'], errors='coerce').astype(np.float64)
-    df['C. Price'] = pd.to_numeric(df['C. Price'], errors='coerce').astype(np.float64)
+    # Strings become categories only once the derived columns are filled in, see State.normalize_tables
+    df = schema.enforce(df, 'trades', categorize=False)
     if 'Display Suffix' not in df.columns:
         df['Display Suffix'] = ''
     df['Display Suffix'] = df['Display Suffix'].fillna('').astype(str)
     if 'Manual' not in df.columns:
         df['Manual'] = False
-    if 'Action' not in df.columns and 'Code' in df.columns:
-        def determine_action(code):
-            actions = code.split(';')
-            if 'O' in actions or 'Ca' in actions:
-                if 'C' in actions:
-                    return 'Close/Open'
-                return 'Open'
-            elif 'C' in actions:
-                return 'Close'
-            else:
-                return 'Unknown'
-        df['Action'] = df['Code'].apply(determine_action)
     if 'Code' in df.columns:
         df['Code'] = df['Code'].fillna('')
+    add_code_flags(df)
+    if 'Action' not in df.columns and 'Code' in df.columns:
+        opening = df['Opening'] | df['Cancelled']
+        df['Action'] = np.select([opening & df['Closing'], opening, df['Closing']], ['Close/Open', 'Open', 'Close'], default='Unknown')
     if 'Option Type' not in df.columns:
         df['Option Type'] = ''
     # If action is not Transfer, then Type is Long if we're opening a position, Short if closing
-    def get_type(row):
-        if row['Quantity'] == 0:
-            return None
-        if row['Action'] == 'Transfer':
-            return 'In' if row['Quantity'] > 0 else 'Out'
-        codes = row['Code'].split(';') if 'Code' in row else []
-        if 'Ex' in codes:
-            return 'Exercised'
-        if 'Ep' in codes:
-            return 'Expired'
-        if 'A' in codes:
-            return 'Assigned'
-        if (row['Action'] == 'Close' and row['Quantity'] < 0) or (row['Action'] == 'Open' and row['Quantity'] > 0):
-            return 'Long'
-        return 'Short'
+    quantity = df['Quantity'].to_numpy()
+    action = df['Action'].to_numpy()
+    types = np.select([quantity == 0, action == 'Transfer', df['Exercised'].to_numpy(), df['Expired'].to_numpy(), df['Assigned'].to_numpy(),
+                       ((action == 'Close') & (quantity < 0)) | ((action == 'Open') & (quantity > 0))],
+                      [None, np.where(quantity > 0, 'In', 'Out').astype(object), 'Exercised', 'Expired', 'Assigned', 'Long'], default='Short')
     if 'Type' not in df.columns:
         df['Type'] = None
-    df['Type'] = df['Type'].fillna(df.apply(get_type, axis=1))
+    df['Type'] = df['Type'].fillna(pd.Series(types, index=df.index))
     return df
 
 def normalize_trades(df: pd.DataFrame) -> pd.DataFrame:
-    """ Normalize the trade DataFrame by converting columns, then adding derived columns and hashing the result as its index (used to determine import uniqueness). """
+    """ Normalize the trade DataFrame by converting columns, then adding derived columns and identifying the trades by their 64-bit hash as index (used to determine import uniqueness). """
     if not df.empty:
         df = convert_trade_columns(df)
         df['Year'] = df['Date/Time'].dt.year
-        df['Orig. Quantity'] = df['Quantity']
-        df['Orig. T. Price'] = df['T. Price']
+        # Trades saved after splits were applied keep their original values
+        if 'Orig. Quantity' not in df.columns:
+            df['Orig. Quantity'] = df['Quantity']
+        if 'Orig. T. Price' not in df.columns:
+            df['Orig. T. Price'] = df['T. Price']
+        if 'Strike' in df.columns and 'Orig. Strike' not in df.columns:
+            df['Orig. Strike'] = df['Strike']
         df['Category'] = 'Trades'
         df = df[['Category'] + [col for col in df.columns if col != 'Category']]
-    # Set up the hash column as index
-    df['Hash'] = df.apply(hash.hash_row, axis=1)
-    df.set_index('Hash', inplace=True)
+    # Set up the trade identity as index
+    df['ID'] = hash.trade_ids(df)
+    df.set_index('ID', inplace=True)
     # st.write('Imported', len(df), 'rows')
     return df
 
-@st.cache_data()
+@cache.cached
 def merge_trades(existing: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
     """ Merge two already processed DataFrames of trades, removing duplicates. """
     if existing is None:
@@ -81,33 +73,34 @@ def merge_trades(existing: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
     merged = pd.concat([existing, new])
     return merged[~merged.index.duplicated(keep='first')]
 
+def _later_splits_ratio(symbols: pd.Series, times: pd.Series, splits: pd.DataFrame) -> np.ndarray:
+    """ Product of the ratios of all splits of each symbol at or after each time, by a forward as-of join against the cumulative ratios. """
+    rows = pd.DataFrame({'Symbol': symbols.astype(object).to_numpy(), 'Date/Time': pd.to_datetime(times).astype('datetime64[ns]').to_numpy(), 'Row': np.arange(len(symbols))})
+    rows = rows[rows['Date/Time'].notna()].sort_values(by='Date/Time', kind='stable')
+    matched = pd.merge_asof(rows, splits, on='Date/Time', by='Symbol', direction='forward')
+    ratios = np.ones(len(symbols))
+    ratios[matched['Row'].to_numpy()] = matched['Cumulative Ratio'].fillna(1.0).to_numpy()
+    return ratios
+
 def add_split_data(target: pd.DataFrame, split_actions: pd.DataFrame) -> pd.DataFrame:
-    """ Compute cumulative split ratio column based on split actions."""
+    """ Compute cumulative split ratio column based on split actions. Options only take the splits of their underlying until their expiration. """
     target['Split Ratio'] = 1.0
     if split_actions is None or split_actions.empty:
         return target
 
     split_actions = split_actions[split_actions['Action'] == 'Split']
-    if not split_actions.empty:
-        # Sort split actions by date and compute cumulative ratio
-        split_actions = split_actions.sort_values(by='Date/Time', ascending=False)
-        split_actions['Cumulative Ratio'] = split_actions.groupby('Symbol')['Ratio'].cumprod()
-
-        # Merge target with split_actions to align split ratios with trades. We'll have many-to-one mapping here, to be cleaned later.
-        merged = target.reset_index().merge(split_actions, on='Symbol', suffixes=('', '_split'), how='left')
-        index_col = 'Hash' if 'Hash' in merged.columns else 'index' 
-
-        # Filter out rows where the split action date is in the future relative to the trade date
-        filtered = merged[merged['Date/Time_split'] >= merged['Date/Time']]
-
-        # Create a binding that can be used to look up the correct split ratio (one with the latest date) for each trade
-        split_lookup = filtered.groupby(index_col)['Date/Time_split'].idxmin()
-        
-        # Apply the lookup to bind to the cumulative ratio
-        target.loc[split_lookup.index, 'Split Ratio'] = 1 / filtered.loc[split_lookup, 'Cumulative Ratio'].values
-
-        # Fill NaN values with 1 (for trades with no applicable split actions)
-        target['Split Ratio'].fillna(1.0, inplace=True)
+    if not split_actions.empty and not target.empty:
+        # Sort split actions by date and compute cumulative ratio of each split and all later ones
+        splits = split_actions.sort_values(by='Date/Time', ascending=False, kind='stable')
+        splits['Cumulative Ratio'] = splits.groupby('Symbol', observed=True)['Ratio'].cumprod()
+        splits = splits[['Symbol', 'Date/Time', 'Cumulative Ratio']].astype({'Symbol': object, 'Date/Time': 'datetime64[ns]'}).sort_values(by='Date/Time', kind='stable')
+
+        ratios = _later_splits_ratio(target['Symbol'], target['Date/Time'], splits)
+        if 'Expiration' in target.columns:
+            # Splits after the end of the expiration day don't concern the option anymore
+            expiration = pd.to_datetime(target['Expiration'], format='%d%b%y', errors='coerce') + pd.Timedelta(seconds=86399)
+            ratios = ratios / _later_splits_ratio(target['Symbol'], expiration, splits)
+        target['Split Ratio'] = 1 / ratios
 
     return target
 
@@ -115,9 +108,9 @@ def compute_accumulated_positions(trades: pd.DataFrame) -> pd.DataFrame:
     """ Compute accumulated positions for each symbol by simulating all trades. Transfers are now excluded from the computation. """
     # trades = trades[trades['Action'] != 'Transfer']
     trades.sort_values(by=['Date/Time'], inplace=True)
-    trades['Accumulated Quantity'] = trades.groupby(['Ticker', 'Display Suffix'])['Quantity'].cumsum().astype(np.float64)
+    trades['Accumulated Quantity'] = trades.groupby(['Ticker', 'Display Suffix'], observed=True)['Quantity'].cumsum().astype(np.float64)
     # Now also compute accumulated quantity per account
-    trades['Account Accumulated Quantity'] = trades.groupby(['Account', 'Ticker', 'Display Suffix'])['Quantity'].cumsum().astype(np.float64)
+    trades['Account Accumulated Quantity'] = trades.groupby(['Account', 'Ticker', 'Display Suffix'], observed=True)['Quantity'].cumsum().astype(np.float64)
     return _split_open_close_transactions(trades)
 
 def _split_open_close_transactions(trades: pd.DataFrame) -> pd.DataFrame:
@@ -126,45 +119,31 @@ def _split_open_close_transactions(trades: pd.DataFrame) -> pd.DataFrame:
     close_open = close_open[close_open['Accumulated Quantity'] < close_open['Quantity']] # Filter out transactions that are not transitioning between long and short
     if close_open.empty:
         return trades
-    split_trades = pd.DataFrame()
-    for index, row in close_open.iterrows():
-        # Split each transaction into two at the point of zero accumulated quantity. The previous accumulated quantity should be negative.
-        closing_row, opening_row = _split_transaction_at_quantity(row, row['Accumulated Quantity'])
-        df = pd.DataFrame([closing_row, opening_row])
-        split_trades = pd.concat([split_trades, df])
+    # Split all transactions at once into two at the point of zero accumulated quantity. The previous accumulated quantity should be negative.
+    quantity = close_open['Quantity'].to_numpy(dtype=np.float64)
+    accumulated = close_open['Accumulated Quantity'].to_numpy(dtype=np.float64)
+    split_quantity = accumulated
+    previous = accumulated - quantity
+    fraction = split_quantity / quantity
+    closing, opening = close_open.copy(), close_open.copy()
+    closing['Quantity'] = split_quantity
+    opening['Quantity'] = quantity - split_quantity
+    closing['Accumulated Quantity'] = previous + split_quantity
+    closing['Account Accumulated Quantity'] = close_open['Account Accumulated Quantity'].to_numpy(dtype=np.float64) - quantity + split_quantity
+    closing['Action'] = np.where(split_quantity + previous <= 0, 'Close', 'Open')
+    opening['Action'] = np.where(accumulated <= 0, 'Close', 'Open')
+    for half in (closing, opening):
+        action, half_quantity = half['Action'].to_numpy(), half['Quantity'].to_numpy()
+        half['Type'] = np.where(((action == 'Close') & (half_quantity > 0)) | ((action == 'Open') & (half_quantity < 0)), 'Short', 'Long')
+    for column in ['Proceeds', 'Comm/Fee', 'Basis', 'Realized P/L', 'MTM P/L']:
+        values = close_open[column].to_numpy(dtype=np.float64)
+        closing[column] = fraction * values
+        opening[column] = (1 - fraction) * values
+    # Each closing half followed by its opening half, identified in bulk
+    split_trades = pd.concat([closing, opening]).iloc[np.arange(2 * len(close_open)).reshape(2, -1).T.ravel()]
+    split_trades.index = pd.Index(hash.trade_ids(split_trades).to_numpy(), name='ID')
     trades = trades.drop(close_open.index)
-    split_trades.set_index('Hash', inplace=True)
-    trades = pd.concat([trades, split_trades])
-    return trades
-
-def _split_transaction_at_quantity(transaction: pd.Series, quantity: float) -> tuple[pd.Series, pd.Series]:
-    """ Split a transaction into two at the given quantity. """
-    assert (transaction['Quantity'] > 0 and 0 <= quantity <= transaction['Quantity']) or (transaction['Quantity'] < 0 and transaction['Quantity'] <= quantity <= 0, "Quantity needs to be within the transaction bounds.")
-    prev_accumulated_quantity = transaction['Accumulated Quantity'] - transaction['Quantity']
-    closing_row = transaction.copy()
-    opening_row = transaction.copy()
-    closing_row['Quantity'] = quantity
-    opening_row['Quantity'] = opening_row['Quantity'] - quantity
-    closing_row['Accumulated Quantity'] = prev_accumulated_quantity + quantity
-    closing_row['Account Accumulated Quantity'] = transaction['Account Accumulated Quantity'] - transaction['Quantity'] + quantity
-    closing_row['Action'] = 'Close' if closing_row['Quantity'] + prev_accumulated_quantity <= 0 else 'Open'
-    opening_row['Action'] = 'Close' if transaction['Accumulated Quantity'] <= 0 else 'Open'
-    closing_row['Type'] = 'Short' if (closing_row['Action'] == 'Close' and closing_row['Quantity'] > 0) or (closing_row['Action'] == 'Open' and closing_row['Quantity'] < 0) else 'Long'
-    opening_row['Type'] = 'Short' if (opening_row['Action'] == 'Close' and opening_row['Quantity'] > 0) or (opening_row['Action'] == 'Open' and opening_row['Quantity'] < 0) else 'Long'
-    fraction = quantity / transaction['Quantity']
-    closing_row['Proceeds'] = fraction * transaction['Proceeds']
-    opening_row['Proceeds'] = (1 - fraction) * transaction['Proceeds']
-    closing_row['Comm/Fee'] = fraction * transaction['Comm/Fee']
-    opening_row['Comm/Fee'] = (1 - fraction) * transaction['Comm/Fee']
-    closing_row['Basis'] = fraction * transaction['Basis']
-    opening_row['Basis'] = (1 - fraction) * transaction['Basis']
-    closing_row['Realized P/L'] = fraction * transaction['Realized P/L']
-    opening_row['Realized P/L'] = (1 - fraction) * transaction['Realized P/L']
-    closing_row['MTM P/L'] = fraction * transaction['MTM P/L']
-    opening_row['MTM P/L'] = (1 - fraction) * transaction['MTM P/L']
-    closing_row['Hash'] = hash.hash_row(closing_row)
-    opening_row['Hash'] = hash.hash_row(opening_row)
-    return closing_row, opening_row
+    return pd.concat([trades, split_trades])
 
 def positions_with_missing_transactions(trades: pd.DataFrame) -> pd.DataFrame:
     """ 
@@ -190,14 +169,14 @@ def transfers_with_missing_transactions(trades: pd.DataFrame) -> tuple[pd.DataFr
     if 'Target' in trades.columns:
         incoming = transfers[transfers['Type'] == 'In']
         # Compute over outgoing account name
-        incoming_grouped = incoming.groupby(['Display Name', 'Account'])['Quantity'].sum()
-        outgoing_grouped = outgoing.groupby(['Display Name', 'Target'])['Quantity'].sum()
+        incoming_grouped = incoming.groupby(['Display Name', 'Account'], observed=True)['Quantity'].sum()
+        outgoing_grouped = outgoing.groupby(['Display Name', 'Target'], observed=True)['Quantity'].sum()
         outgoing_grouped.index = outgoing_grouped.index.set_names('Account', level=1)
         unmatched_outgoing = outgoing_grouped.add(incoming_grouped, fill_value=0)
         unmatched_outgoing = unmatched_outgoing[unmatched_outgoing < 0]
         # Do it again to persist incoming account names
-        incoming_grouped = incoming.groupby(['Display Name', 'Target'])['Quantity'].sum()
-        outgoing_grouped = outgoing.groupby(['Display Name', 'Account'])['Quantity'].sum()
+        incoming_grouped = incoming.groupby(['Display Name', 'Target'], observed=True)['Quantity'].sum()
+        outgoing_grouped = outgoing.groupby(['Display Name', 'Account'], observed=True)['Quantity'].sum()
         outgoing_grouped.index = outgoing_grouped.index.set_names('Target', level=1)
         unmatched_incoming = incoming_grouped.add(outgoing_grouped, fill_value=0)
         unmatched_incoming = unmatched_incoming[unmatched_incoming > 0]
@@ -214,4 +193,12 @@ def adjust_for_splits(trades: pd.DataFrame, split_actions: pd.DataFrame) -> pd.D
         add_split_data(trades, split_actions)
         trades['Quantity'] = trades['Orig. Quantity'] * trades['Split Ratio']
         trades['T. Price'] = trades['Orig. T. Price'] / trades['Split Ratio']
+        if 'Strike' in trades.columns:
+            # Options of a split underlying get more contracts at a lower strike, named by the adjusted strike
+            trades['Orig. Strike'] = trades['Orig. Strike'].fillna(trades['Strike']) if 'Orig. Strike' in trades.columns else trades['Strike']
+            options = trades['Orig. Strike'].notna() & trades['Expiration'].notna()
+            # All strikes are formatted alike, as they can come back from a snapshot as numbers
+            strikes = pd.to_numeric(trades.loc[options, 'Orig. Strike'], errors='coerce') / trades.loc[options, 'Split Ratio']
+            trades.loc[options, 'Strike'] = strikes.map('{:.10g}'.format).where(strikes.notna(), trades.loc[options, 'Orig. Strike'].astype(str))
+            trades.loc[options, 'Display Suffix'] = ' ' + trades.loc[options, 'Expiration'].astype(str) + ' ' + trades.loc[options, 'Strike'].astype(str) + ' ' + trades.loc[options, 'Option Type'].astype(str)
     return trades
\ No newline at end of file
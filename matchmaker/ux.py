@@ -2,6 +2,7 @@ import pandas as pd
 import streamlit as st
 import matchmaker.trade as trade
 import matchmaker.data as data
+import matchmaker.cache as cache
 from streamlit_pills import pills
 
 def transaction_table_descriptor_czk():
@@ -65,7 +66,7 @@ def add_trades_editor(state : data.State, selected_trade, key=None, callback=Non
         st.caption('Zde můžete přidat chybějící nákup(y) k prodeji')
         # Create a dataframe representing the new trade
         def create_dataframe(trades, symbol, date, quantity, price, target):
-            currency = state.symbols[state.symbols['Ticker'] == symbol]['Currency'].values[-1]
+            currency = state.currency_of(symbol)
             return pd.DataFrame({'Symbol': [symbol], 'Currency': currency, 'Date/Time': [pd.to_datetime(date)], 'Quantity': [quantity], 
                         'T. Price': [price], 'C. Price': [price], 'Action': ['Open'], 'Type': ['Long'], 'Account': [selected_trade['Account']],
                         'Proceeds': [-quantity*price], 'Target': [target], 'Comm/Fee': [0], 'Basis': [0], 'Realized P/L': [0], 'MTM P/L': [0]})
@@ -116,4 +117,12 @@ def add_years_filter(trades, show_all=True, title='Vyberte si rok'):
     extra = ['All'] if show_all else []
     year_str = pills(title, extra + [str(year) for year in years])
     year = int(year_str) if year_str != 'All' else None
-    return year
\ No newline at end of file
+    return year
+
+def add_cache_statistics():
+    """ Debug panel with hit and miss counts of the result cache. """
+    with st.sidebar.expander('Cache'):
+        st.caption(f'Obsazeno :blue[{cache.results.memory_used / 2**20:.1f}] z {cache.results.memory_limit / 2**20:.0f} MB')
+        st.dataframe(cache.results.statistics(), hide_index=True, column_config={'Memory [MB]': st.column_config.NumberColumn(format="%.2f")})
+        if st.button('Vyprázdnit cache'):
+            cache.results.clear()
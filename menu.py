@@ -1,4 +1,6 @@
 import streamlit as st
+import matchmaker.data as data
+import matchmaker.ux as ux
 
 
 def unauthenticated_menu():
@@ -11,9 +13,16 @@ def unauthenticated_menu():
     st.sidebar.page_link("pages/5_positions.py", label="Přehled otevřených pozic", icon="📋")
     st.sidebar.page_link("pages/6_save_state.py", label="Uložení stavu", icon="💾")
 
+def debug_menu():
+    # Show internal statistics in the sidebar when enabled in settings
+    data.load_settings()
+    if st.session_state['settings'].get('debug_panel', False):
+        ux.add_cache_statistics()
+
 def menu():
     # Determine if a user is logged in or not, then show the correct
     # navigation menu
+    debug_menu()
     if "role" not in st.session_state or st.session_state.role is None:
         unauthenticated_menu()
         return
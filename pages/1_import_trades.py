@@ -71,15 +71,21 @@ def main():
     loaded_count = 0
     # On upload, run import trades
     if uploaded_files:
-        for uploaded_file in uploaded_files:
-            import_state.write('Importuji transakce...')
-            imported = imports.import_trade_file(uploaded_file)
-            import_state.write(f'Slučuji :blue[{len(imported.trades)}] obchodů...')
-            loaded_count += state.merge_with(imported, loaded_count > 0)
-            import_message = f'Importováno :green[{len(state.trades) - trades_count}] obchodů.'
-            import_state.write(import_message)
-        state.actions.drop_duplicates(inplace=True)
-        state.imports = imports.merge_import_intervals(state.imports)
+        import_state.write('Importuji transakce...')
+        import_progress = st.progress(0.0)
+        imported_files = []
+        def show_progress(name, error):
+            imported_files.append(name)
+            import_progress.progress(len(imported_files) / len(uploaded_files), text=f'Importováno {len(imported_files)} z {len(uploaded_files)} souborů ({name})')
+        results = imports.import_trade_files(uploaded_files, st.session_state['settings'].get('import_workers', 1), show_progress)
+        import_progress.empty()
+        for imported, error in results:
+            if error is not None:
+                st.error(error)
+        imported = [imported for imported, _ in results if imported is not None]
+        import_state.write(f'Slučuji :blue[{sum(len(imported_state.trades) for imported_state in imported)}] obchodů...')
+        loaded_count = imports.merge_imported_states(state, imported)
+        import_state.write(f'Importováno :green[{len(state.trades) - trades_count}] obchodů.')
 
     if loaded_count > 0:
         import_state.write(f'Nalezeno :blue[{loaded_count}] obchodů, z nichž :green[{len(state.trades) - trades_count}] je nových.')
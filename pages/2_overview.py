@@ -26,7 +26,12 @@ else:
 if state.trades is not None and not state.trades.empty:    
     daily_rates = currency.load_daily_rates(st.session_state['settings']['currency_rates_dir'])
     yearly_rates = currency.load_yearly_rates(st.session_state['settings']['currency_rates_dir'])
-    trades = currency.add_czk_conversion_to_trades(state.trades, daily_rates, use_yearly_rates=False)
+    # Convert the trades again only if they changed since the last conversion
+    converted = st.session_state.get('overview_trades')
+    if converted is None or not state.unchanged_since(converted[0], 'trades'):
+        converted = (state.generation, currency.add_czk_conversion_to_trades(state.trades, daily_rates, use_yearly_rates=False))
+        st.session_state.update(overview_trades=converted)
+    trades = converted[1]
     year=ux.add_years_filter(trades)
     st.session_state.update(year=year)
     st.caption(f'Vysvětlivky k jednotlivým sloupcům jsou k dispozici na najetí myší.')
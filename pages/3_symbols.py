@@ -69,10 +69,8 @@ if state.trades is not None and not state.trades.empty:
                 edited_trades['Orig. Quantity'] = edited_trades['Quantity']
                 edited_trades['Orig. T. Price'] = edited_trades['T. Price']
                 edited_trades['Split Ratio'] = 1.0
-                state.trades.update(edited_trades)
-                trades_to_drop = edited_trades[edited_trades['Quantity'] == 0].index
-                state.trades.drop(trades_to_drop, inplace=True)
-                state.recompute_positions()
+                state.edit_trades(edited_trades)
+                state.recompute_positions(edited_trades['Symbol'])
                 state.save_session()
                 st.session_state['changes_made'] = False
                 st.rerun()
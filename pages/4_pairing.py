@@ -7,6 +7,8 @@ import matchmaker.ux as ux
 import matchmaker.trade as trade
 import matchmaker.styling as styling
 import matchmaker.pairing as pairing
+import matchmaker.lots as lots
+import matchmaker.planner as planner
 from menu import menu
 import copy
 
@@ -25,11 +27,11 @@ def page():
         
     st.caption(str(len(state.trades)) + ' obchodů k dispozici.')
     # Matching configuration is a dictionary[year] of:
-    #  strategy: FIFO, LIFO, AverageCost, MaxLoss, MaxProfit
+    #  strategy: FIFO, LIFO, AverageCost, MaxLoss, MaxProfit, Optimal
     #  use_yearly_rates: bool
     trades = state.trades[(state.trades['Action'] == 'Open') | (state.trades['Action'] == 'Close')] # Filter out transfers and other transactions
     closing_trades = trades[trades['Action'] == 'Close']
-    strategies = pairing.Pairings.get_strategies()[1:]
+    strategies = pairing.Pairings.get_strategies(trades)[1:]
     
     if closing_trades.empty:
         st.caption('Nebyly nalezeny žádné uzavřené obchody. Pro párování je třeba mít alespoň jeden uzavřený obchod.')
@@ -43,14 +45,56 @@ def page():
     state.pairings.populate_choices(trades)
     
     choice = copy.deepcopy(state.pairings.config[show_year])
-    if (choice.pair_strategy == 'None'):
+    if choice.pair_strategy not in strategies:
         choice.pair_strategy = 'FIFO'
+    if 'Optimal' not in strategies:
+        st.caption(f'Strategie Optimal není k dispozici, některý symbol má přes {lots.OPTIMAL_MAX_STRETCH} obchodů bez uzavření celé pozice.')
     choice.pair_strategy = pills('Strategie párování', strategies, index=strategies.index(choice.pair_strategy), key=f'strategy_{show_year}')
     choice.conversion_rates = 'Yearly' if pills(f'Použíté kurzy', ['roční', 'denní'], index=0 if choice.conversion_rates == 'Yearly' else 1, key=f'yearly_rates_{show_year}') == 'roční' else 'Daily'
     
     st.caption(f'Strategie pro rok {show_year}: {choice.pair_strategy} | {"roční" if choice.conversion_rates == 'Yearly' else "denní"} kurzy')
     
-    state.pairings.populate_pairings(trades, show_year, choice)
+    workers = st.session_state['settings'].get('pairing_workers', 1)
+    with st.expander(f'Porovnání strategií pro rok {show_year}'):
+        if choice.conversion_rates == 'Yearly':
+            rates = currency.load_yearly_rates(st.session_state['settings']['currency_rates_dir'])
+        else:
+            rates = currency.load_daily_rates(st.session_state['settings']['currency_rates_dir'])
+        # The expander body runs even when collapsed, so the strategies are paired only once asked for
+        if st.toggle('Porovnat strategie', key=f'compare_strategies_{show_year}'):
+            compared = strategies if 'Optimal' in strategies and st.checkbox('Včetně strategie Optimal', help='Optimální párování může u tisíců obchodů jednoho symbolu trvat několik sekund.') else pairing.Pairings.compared_strategies
+            earlier_pairs = pairing.pairs_before(state.pairings.paired, show_year)
+            comparison = pairing.compare_strategies(trades, earlier_pairs, show_year, rates, choice.conversion_rates == 'Yearly', compared, workers)
+            st.dataframe(comparison[comparison['Year'] == show_year], hide_index=True,
+                         column_order=('Strategy', 'Taxable Revenue', 'Exempt Revenue', 'Unpaired Quantity'),
+                         column_config={
+                             'Strategy': st.column_config.TextColumn("Strategie", help="Strategie párování použitá od zvoleného roku"),
+                             'Taxable Revenue': st.column_config.NumberColumn("Danitelný výdělek v CZK", help="Výdělek z prodejů, které nesplňují časový test", format="%.0f"),
+                             'Exempt Revenue': st.column_config.NumberColumn("Osvobozeno v CZK", help="Výdělek z prodejů osvobozených časovým testem", format="%.0f"),
+                             'Unpaired Quantity': st.column_config.NumberColumn("Nenapárováno", help="Počet kusů prodejů, ke kterým nebyl nalezen nákup", format="%.2f"),
+                         })
+        if st.button('Naplánovat strategie všech let', help='Vybere pro každý rok strategii tak, aby byla daň za všechny roky dohromady co nejnižší.'):
+            strategy_planner = planner.StrategyPlanner(trades, state.pairings.paired, years[0], rates, choice.conversion_rates == 'Yearly', strategies)
+            total_tax, plan = strategy_planner.plan()
+            state.pairings.apply_plan(strategy_planner, plan, choice.conversion_rates)
+            state.save_session()
+            st.session_state.update(strategy_plan=strategy_planner.summary(plan))
+            # Let the strategy pills pick up the planned strategies
+            for year in years:
+                st.session_state.pop(f'strategy_{year}', None)
+            st.rerun()
+        if 'strategy_plan' in st.session_state:
+            st.caption(f'Plán strategií s daní :blue[{st.session_state.strategy_plan["Tax"].sum():,.0f}] Kč za všechny roky')
+            st.dataframe(st.session_state.strategy_plan, hide_index=True,
+                         column_config={
+                             'Year': st.column_config.NumberColumn("Rok", format="%d"),
+                             'Strategy': st.column_config.TextColumn("Strategie"),
+                             'Taxable Revenue': st.column_config.NumberColumn("Danitelný výdělek v CZK", format="%.0f"),
+                             'Exempt Revenue': st.column_config.NumberColumn("Osvobozeno v CZK", format="%.0f"),
+                             'Tax': st.column_config.NumberColumn("Daň v CZK", format="%.0f"),
+                         })
+
+    state.pairings.populate_pairings(trades, show_year, choice, workers)
     state.save_session()
 
     st.session_state.update(show_year=show_year)
@@ -90,7 +90,7 @@ if state.trades is not None and not state.trades.empty:
                     state.symbols.loc[row['Symbol'], 'Manual'] = True
             st.success("Aplikuji změny, prosím o strpení.")
             st.session_state['rename_changes_made'] = False
-            state.recompute_positions()
+            state.recompute_positions(guessed_renames[guessed_renames['Apply']]['Symbol'])
             state.save_session()
             st.rerun()
 
@@ -0,0 +1,17 @@
+import os
+import sys
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+import matchmaker
+
+
+@pytest.fixture(autouse=True, scope='session')
+def settings():
+    """ Settings of the repository with its data directories, without the statement cache. """
+    matchmaker.load_settings(os.path.join(root, 'settings.json'))
+    for key in ['currency_rates_dir', 'rename_history_dir']:
+        matchmaker.settings[key] = os.path.join(root, matchmaker.settings[key])
+    matchmaker.settings['statement_cache_dir'] = ''
+    return matchmaker.settings
@@ -0,0 +1,53 @@
+""" Small IBKR activity statements for the tests. """
+import io
+
+mark_to_market_header = ('Mark-to-Market Performance Summary,Header,Asset Category,Symbol,Prior Quantity,Current Quantity,Prior Price,Current Price,'
+                         'Mark-to-Market P/L Position,Mark-to-Market P/L Transaction,Mark-to-Market P/L Commissions,Mark-to-Market P/L Other,Mark-to-Market P/L Total,Code')
+
+trades_header = 'Trades,Header,DataDiscriminator,Asset Category,Currency,Symbol,Date/Time,Quantity,T. Price,C. Price,Proceeds,Comm/Fee,Basis,Realized P/L,MTM P/L,Code'
+
+def statement(trades: list[str], actions: list[str] = (), positions: list[str] = (), period: str = 'January 1, 2020 - December 31, 2020',
+              trades_header: str = trades_header) -> io.BytesIO:
+    """ Activity statement of account U1234567 with the given rows of the trades, corporate actions and mark-to-market sections. """
+    lines = ['Statement,Header,Field Name,Field Value', 'Statement,Data,Title,Activity Statement', f'Statement,Data,Period,"{period}"',
+             'Account Information,Header,Field Name,Field Value', 'Account Information,Data,Account,U1234567',
+             mark_to_market_header, *[f'Mark-to-Market Performance Summary,Data,Stocks,{row}' for row in positions],
+             trades_header,
+             *[f'Trades,Data,Order,{row}' for row in trades],
+             'Corporate Actions,Header,Asset Category,Currency,Report Date,Date/Time,Description,Quantity,Proceeds,Value,Realized P/L,Code',
+             *[f'Corporate Actions,Data,Stocks,{row}' for row in actions]]
+    file = io.BytesIO(('\n'.join(lines) + '\n').encode('utf-8'))
+    file.name = 'U1234567.csv'
+    return file
+
+# AAPL bought before its 4 for 1 split in 2020, a put expiring before the split and a call written before the split and bought back after it
+split_options = statement(
+    trades=['Stocks,USD,AAPL,"2020-03-02, 10:00:00",100,300,300,-30000,-1,30001,0,0,O',
+            'Equity and Index Options,USD,AAPL 17JUL20 250 P,"2020-06-01, 10:00:00",-1,5,5,500,-1,-499,0,0,O',
+            'Equity and Index Options,USD,AAPL 17JUL20 250 P,"2020-07-10, 10:00:00",1,2,2,-200,-1,201,0,0,C',
+            'Equity and Index Options,USD,AAPL 18DEC20 400 C,"2020-08-03, 10:00:00",-1,20,20,2000,-1,-1999,0,0,O',
+            'Equity and Index Options,USD,AAPL 18DEC20 100 C,"2020-10-01, 10:00:00",3,4,4,-1200,-1,1201,0,0,C'],
+    actions=['USD,2020-08-28,"2020-08-28, 20:25:00",AAPL(US0378331005) Split 4 for 1 (AAPL APPLE INC US0378331005),300,0,0,0,'],
+    positions=['AAPL,0,400,300,120,1,1,1,1,1,'])
+
+# Options of 2020 that were assigned, exercised or expired, with the stock they delivered, and a short sale of stock bought back later
+option_outcomes = statement(
+    trades=['Equity and Index Options,USD,AAPL 20NOV20 100 P,"2020-10-01, 10:00:00",-1,3,3,300,-1,-299,0,0,O',
+            'Equity and Index Options,USD,AAPL 20NOV20 100 P,"2020-11-20, 16:20:00",1,0,0,0,0,299,0,0,A;C',
+            'Stocks,USD,AAPL,"2020-11-20, 16:20:00",100,100,100,-10000,0,10000,0,0,A;O',
+            'Stocks,USD,AAPL,"2020-12-01, 10:00:00",-100,120,120,12000,-1,-10001,1999,0,C',
+            'Equity and Index Options,USD,MSFT 20NOV20 200 C,"2020-10-01, 10:00:00",1,5,5,-500,-1,501,0,0,O',
+            'Equity and Index Options,USD,MSFT 20NOV20 200 C,"2020-11-20, 16:20:00",-1,0,0,0,0,-501,0,0,Ex;C',
+            'Stocks,USD,MSFT,"2020-11-20, 16:20:00",100,200,200,-20000,0,20000,0,0,Ex;O',
+            'Stocks,USD,MSFT,"2020-12-01, 10:00:00",-50,210,210,10500,-1,-10001,499,0,C',
+            'Equity and Index Options,USD,TSLA 20NOV20 300 P,"2020-10-01, 10:00:00",1,4,4,-400,-1,401,0,0,O',
+            'Equity and Index Options,USD,TSLA 20NOV20 300 P,"2020-11-20, 16:20:00",-1,0,0,0,0,-401,-401,0,Ep;C',
+            'Stocks,USD,TSLA,"2020-06-01, 10:00:00",-10,200,200,2000,-1,-1999,0,0,O',
+            'Stocks,USD,TSLA,"2020-09-01, 10:00:00",10,150,150,-1500,-1,1501,499,0,C'],
+    positions=['MSFT,0,50,200,210,1,1,1,1,1,'])
+
+# Consolidated statement with the same fill in two sub-accounts
+consolidated_fills = statement(
+    trades=['Stocks,USD,U1234567,AAPL,"2020-03-02, 10:00:00",10,300,300,-3000,-1,3001,0,0,O',
+            'Stocks,USD,U7654321,AAPL,"2020-03-02, 10:00:00",10,300,300,-3000,-1,3001,0,0,O'],
+    trades_header=trades_header.replace('Currency,Symbol', 'Currency,Account,Symbol'))
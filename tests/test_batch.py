@@ -0,0 +1,33 @@
+import argparse
+import io
+import matchmaker
+from matchmaker import batch
+from matchmaker import ibkr
+from matchmaker import pairing
+from matchmaker import snapshot
+from tests import statements
+
+
+def options(**values) -> batch.Options:
+    args = dict(import_trades_dir=None, strategy='fifo', process_years=None, preserve_years=None, load_trades=None, save_trades=None,
+                load_matched_trades=None, save_matched_trades=None, save_trade_overview_dir=None, rates='yearly', workers=1)
+    args.update(values)
+    return batch.Options(argparse.Namespace(**args), {})
+
+def test_snapshot_keeps_pairings_when_statements_are_added(tmp_path):
+    statements.option_outcomes.seek(0)
+    state = ibkr.import_activity_statement(statements.option_outcomes)
+    state.recompute_positions()
+    trades = state.trades[state.trades['Action'].isin(['Open', 'Close'])]
+    state.pairings.paired, state.pairings.unpaired = pairing.pair_buy_sell(trades, None, 'FIFO')
+    state.pairings.config = {2020: pairing.Pairings.Choices('FIFO', 'Yearly')}
+    loaded_path, saved_path, statement_path = tmp_path / 'loaded.csv', tmp_path / 'saved.csv', tmp_path / 'statement.csv'
+    loaded_path.write_text(snapshot.save_snapshot(state), encoding='utf-8')
+    statement_path.write_bytes(statements.split_options.getvalue())
+
+    batch.process_account('U1234567', [str(statement_path)], options(load_trades=str(loaded_path), save_trades=str(saved_path)), dict(matchmaker.settings))
+    saved = snapshot.load_snapshot(io.BytesIO(saved_path.read_bytes()))
+    assert {year: choices.get_state() for year, choices in saved.pairings.config.items()} == {2020: ('FIFO', 'Yearly')}
+    assert len(saved.pairings.paired) == len(state.pairings.paired)
+    assert saved.trades.index.isin(state.trades.index).sum() == len(state.trades)
+    assert len(saved.trades) > len(state.trades)
@@ -0,0 +1,33 @@
+from matchmaker import data
+from matchmaker import ibkr
+from tests import statements
+
+
+def renamed_state() -> data.State:
+    file = statements.statement(
+        trades=['Stocks,USD,FB,"2021-03-02, 10:00:00",10,250,250,-2500,-1,2501,0,0,O',
+                'Stocks,EUR,SAP,"2021-03-02, 11:00:00",5,100,100,-500,-1,501,0,0,O'],
+        period='January 1, 2021 - December 31, 2021')
+    state = data.State()
+    state.merge_with(ibkr.import_activity_statement(file))
+    state.recompute_positions()
+    return state
+
+def test_currency_of_renamed_ticker():
+    state = renamed_state()
+    assert state.trades.loc[state.trades['Symbol'] == 'FB', 'Ticker'].tolist() == ['META']
+    assert state.currency_of('FB') == 'USD'
+    assert state.currency_of('META') == 'USD'
+    assert state.currency_of('SAP') == 'EUR'
+    assert state.currency_of('UNKNOWN') is None
+
+def test_currencies_kept_in_session():
+    import streamlit as st
+    state = renamed_state()
+    state.symbol_currencies()
+    state.save_session()
+    loaded = data.State()
+    loaded.load_session()
+    assert loaded.currencies_generation == state.currencies_generation
+    assert loaded.symbol_currencies() is state.currencies
+    st.session_state.clear()
@@ -0,0 +1,14 @@
+from matchmaker import data
+from matchmaker import ibkr
+from tests import statements
+
+
+def test_same_fill_in_two_accounts_stays_two_trades():
+    statements.consolidated_fills.seek(0)
+    imported = ibkr.import_activity_statement(statements.consolidated_fills)
+    assert sorted(imported.trades['Account']) == ['U1234567', 'U7654321']
+    assert imported.trades.index.is_unique
+
+    state = data.State()
+    assert state.merge_with(imported) == 2
+    assert len(state.trades) == 2
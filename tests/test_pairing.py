@@ -0,0 +1,94 @@
+import io
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.pairing_strategies import generate_trades
+from matchmaker import ibkr
+from matchmaker import lots
+from matchmaker import pairing
+from matchmaker import snapshot
+from tests import statements
+
+
+def fill_trades_covered_quantity_by_rows(trades, sell_buy_pairs):
+    """ The former row by row reconstruction of the covered quantities, kept as the reference. """
+    def is_short_trade(row):
+        def is_quantity_opposite_of_action(row : pd.Series):
+            return (row['Quantity'] > 0 and row['Action'] == 'Close') or (row['Quantity'] < 0 and row['Action'] == 'Open')
+        if row['Type'] == 'Short':
+            return True
+        if row['Type'] == 'Assigned' and (not pd.isna(row['Option Type'] or is_quantity_opposite_of_action(row))):
+            return True
+        if row['Type'] == 'Exercised' and pd.isna(row['Option Type']) and is_quantity_opposite_of_action(row):
+            return True
+        if row['Type'] == 'Expired' and row['Quantity'] > 0:
+            return True
+        return False
+    trades['Covered Quantity'] = 0.0
+    trades['Uncovered Quantity'] = trades.apply(lambda row: row['Quantity'] if not is_short_trade(row) else -row['Quantity'], axis=1)
+    if sell_buy_pairs is not None:
+        for index, row in sell_buy_pairs.iterrows():
+            trades.loc[row['Buy Transaction'], 'Covered Quantity'] += row['Quantity']
+            trades.loc[row['Buy Transaction'], 'Uncovered Quantity'] -= row['Quantity']
+            trades.loc[row['Sell Transaction'], 'Covered Quantity'] += row['Quantity']
+            trades.loc[row['Sell Transaction'], 'Uncovered Quantity'] += row['Quantity']
+    return trades
+
+def assert_same_quantities(trades, pairs):
+    columns = ['Covered Quantity', 'Uncovered Quantity']
+    expected = fill_trades_covered_quantity_by_rows(trades.copy(), pairs)[columns].astype(float)
+    actual = pairing.fill_trades_covered_quantity(trades.copy(), pairs)[columns].astype(float)
+    pd.testing.assert_frame_equal(actual, expected)
+
+@pytest.fixture
+def loaded_state():
+    """ Paired option outcomes, read back from a snapshot. """
+    file = statements.option_outcomes
+    file.seek(0)
+    state = ibkr.import_activity_statement(file)
+    state.recompute_positions()
+    loaded = snapshot.load_snapshot(io.BytesIO(snapshot.save_snapshot(state).encode('utf-8')))
+    loaded.recompute_positions()
+    return loaded
+
+def test_covered_quantities_match_rows_on_snapshot(loaded_state):
+    trades = loaded_state.trades
+    pairs, _ = pairing.pair_buy_sell(trades, None, 'FIFO')
+    assert len(pairs) == 6
+    assert_same_quantities(trades, pairs)
+    assert_same_quantities(trades, pairs[pairs['Display Name'].str.startswith('AAPL')])
+    assert_same_quantities(trades, None)
+
+@pytest.mark.parametrize('option_type', [None, np.nan, '', 'Put'])
+def test_short_trades_match_rows_for_missing_option_types(loaded_state, option_type):
+    trades = loaded_state.trades.copy()
+    trades['Option Type'] = trades['Option Type'].astype(object)
+    # Stock delivered by the assigned put and by the exercised call
+    delivered = trades['Type'].isin(['Assigned', 'Exercised']) & trades['Expiration'].isna()
+    assert delivered.sum() == 2
+    trades.loc[delivered, 'Option Type'] = option_type
+    assert_same_quantities(trades, None)
+
+def test_strategies_compared_with_earlier_pairs_only(loaded_state):
+    trades = loaded_state.trades
+    pairs, _ = pairing.pair_buy_sell(trades, None, 'FIFO')
+    rates = pd.DataFrame({'USD': [22.0]}, index=pd.Index([2020], name='Year'))
+    comparison = pairing.compare_strategies(trades, pairs, 2020, rates, True)
+    assert sorted(comparison['Strategy'].unique()) == sorted(pairing.Pairings.compared_strategies)
+    earlier = pairing.compare_strategies(trades, pairing.pairs_before(pairs, 2020), 2020, rates, True)
+    pd.testing.assert_frame_equal(earlier, comparison)
+
+def test_optimal_pairs_least_taxable_revenue():
+    trades = generate_trades(600, 0.0)
+    assert lots.longest_open_stretch(trades) <= lots.OPTIMAL_MAX_STRETCH
+    taxable = {}
+    for strategy in pairing.Pairings.strategies[1:]:
+        pairs = lots.pair_trades(trades.copy(), strategy)
+        taxable[strategy] = (pairs['Proceeds'] + pairs['Cost'])[pairs['Taxable'] == 1].sum()
+    assert taxable['Optimal'] <= min(taxable.values()) + 1e-6
+
+def test_longest_open_stretch():
+    trades = pd.DataFrame({'Display Name': ['A', 'B', 'A', 'A', 'B', 'A'], 'Date/Time': pd.date_range('2020-01-01', periods=6), 'Quantity': [5, 1, -5, 2, 1, -1]})
+    assert lots.longest_open_stretch(trades) == 2
+    assert lots.longest_open_stretch(trades[trades['Display Name'] == 'B']) == 2
+    assert pairing.Pairings.get_strategies(trades)[-1] == 'Optimal'
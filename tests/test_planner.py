@@ -0,0 +1,23 @@
+import pandas as pd
+from benchmarks.pairing_strategies import generate_trades
+from matchmaker import pairing
+from matchmaker import planner
+
+
+def pair_keys(pairs: pd.DataFrame) -> pd.DataFrame:
+    return pairs[['Sell Transaction', 'Buy Transaction', 'Quantity']].sort_values(by=['Sell Transaction', 'Buy Transaction']).reset_index(drop=True)
+
+def test_plan_pairs_like_its_strategies():
+    trades = pd.concat([generate_trades(800, 0.03, seed).assign(**{'Display Name': f'S{seed}'}) for seed in range(2)], ignore_index=True)
+    # The second symbol stops selling a year earlier
+    trades = trades[(trades['Display Name'] == 'S0') | (trades['Year'] < trades['Year'].max())]
+    rates = pd.DataFrame({'USD': 22.0}, index=pd.Index(range(2010, 2020), name='Year'))
+    strategy_planner = planner.StrategyPlanner(trades, None, trades['Year'].min(), rates, strategies=['FIFO', 'LIFO', 'MaxLoss'])
+    tax, plan = strategy_planner.plan()
+    assert [result.year for result in plan] == strategy_planner.years
+    assert len(strategy_planner.state_positions[-1]) < len(strategy_planner.state_positions[0])
+
+    paired, unpaired = strategy_planner.pairings(plan)
+    expected, expected_unpaired = pairing.pair_years(trades, None, {result.year: result.strategy for result in plan})
+    pd.testing.assert_frame_equal(pair_keys(paired), pair_keys(expected))
+    pd.testing.assert_frame_equal(unpaired[['Uncovered Quantity', 'Covered Quantity']], expected_unpaired[['Uncovered Quantity', 'Covered Quantity']])
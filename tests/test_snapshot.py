@@ -0,0 +1,35 @@
+import io
+from matchmaker import hash
+from matchmaker import ibkr
+from matchmaker import snapshot
+from tests import statements
+
+
+def imported_state(file: io.BytesIO):
+    file.seek(0)
+    state = ibkr.import_activity_statement(file)
+    state.recompute_positions()
+    return state
+
+def test_split_options_survive_round_trip():
+    state = imported_state(statements.split_options)
+    columns = ['Display Name', 'Date/Time', 'Quantity', 'Strike', 'Accumulated Quantity']
+    before = state.trades[columns].astype({'Display Name': object}).sort_index()
+    assert sorted(before['Display Name'].unique()) == ['AAPL', 'AAPL 17JUL20 250 Put', 'AAPL 18DEC20 100 Call']
+
+    loaded = snapshot.load_snapshot(io.BytesIO(snapshot.save_snapshot(state).encode('utf-8')))
+    loaded.recompute_positions()
+    after = loaded.trades[columns].astype({'Display Name': object}).sort_index()
+    assert after.equals(before)
+    # The call written before the split stays a single position with its closing trade
+    call = after[after['Display Name'] == 'AAPL 18DEC20 100 Call'].sort_values(by='Date/Time')
+    assert call['Accumulated Quantity'].tolist() == [-4.0, -1.0]
+
+def test_older_snapshot_keeps_trades_of_both_accounts():
+    state = imported_state(statements.consolidated_fills)
+    saved = snapshot.save_snapshot(state)
+    version = f'Version\n{hash.HASH_VERSION}\n'
+    assert version in saved
+    loaded = snapshot.load_snapshot(io.BytesIO(saved.replace(version, f'Version\n{hash.HASH_VERSION - 1}\n').encode('utf-8')))
+    assert loaded.trades.index.is_unique
+    assert sorted(loaded.trades.index) == sorted(state.trades.index)